@@ -0,0 +1,317 @@
+"""
+Memory- and CPU-aware admission of documents.
+
+Before a document is processed its cost is estimated from its page count
+and page dimensions: an evenly spaced sample of at most ESTIMATE_SAMPLE_PAGES
+pages is triaged, and the regions that would be rendered for OCR are
+measured at the highest resolution rasterize may choose. From that:
+
+    memory   the document itself, the rendered frames the pipeline can hold
+             at once (the queue between rendering and OCR plus the pages in
+             flight to the OCR workers), and what is kept for every page
+             until the result is built
+    cpu      OCR seconds for the rendered megapixels, plus a little per page
+
+The estimate covers what the document adds to this process; the OCR
+workers' own memory (the models) is shared by every document and is not
+part of it.
+
+An AdmissionController holds the budgets and the costs of the documents
+being processed. A document is admitted while the costs admitted so far
+plus its own fit in both budgets; one that does not fit waits for others to
+finish (policy "queue") or is turned away (policy "reject"). A document
+whose memory alone is over the budget is always turned away. The CPU
+budget only spreads work out: a document over it on its own still runs,
+once nothing else does.
+
+A document that cannot be opened as a PDF raises InvalidDocument from
+estimate, before any budget is touched.
+
+    REDACTOR_MEMORY_BUDGET_MB     memory admitted at once (default: half the
+                                  physical memory, 0 = no limit)
+    REDACTOR_CPU_BUDGET_S         estimated CPU seconds admitted at once (default 0 = no limit)
+    REDACTOR_ADMISSION            queue or reject (default queue)
+    REDACTOR_OCR_CPU_S_PER_MP     OCR CPU seconds per rendered megapixel (default 1.0)
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import fitz  # PyMuPDF
+
+from ocr_engine import default_workers
+from pipeline import DEFAULT_QUEUE_SIZE, OCR_PAGES_IN_FLIGHT_PER_WORKER
+from rasterize import FIXED_DPI, MAX_DPI, MAX_PIXELS
+from triage import open_pdf, triage_page
+
+POLICY_QUEUE = "queue"
+POLICY_REJECT = "reject"
+POLICIES = (POLICY_QUEUE, POLICY_REJECT)
+
+MB = 1024 * 1024
+
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return 0  # Not available on this platform: no limit
+
+
+MEMORY_BUDGET = (
+    int(float(os.environ["REDACTOR_MEMORY_BUDGET_MB"]) * MB) if os.environ.get("REDACTOR_MEMORY_BUDGET_MB")
+    else _physical_memory() // 2
+)
+CPU_BUDGET = float(os.environ.get("REDACTOR_CPU_BUDGET_S", "0"))
+ADMISSION_POLICY = os.environ.get("REDACTOR_ADMISSION", POLICY_QUEUE)
+OCR_CPU_SECONDS_PER_MEGAPIXEL = float(os.environ.get("REDACTOR_OCR_CPU_S_PER_MP", "1.0"))
+
+# Pages triaged and measured to estimate a document, the rest are extrapolated
+ESTIMATE_SAMPLE_PAGES = 32
+# CPU seconds of a page that is not OCR'd: text layer, redaction and writing
+TEXT_CPU_SECONDS_PER_PAGE = 0.01
+# Bytes held per byte of a document given in memory: the bytes and MuPDF's parsed objects
+DOCUMENT_OVERHEAD = 2
+# Bytes held per pixel of a frame in flight: the grayscale pixmap and the copy sent to a worker
+FRAME_OVERHEAD = 3
+# Bytes kept per page until the result is built: text, words, OCR boxes, matches, export buffers
+RETAINED_BYTES_PER_PAGE = 64 * 1024
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+class AdmissionRejected(Exception):
+    """Raised when a document does not fit the budgets and is not allowed to wait."""
+
+
+class InvalidDocument(Exception):
+    """Raised when a document cannot be opened as a PDF."""
+
+
+def _render_pixels(rect):
+    """Pixels of a region rendered at the highest resolution rasterize uses for it."""
+    scale = (FIXED_DPI or MAX_DPI) / 72
+    return int(min(rect.width * rect.height * scale * scale, MAX_PIXELS))
+
+
+class JobCost:
+    """
+    Estimated cost of one document, see estimate.
+
+    Attributes:
+        pages: Page count
+        ocr_pages: Pages expected to need OCR
+        megapixels: Rendered megapixels expected over the document
+        frame_bytes: Largest rendered frame seen in the sample
+        memory_bytes: Peak memory the document is expected to add
+        cpu_seconds: CPU time expected, most of it OCR
+    """
+
+    def __init__(self, pages=0, ocr_pages=0, megapixels=0.0, frame_bytes=0, memory_bytes=0, cpu_seconds=0.0):
+        self.pages = pages
+        self.ocr_pages = ocr_pages
+        self.megapixels = megapixels
+        self.frame_bytes = frame_bytes
+        self.memory_bytes = memory_bytes
+        self.cpu_seconds = cpu_seconds
+
+    def as_dict(self):
+        return {
+            "pages": self.pages,
+            "ocr_pages": self.ocr_pages,
+            "megapixels": round(self.megapixels, 1),
+            "frame_bytes": self.frame_bytes,
+            "memory_bytes": self.memory_bytes,
+            "cpu_seconds": round(self.cpu_seconds, 1),
+        }
+
+    def __repr__(self):
+        return (f"JobCost({self.pages} pages, {self.ocr_pages} OCR, {self.memory_bytes / MB:.0f} MB, "
+                f"{self.cpu_seconds:.0f} CPU s)")
+
+
+def estimate(source, workers=None):
+    """
+    Estimate the memory and CPU a PDF will need, without rendering it.
+
+    Args:
+        source: The PDF as bytes, or the path of a PDF on disk
+        workers: OCR processes the document will use (None = derive from the CPU count)
+
+    Returns:
+        JobCost
+
+    Raises:
+        InvalidDocument: when the source is not a PDF MuPDF can open, is password-protected or cannot be read
+    """
+    workers = workers or default_workers()
+    try:
+        doc = open_pdf(source)
+    except fitz.FileDataError as e:
+        raise InvalidDocument(f"not a readable PDF ({e})") from e
+    with doc:
+        if doc.needs_pass or doc.is_encrypted:
+            raise InvalidDocument("the PDF is password-protected")
+        try:
+            pages = doc.page_count
+            if pages <= ESTIMATE_SAMPLE_PAGES:
+                sample = range(pages)
+            else:
+                sample = sorted({round(i * (pages - 1) / (ESTIMATE_SAMPLE_PAGES - 1)) for i in range(ESTIMATE_SAMPLE_PAGES)})
+            ocr_pages = 0
+            pixels = 0
+            frame_bytes = 0
+            for number in sample:
+                regions = triage_page(doc.load_page(number))["ocr_regions"]
+                if regions:
+                    ocr_pages += 1
+                    frames = [_render_pixels(rect) for rect in regions]
+                    pixels += sum(frames)
+                    frame_bytes = max(frame_bytes, sum(frames))
+        except (ValueError, RuntimeError) as e:
+            # MuPDF reports damaged page trees and unreadable pages this way
+            raise InvalidDocument(f"the PDF cannot be read ({e})") from e
+    scale = pages / len(sample) if len(sample) else 0
+    ocr_pages = round(ocr_pages * scale)
+    megapixels = pixels * scale / 1e6
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        document_bytes = len(source) * DOCUMENT_OVERHEAD
+    else:
+        document_bytes = os.path.getsize(source)
+    frames_in_flight = min(ocr_pages, DEFAULT_QUEUE_SIZE + 1 + OCR_PAGES_IN_FLIGHT_PER_WORKER * workers)
+    memory = document_bytes + frames_in_flight * frame_bytes * FRAME_OVERHEAD + pages * RETAINED_BYTES_PER_PAGE
+    cpu = megapixels * OCR_CPU_SECONDS_PER_MEGAPIXEL + pages * TEXT_CPU_SECONDS_PER_PAGE
+    return JobCost(pages, ocr_pages, megapixels, frame_bytes, memory, cpu)
+
+
+class AdmissionController:
+    """
+    Budgets of memory and CPU shared by the documents processed at once.
+
+    Args:
+        memory_budget: Bytes of estimated memory admitted at once (0 = no limit)
+        cpu_budget: Estimated CPU seconds admitted at once (0 = no limit)
+        policy: POLICY_QUEUE to let documents that do not fit wait, POLICY_REJECT to turn them away
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, cpu_budget=CPU_BUDGET, policy=ADMISSION_POLICY):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown admission policy: {policy!r}")
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self.policy = policy
+        self.memory_reserved = 0
+        self.cpu_reserved = 0.0
+        self.admitted = 0
+        self.counts = {"admitted": 0, "waited": 0, "rejected": 0}  # waited: by reserve()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def _fits(self, cost):
+        if not self.admitted:
+            return True  # Already checked against the whole memory budget; alone, anything that fits runs
+        if self.memory_budget and self.memory_reserved + cost.memory_bytes > self.memory_budget:
+            return False
+        if self.cpu_budget and self.cpu_reserved + cost.cpu_seconds > self.cpu_budget:
+            return False
+        return True
+
+    def _check(self, cost):
+        if self.memory_budget and cost.memory_bytes > self.memory_budget:
+            self.counts["rejected"] += 1
+            raise AdmissionRejected(
+                f"the document needs about {cost.memory_bytes / MB:.0f} MB, "
+                f"more than the memory budget of {self.memory_budget / MB:.0f} MB"
+            )
+
+    def check(self, cost):
+        """Raise AdmissionRejected if the cost could never be admitted, even alone."""
+        with self._lock:
+            self._check(cost)
+
+    def _reserve(self, cost):
+        self.memory_reserved += cost.memory_bytes
+        self.cpu_reserved += cost.cpu_seconds
+        self.admitted += 1
+        self.counts["admitted"] += 1
+
+    def try_reserve(self, cost):
+        """
+        Reserve the cost if it fits now.
+
+        Returns:
+            True when reserved, False when the document has to wait (policy "queue")
+
+        Raises:
+            AdmissionRejected: when it can never fit, or does not fit now under policy "reject"
+        """
+        with self._lock:
+            self._check(cost)
+            if self._fits(cost):
+                self._reserve(cost)
+                return True
+            if self.policy == POLICY_REJECT:
+                self.counts["rejected"] += 1
+                raise AdmissionRejected(
+                    f"{self.admitted} documents are using {self.memory_reserved / MB:.0f} MB "
+                    f"of {self.memory_budget / MB:.0f} MB, try again shortly"
+                )
+            return False
+
+    def reserve(self, cost):
+        """Reserve the cost, waiting until it fits under policy "queue". Raises as try_reserve."""
+        if self.try_reserve(cost):
+            return
+        with self._lock:
+            self.counts["waited"] += 1
+            while not self._fits(cost):
+                self._released.wait()
+            self._reserve(cost)
+
+    def release(self, cost):
+        """Give back a reserved cost and let waiting documents in."""
+        with self._lock:
+            self.memory_reserved -= cost.memory_bytes
+            self.cpu_reserved -= cost.cpu_seconds
+            self.admitted -= 1
+            self._released.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    @contextmanager
+    def reserved(self, cost):
+        """Hold the cost for the duration of the block, see reserve."""
+        self.reserve(cost)
+        try:
+            yield cost
+        finally:
+            self.release(cost)
+
+    def add_listener(self, callback):
+        """Call callback(), without arguments, after every release, e.g. to admit queued jobs."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.counts,
+                policy=self.policy,
+                active=self.admitted,
+                memory_reserved=self.memory_reserved,
+                memory_budget=self.memory_budget,
+                cpu_reserved=round(self.cpu_reserved, 1),
+                cpu_budget=self.cpu_budget,
+            )
+
+
+def get_admission():
+    """Return the process-wide AdmissionController, with the budgets of the environment."""
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionController()
+        return _admission
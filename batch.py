@@ -0,0 +1,312 @@
+"""
+Headless batch redaction of many PDFs.
+
+Runs the same pipeline as the Streamlit app (pipeline.redact_pdf) over
+directories, globs or single files, fanning the files out across a process
+pool. Files whose outputs are newer than the input and were made with the
+same settings (mode, PDF output, redaction rules, OCR engine, NER model and
+render settings, kept in a .settings.json sidecar next to the outputs) are
+skipped, and one JSON line per file is written to a manifest with timings,
+page counts, redaction counts and errors. With --metrics-file (or REDACTOR_METRICS_FILE) the totals
+of the run are kept up to date in Prometheus text format. Files of at least
+REDACTOR_LARGE_DOCUMENT_MB are processed in checkpointed shards (see shards),
+so re-running the batch after a crash resumes them where they stopped.
+
+    python batch.py scans/ "inbox/**/*.pdf" --output-dir redacted/ --mode aggressive --jobs 8
+"""
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_IN_PLACE, PDF_OUTPUT_RETYPESET
+from metrics import METRICS_FILE, REGISTRY, PipelineMetrics
+
+STATUS_OK = "ok"
+STATUS_SKIPPED = "skipped"
+STATUS_EMPTY = "empty"  # No text could be extracted
+STATUS_ERROR = "error"
+
+
+def _glob_root(spec):
+    """The folder of a file path, or the leading folders of a glob up to its first wildcard."""
+    if not glob.has_magic(spec):
+        return os.path.dirname(os.path.abspath(spec))
+    parts = os.path.normpath(spec).split(os.sep)
+    fixed = []
+    for part in parts:
+        if glob.has_magic(part):
+            break
+        fixed.append(part)
+    return os.path.abspath(os.sep.join(fixed) or os.curdir)
+
+
+def collect_inputs(specs):
+    """
+    Expand directories (recursively), globs and file paths into (input path, relative output stem) pairs.
+
+    Stems are relative to the deepest folder shared by all the arguments
+    (a directory, the part of a glob before its first wildcard, the folder
+    of a single file), so the outputs mirror the input layout and files with
+    the same name in different folders do not collide.
+
+    Raises:
+        ValueError: when two inputs would still write the same outputs (e.g. scan.pdf and scan.PDF)
+    """
+    found = set()
+    roots = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            roots.append(spec)
+            found.update(os.path.abspath(path) for path in glob.glob(os.path.join(spec, "**", "*.pdf"), recursive=True))
+        else:
+            paths = glob.glob(spec, recursive=True) or ([spec] if os.path.isfile(spec) else [])
+            if paths:
+                roots.append(_glob_root(spec))
+            found.update(os.path.abspath(path) for path in paths)
+    if not found:
+        return []
+    root = os.path.commonpath([os.path.abspath(r) for r in roots] + [os.path.dirname(path) for path in found])
+    inputs = sorted((path, os.path.splitext(os.path.relpath(path, root))[0]) for path in found)
+    owners = {}
+    for path, stem in inputs:
+        # Compared case-folded: on Windows and macOS the outputs of scan.pdf and Scan.pdf are the same files
+        other = owners.setdefault(os.path.normcase(stem).lower(), path)
+        if other != path:
+            raise ValueError(f"{other} and {path} would both be written as {stem}.redacted.*")
+    return inputs
+
+
+def output_paths(output_dir, stem, formats):
+    return {fmt: os.path.join(output_dir, f"{stem}.redacted.{fmt}") for fmt in formats}
+
+
+def settings_path(output_dir, stem):
+    """The sidecar recording the settings a file's outputs were made with."""
+    return os.path.join(output_dir, f"{stem}.redacted.settings.json")
+
+
+def output_settings(mode, pdf_output, ocr_backend=None, ner_model=None):
+    """Everything besides the input that changes the outputs, as a JSON-serializable dict."""
+    from ner import NER_MODEL
+    from ocr_engine import engine_version
+    from rasterize import RENDER_SETTINGS
+    from redaction import get_engine
+
+    rules = [[rule.name, rule.pattern, rule.flags] for rule in get_engine(mode).rules]
+    return {
+        "mode": mode,
+        "pdf_output": pdf_output,
+        "rules": hashlib.sha256(json.dumps(rules).encode("utf-8")).hexdigest(),
+        "ocr_engine": engine_version(backend=ocr_backend),
+        "ner_model": ner_model or NER_MODEL,
+        "render": RENDER_SETTINGS,
+    }
+
+
+def is_up_to_date(input_path, outputs, sidecar=None, settings=None):
+    """True when every output exists, is at least as new as the input, and the sidecar records these settings."""
+    input_mtime = os.path.getmtime(input_path)
+    if not all(os.path.exists(path) and os.path.getmtime(path) >= input_mtime for path in outputs.values()):
+        return False
+    if sidecar is None:
+        return True
+    try:
+        with open(sidecar) as f:
+            return json.load(f) == json.loads(json.dumps(settings))
+    except (OSError, ValueError):
+        return False
+
+
+def _init_worker(torch_threads, ocr_backend, ner_model):
+    # Must be set before torch, ocr_engine and ner are first imported in this process
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = str(torch_threads)
+    if ocr_backend:
+        os.environ["REDACTOR_OCR_BACKEND"] = ocr_backend
+    if ner_model:
+        os.environ["REDACTOR_NER"] = ner_model
+
+
+def redact_file(input_path, outputs, mode, pdf_output, use_cache, sidecar=None, settings=None):
+    """
+    Redact one file and write its outputs, then the settings sidecar, if given.
+    Runs in a worker process; never raises.
+    """
+    from dedup import get_default_index
+    from ocr_cache import get_default_cache
+    from pipeline import redact_pdf
+    from shards import is_large, redact_large
+
+    record = {"input": input_path, "outputs": {}, "status": STATUS_OK, "error": None}
+    metrics = PipelineMetrics()
+    start = time.perf_counter()
+    try:
+        options = dict(
+            workers=1,  # Files are already spread across processes
+            pdf_output=pdf_output,
+            export_formats=tuple(outputs),
+            cache=get_default_cache() if use_cache else None,
+            dedup=get_default_index() if use_cache else None,  # Shared by the files of this worker
+            metrics=metrics,
+        )
+        if is_large(os.path.getsize(input_path)):
+            # Read by path, shard by shard; the checkpoints next to the outputs let a re-run resume
+            checkpoints = os.path.splitext(next(iter(outputs.values())))[0] + ".shards"
+            pages, exports = redact_large(input_path, mode, checkpoints=checkpoints, **options)
+            record["large_document"] = True
+        else:
+            with open(input_path, "rb") as f:
+                pdf_bytes = f.read()
+            pages, exports = redact_pdf(pdf_bytes, mode, **options)
+        pipeline_done = time.perf_counter()
+        categories = Counter(match.category for page in pages for match in page["matches"])
+        record.update({
+            "pages": len(pages),
+            "page_kinds": dict(Counter(page["triage"]["kind"] for page in pages)),
+            "redactions": sum(categories.values()),
+            "redactions_by_category": dict(categories),
+        })
+        if exports is None:
+            record["status"] = STATUS_EMPTY
+        else:
+            exports.build(outputs)
+            if sidecar and os.path.exists(sidecar):
+                os.remove(sidecar)  # Outputs of mixed settings must never look up to date
+            for fmt, path in outputs.items():
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                tmp_path = path + ".part"
+                with open(tmp_path, "wb") as f:
+                    f.write(exports.get(fmt))
+                os.replace(tmp_path, path)  # Never leave a half-written output that looks up to date
+                record["outputs"][fmt] = path
+            if sidecar:
+                tmp_path = sidecar + ".part"
+                with open(tmp_path, "w") as f:
+                    json.dump(settings, f, sort_keys=True)
+                os.replace(tmp_path, sidecar)  # Last, once every output is in place
+            if exports.unlocated:
+                record["unlocated"] = exports.unlocated
+        record["timings"] = {
+            "pipeline_s": round(pipeline_done - start, 4),
+            "export_s": round(time.perf_counter() - pipeline_done, 4),
+        }
+        record["metrics"] = metrics.snapshot()
+    except Exception as e:
+        record["status"] = STATUS_ERROR
+        record["error"] = f"{type(e).__name__}: {e}"
+    record.setdefault("timings", {})["total_s"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def run_batch(inputs, output_dir, manifest_path, mode="conservative", formats=(FORMAT_PDF, FORMAT_DOCX),
+              pdf_output=PDF_OUTPUT_RETYPESET, jobs=None, force=False, use_cache=True, metrics_path=METRICS_FILE,
+              ocr_backend=None, ner_model=None):
+    """
+    Redact every (input path, output stem) pair and write the manifest.
+
+    The per-file metrics are added up in metrics.REGISTRY, which is rewritten
+    to metrics_path (Prometheus text format) after every file when given.
+    ocr_backend overrides REDACTOR_OCR_BACKEND in the workers, see ocr_engine,
+    and ner_model overrides REDACTOR_NER, see ner.
+
+    Returns:
+        Counter of the per-file statuses
+    """
+    jobs = jobs or os.cpu_count() or 1
+    statuses = Counter()
+    settings = output_settings(mode, pdf_output, ocr_backend, ner_model)
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    with open(manifest_path, "w") as manifest:
+        def record(entry):
+            statuses[entry["status"]] += 1
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            if entry["status"] == STATUS_ERROR:
+                REGISTRY.record_failure()
+            elif "metrics" in entry:
+                REGISTRY.record(entry["metrics"])
+            if metrics_path and entry["status"] != STATUS_SKIPPED:
+                REGISTRY.write_textfile(metrics_path)
+            print(f"[{entry['status']}] {entry['input']}", file=sys.stderr)
+
+        pending = []
+        for input_path, stem in inputs:
+            outputs = output_paths(output_dir, stem, formats)
+            sidecar = settings_path(output_dir, stem)
+            if not force and is_up_to_date(input_path, outputs, sidecar, settings):
+                record({"input": input_path, "outputs": outputs, "status": STATUS_SKIPPED, "error": None})
+            else:
+                pending.append((input_path, outputs, sidecar))
+
+        if not pending:
+            return statuses
+        # spawn, not fork: OCR runs torch, which does not survive a fork reliably
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(pending)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(max(1, (os.cpu_count() or 1) // jobs), ocr_backend, ner_model),
+        ) as executor:
+            futures = [
+                executor.submit(redact_file, input_path, outputs, mode, pdf_output, use_cache, sidecar, settings)
+                for input_path, outputs, sidecar in pending
+            ]
+            for future in as_completed(futures):
+                record(future.result())
+    return statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Redact sensitive information from many PDFs without the UI.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories (searched recursively) or glob patterns")
+    parser.add_argument("-o", "--output-dir", required=True, help="Where the redacted files are written")
+    parser.add_argument("--mode", choices=["conservative", "aggressive"], default="conservative")
+    parser.add_argument("--formats", default="pdf,docx", help="Comma-separated output formats: pdf, docx")
+    parser.add_argument("--pdf-output", choices=[PDF_OUTPUT_RETYPESET, PDF_OUTPUT_IN_PLACE], default=PDF_OUTPUT_RETYPESET)
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Files processed in parallel (default: CPU count)")
+    parser.add_argument("--manifest", help="JSONL manifest path (default: OUTPUT_DIR/manifest.jsonl)")
+    parser.add_argument("--force", action="store_true", help="Redact files even when their outputs are up to date")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the OCR result cache nor reuse near-duplicate regions")
+    parser.add_argument("--ocr-backend", choices=["fp32", "int8"], help="OCR backend (default: REDACTOR_OCR_BACKEND or fp32)")
+    parser.add_argument("--ner", help="NER address detection: off, distilled, large or a model name (default: REDACTOR_NER or off)")
+    parser.add_argument("--metrics-file", default=METRICS_FILE, help="Prometheus text file kept up to date with the run's totals")
+    args = parser.parse_args(argv)
+
+    formats = tuple(fmt.strip() for fmt in args.formats.split(",") if fmt.strip())
+    unknown = set(formats) - {FORMAT_PDF, FORMAT_DOCX}
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(sorted(unknown))}")
+    try:
+        inputs = collect_inputs(args.inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    if not inputs:
+        parser.error("no PDF files found")
+
+    statuses = run_batch(
+        inputs,
+        args.output_dir,
+        args.manifest or os.path.join(args.output_dir, "manifest.jsonl"),
+        mode=args.mode,
+        formats=formats,
+        pdf_output=args.pdf_output,
+        jobs=args.jobs,
+        force=args.force,
+        use_cache=not args.no_cache,
+        metrics_path=args.metrics_file,
+        ocr_backend=args.ocr_backend,
+        ner_model=args.ner,
+    )
+    print(", ".join(f"{count} {status}" for status, count in sorted(statuses.items())), file=sys.stderr)
+    return 1 if statuses[STATUS_ERROR] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+OCR work saved by near-duplicate reuse on form-like scans.
+
+Scans of synthetic forms (the same letterhead, boilerplate and footer on
+every page, different fields) are run through the pipeline twice, without
+the OCR cache: once with a fresh dedup.DedupIndex and once without. Reported:
+regions OCR'd, the dedup hit rate per band (header, body, footer), OCR
+stage time, and the pages whose text differs between the two runs, which
+should be none when reuse only picks true duplicates. That last check needs
+the real OCR engine: a reused region's text is compared with that of its own
+pixels, which only a reader that actually reads them gives back the same.
+
+    python benchmarks/bench_dedup.py --documents 3 --pages 10 --degradation 0.2 --json dedup.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from dedup import DedupIndex  # noqa: E402
+from metrics import STAGE_OCR, PipelineMetrics  # noqa: E402
+from pipeline import redact_pdf  # noqa: E402
+from synthetic import generate_form, scan_document  # noqa: E402
+
+
+def run(scans, workers, dedup):
+    metrics = PipelineMetrics()
+    texts = []
+    start = time.perf_counter()
+    for pdf_bytes in scans:
+        pages, _ = redact_pdf(pdf_bytes, workers=workers, export_formats=(), metrics=metrics, dedup=dedup)
+        texts.extend(page["text"] for page in pages)
+    seconds = time.perf_counter() - start
+    snapshot = metrics.snapshot()
+    regions = snapshot["ocr_regions"]
+    return texts, {
+        "seconds": round(seconds, 3),
+        "ocr_seconds": snapshot["stages"][STAGE_OCR]["seconds"],
+        "regions": regions,
+        "regions_ocrd": regions - snapshot["dedup_hits"],
+        "dedup_hit_rate": round(snapshot["dedup_hits"] / regions, 4) if regions else 0.0,
+        "hit_rate_by_band": {
+            band: round(snapshot["band_dedup_hits"].get(band, 0) / count, 4)
+            for band, count in sorted(snapshot["band_regions"].items())
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per document")
+    parser.add_argument("--degradation", type=float, default=0.2, help="0..1 scan degradation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="OCR worker processes")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    scans = [
+        scan_document(generate_form(args.pages, seed=args.seed + index)[0], args.degradation, seed=args.seed + index)
+        for index in range(args.documents)
+    ]
+    baseline_texts, baseline = run(scans, args.workers, None)
+    dedup_texts, deduped = run(scans, args.workers, DedupIndex())
+    results = {
+        "config": {
+            "documents": args.documents, "pages": args.pages, "degradation": args.degradation,
+            "seed": args.seed, "workers": args.workers,
+        },
+        "without_dedup": baseline,
+        "with_dedup": deduped,
+        "pages_with_different_text": sum(a != b for a, b in zip(baseline_texts, dedup_texts)),
+    }
+    for name in ("without_dedup", "with_dedup"):
+        entry = results[name]
+        print(f"{name:<14} {entry['regions_ocrd']:>5} of {entry['regions']} regions OCR'd   OCR {entry['ocr_seconds']:.2f}s")
+    print("dedup hit rate by band: " + ", ".join(f"{band} {rate:.0%}" for band, rate in deduped["hit_rate_by_band"].items()))
+    print(f"pages whose text changed: {results['pages_with_different_text']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Per-document cost of the NER address stage, with and without the prefilter.
+
+Born-digital synthetic documents are used, so OCR plays no part. For each
+document the model runs over either every non-empty line ("full", what
+running the model on whole pages amounts to) or only the prefiltered
+candidate spans ("prefiltered", what the pipeline does), in one batched
+call per document. Reported per strategy: seconds per document, the share
+of the text sent to the model, and the share of the document's addresses
+covered by an entity, so the prefilter's savings can be weighed against
+what it misses. The regex-only pipeline time is reported alongside.
+
+    python benchmarks/bench_ner.py --model distilled --documents 3 --pages 5 --json ner.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402  PyMuPDF
+
+from ner import NER_BATCH_SIZE, NER_OFF, candidate_spans, find_entities, model_name  # noqa: E402
+from pipeline import redact_pdf  # noqa: E402
+from redaction import ADDRESS  # noqa: E402
+from synthetic import generate_document  # noqa: E402
+
+
+def line_spans(text):
+    """Every non-empty line of text as a (start, end) span."""
+    spans = []
+    start = 0
+    for line in text.split("\n"):
+        if line.strip():
+            spans.append((start, start + len(line)))
+        start += len(line) + 1
+    return spans
+
+
+STRATEGIES = {"full": line_spans, "prefiltered": candidate_spans}
+
+
+def address_coverage(texts, found, truth):
+    """Share of the ADDRESS values in truth overlapped by at least one entity on their page."""
+    addresses = [entry for entry in truth if entry["category"] == ADDRESS]
+    covered = 0
+    for entry in addresses:
+        text = texts[entry["page"]]
+        start = text.find(entry["value"])
+        if start >= 0 and any(m.start < start + len(entry["value"]) and start < m.end for m in found[entry["page"]]):
+            covered += 1
+    return covered / len(addresses) if addresses else 1.0
+
+
+def bench_strategy(strategy, documents, model, batch_size):
+    seconds = 0.0
+    characters = sent = 0
+    coverage = []
+    for texts, truth in documents:
+        spans = [STRATEGIES[strategy](text) for text in texts]
+        start = time.perf_counter()
+        found = find_entities(texts, spans, model, batch_size)
+        seconds += time.perf_counter() - start
+        characters += sum(len(text) for text in texts)
+        sent += sum(end - start for page_spans in spans for start, end in page_spans)
+        coverage.append(address_coverage(texts, found, truth))
+    return {
+        "seconds_per_document": round(seconds / len(documents), 4),
+        "text_share": round(sent / characters, 4) if characters else 0.0,
+        "address_coverage": round(sum(coverage) / len(coverage), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="distilled", help="distilled, large, or a model name or path")
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=5, help="Pages per document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=NER_BATCH_SIZE)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    documents = []
+    pipeline_seconds = 0.0
+    for index in range(args.documents):
+        pdf_bytes, truth = generate_document(args.pages, seed=args.seed + index)
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            texts = [page.get_text("text") for page in doc]
+        documents.append((texts, truth))
+        start = time.perf_counter()
+        redact_pdf(pdf_bytes, "aggressive", workers=1, export_formats=(), ner_model=NER_OFF)
+        pipeline_seconds += time.perf_counter() - start
+
+    find_entities(["Warm-up at 1 Main Street"], [[(0, 24)]], args.model)  # Loads the model, not timed
+    results = {
+        "config": {
+            "model": model_name(args.model), "documents": args.documents, "pages": args.pages,
+            "seed": args.seed, "batch_size": args.batch_size,
+        },
+        "pipeline_without_ner_seconds_per_document": round(pipeline_seconds / args.documents, 4),
+        "strategies": {},
+    }
+    print(f"pipeline without NER  {results['pipeline_without_ner_seconds_per_document']:>8}s/document")
+    for strategy in STRATEGIES:
+        entry = bench_strategy(strategy, documents, args.model, args.batch_size)
+        results["strategies"][strategy] = entry
+        print(
+            f"NER {strategy:<17} {entry['seconds_per_document']:>8}s/document   "
+            f"{entry['text_share']:.0%} of the text   {entry['address_coverage']:.0%} of addresses covered"
+        )
+    full, prefiltered = results["strategies"]["full"], results["strategies"]["prefiltered"]
+    if prefiltered["seconds_per_document"]:
+        results["prefilter_speedup"] = round(full["seconds_per_document"] / prefiltered["seconds_per_document"], 3)
+        print(f"prefilter speedup: {results['prefilter_speedup']}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""
+Side-by-side benchmark of the OCR backends (fp32 vs dynamic int8).
+
+Scans of the synthetic corpus are rendered exactly as the pipeline renders
+them and OCR'd in-process by each backend, on the CPU. Reported per backend:
+pages/s, character accuracy (1 - character error rate) against the text layer
+of the born-digital original, and how often the backend's text differs from
+the fp32 text. Accuracy uses an exact edit distance, which is quadratic in
+the page length; keep --pages small.
+
+    python benchmarks/bench_ocr_backends.py --documents 2 --pages 3 --degradation 0.2 --json ocr_backends.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402  PyMuPDF
+
+from ocr_engine import BACKENDS, DEFAULT_BATCH_SIZE, get_reader, ocr_sequential, result_text  # noqa: E402
+from pipeline import render_pages  # noqa: E402
+from synthetic import generate_document, scan_document  # noqa: E402
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_accuracy(predicted, truth):
+    if not truth:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1 - edit_distance(predicted, truth) / len(truth))
+
+
+def build_corpus(documents, pages, degradation, seed):
+    """Rendered scan regions plus the reference text of every page."""
+    corpus = []
+    for index in range(documents):
+        pdf_bytes, _ = generate_document(pages, seed=seed + index)
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            truths = [normalize(page.get_text("text")) for page in doc]
+        scanned = scan_document(pdf_bytes, degradation, seed=seed + index)
+        for page, truth in zip(render_pages(scanned), truths):
+            corpus.append({"images": page["images"], "truth": truth})
+    return corpus
+
+
+def bench_backend(backend, corpus, batch_size):
+    reader = get_reader(gpu=False, backend=backend)
+    ocr_sequential(reader, corpus[0]["images"][:1], batch_size)  # Warm-up, not timed
+    start = time.perf_counter()
+    texts = [
+        normalize(" ".join(result_text(result) for result in ocr_sequential(reader, page["images"], batch_size)))
+        for page in corpus
+    ]
+    seconds = time.perf_counter() - start
+    accuracy = [character_accuracy(text, page["truth"]) for text, page in zip(texts, corpus)]
+    return texts, {
+        "pages": len(corpus),
+        "seconds": round(seconds, 3),
+        "pages_per_s": round(len(corpus) / seconds, 3),
+        "character_accuracy": round(sum(accuracy) / len(accuracy), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=3, help="Pages per document")
+    parser.add_argument("--degradation", type=float, default=0.2, help="0..1 scan degradation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (default: torch's own)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    corpus = build_corpus(args.documents, args.pages, args.degradation, args.seed)
+    results = {
+        "config": {
+            "documents": args.documents, "pages": args.pages, "degradation": args.degradation,
+            "seed": args.seed, "batch_size": args.batch_size, "threads": args.threads,
+        },
+        "backends": {},
+    }
+    reference = None
+    for backend in args.backends.split(","):
+        texts, entry = bench_backend(backend.strip(), corpus, args.batch_size)
+        if reference is None:
+            reference = texts
+        else:
+            entry["pages_differing_from_" + args.backends.split(",")[0].strip()] = sum(
+                text != ref for text, ref in zip(texts, reference)
+            )
+        results["backends"][backend] = entry
+        print(f"{backend:<6} {entry['pages_per_s']:>8} pages/s   character accuracy {entry['character_accuracy']:.2%}")
+
+    names = list(results["backends"])
+    if len(names) > 1:
+        base, other = results["backends"][names[0]], results["backends"][names[1]]
+        results["speedup"] = round(other["pages_per_s"] / base["pages_per_s"], 3)
+        results["accuracy_delta"] = round(other["character_accuracy"] - base["character_accuracy"], 4)
+        print(f"{names[1]} vs {names[0]}: {results['speedup']}x pages/s, accuracy {results['accuracy_delta']:+.2%}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+OCR time and accuracy with each image preprocessing setting.
+
+Synthetic documents are scanned with noise and a random tilt of up to
+--skew degrees per page, then rendered for OCR as the pipeline renders them
+(rasterize.render_regions) with each set of preprocessing steps (see
+preprocess) and OCR'd in-process. Reported per setting, per page: render
+and preprocessing seconds, megapixels sent to OCR, OCR seconds and the
+time saved against no preprocessing; and character accuracy against the
+text layer of the born-digital original (before and after
+ocr_engine.correct_ocr_text), the share of the known SSNs and card numbers
+that came out of OCR intact, and the share the aggressive rules redacted.
+Accuracy uses an exact edit distance, which is quadratic in the page
+length; keep --pages small. --skip-ocr only measures rendering.
+
+    python benchmarks/bench_preprocess.py --documents 2 --pages 3 --degradation 0.3 --skew 3 --json preprocess.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402  PyMuPDF
+
+from bench_ocr_backends import character_accuracy, normalize  # noqa: E402
+from ocr_engine import DEFAULT_BATCH_SIZE, correct_ocr_text, get_reader, ocr_sequential, result_text  # noqa: E402
+from preprocess import DEFAULT_STEPS, parse_steps  # noqa: E402
+from rasterize import render_regions  # noqa: E402
+from redaction import get_engine  # noqa: E402
+from synthetic import CREDIT_CARD, SSN, generate_document, scan_document  # noqa: E402
+from triage import triage_page  # noqa: E402
+
+SETTINGS = ("none", "despeckle", "deskew", ",".join(DEFAULT_STEPS), "despeckle,deskew,crop", "despeckle,deskew,binarize,crop")
+
+
+def build_corpus(documents, pages, degradation, skew, seed):
+    """Scanned documents, with the reference text and the known numbers of every page."""
+    corpus = []
+    for index in range(documents):
+        pdf_bytes, truth = generate_document(pages, seed=seed + index)
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            texts = [normalize(page.get_text("text")) for page in doc]
+        numbers = [
+            [item["value"] for item in truth if item["page"] == number and item["category"] in (SSN, CREDIT_CARD)]
+            for number in range(pages)
+        ]
+        scanned = scan_document(pdf_bytes, degradation, seed=seed + index, skew=skew)
+        corpus.append({"pdf_bytes": scanned, "texts": texts, "numbers": numbers})
+    return corpus
+
+
+def render(corpus, steps):
+    """Frames of every page rendered with these steps, and the seconds it took."""
+    pages = []
+    start = time.perf_counter()
+    for entry in corpus:
+        with fitz.open(stream=entry["pdf_bytes"], filetype="pdf") as doc:
+            for page in doc:
+                _, frames = render_regions(page, triage_page(page)["ocr_regions"], steps)
+                pages.append(frames)
+    return pages, time.perf_counter() - start
+
+
+def bench_setting(name, corpus, reader, batch_size):
+    steps = parse_steps(name)
+    pages, render_seconds = render(corpus, steps)
+    texts = [text for entry in corpus for text in entry["texts"]]
+    numbers = [values for entry in corpus for values in entry["numbers"]]
+    entry = {
+        "steps": list(steps),
+        "render_seconds_per_page": round(render_seconds / len(pages), 4),
+        "megapixels_per_page": round(sum(frame.size for frames in pages for frame in frames) / len(pages) / 1e6, 3),
+    }
+    if reader is None:
+        return entry
+
+    start = time.perf_counter()
+    raw = [normalize(" ".join(result_text(result) for result in ocr_sequential(reader, frames, batch_size))) for frames in pages]
+    ocr_seconds = time.perf_counter() - start
+    corrected = [correct_ocr_text(text, enabled=True) for text in raw]
+    engine = get_engine("aggressive")
+    expected = sum(len(values) for values in numbers)
+    intact = sum(value in text for text, values in zip(corrected, numbers) for value in values)
+    redacted = [engine.redact(text) for text in corrected]
+    caught = sum(
+        value in text and value not in red
+        for text, red, values in zip(corrected, redacted, numbers) for value in values
+    )
+    entry.update({
+        "ocr_seconds_per_page": round(ocr_seconds / len(pages), 4),
+        "character_accuracy": round(sum(map(character_accuracy, raw, texts)) / len(pages), 4),
+        "character_accuracy_corrected": round(sum(map(character_accuracy, corrected, texts)) / len(pages), 4),
+        "numbers_intact": round(intact / expected, 4) if expected else 1.0,
+        "numbers_redacted": round(caught / expected, 4) if expected else 1.0,
+    })
+    return entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=3, help="Pages per document")
+    parser.add_argument("--degradation", type=float, default=0.3, help="0..1 scan degradation")
+    parser.add_argument("--skew", type=float, default=3.0, help="Largest page tilt in degrees")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--settings", default=";".join(SETTINGS),
+                        help="Semicolon-separated settings, each a comma-separated list of steps or none")
+    parser.add_argument("--skip-ocr", action="store_true", help="Only measure rendering and preprocessing")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.documents, args.pages, args.degradation, args.skew, args.seed)
+    reader = None
+    if not args.skip_ocr:
+        reader = get_reader(gpu=False)
+        ocr_sequential(reader, render(corpus[:1], ())[0][0][:1], args.batch_size)  # Warm-up, not timed
+    results = {
+        "config": {
+            "documents": args.documents, "pages": args.pages, "degradation": args.degradation,
+            "skew": args.skew, "seed": args.seed, "batch_size": args.batch_size,
+        },
+        "settings": {},
+    }
+    baseline = None
+    for name in args.settings.split(";"):
+        entry = bench_setting(name.strip(), corpus, reader, args.batch_size)
+        if baseline is None:
+            baseline = entry
+        entry["render_seconds_added_per_page"] = round(
+            entry["render_seconds_per_page"] - baseline["render_seconds_per_page"], 4
+        )
+        line = (f"{name.strip():<32} render {entry['render_seconds_per_page']:.3f}s/page   "
+                f"{entry['megapixels_per_page']:>6} MP/page")
+        if reader is not None:
+            entry["ocr_seconds_saved_per_page"] = round(
+                baseline["ocr_seconds_per_page"] - entry["ocr_seconds_per_page"], 4
+            )
+            line += (f"   OCR {entry['ocr_seconds_per_page']:.2f}s/page ({entry['ocr_seconds_saved_per_page']:+.2f}s saved)"
+                     f"   accuracy {entry['character_accuracy']:.2%} ({entry['character_accuracy_corrected']:.2%} corrected)"
+                     f"   numbers intact {entry['numbers_intact']:.0%}, redacted {entry['numbers_redacted']:.0%}")
+        results["settings"][name.strip()] = entry
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Throughput benchmark for the redaction engine on multi-MB text.
+
+Compares the single-pass engine with the previous multi-pass implementation
+(one re.sub / str.replace pass per pattern) for both modes.
+
+    python benchmarks/bench_redaction.py --size-mb 8 --repeat 3
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redaction import AGGRESSIVE, CONSERVATIVE  # noqa: E402
+
+WORDS = ("the", "account", "holder", "was", "notified", "on", "record", "payment", "due", "form",
+         "signature", "date", "policy", "number", "reference", "claim", "please", "review", "attached")
+
+
+def synthetic_text(size_bytes, seed=0):
+    """Filler text with labeled and unlabeled SSNs, cards, addresses and ZIPs sprinkled in."""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < size_bytes:
+        kind = rng.randrange(10)
+        if kind == 0:
+            line = f"SSN: {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}"
+        elif kind == 1:
+            line = "Credit Card: " + " ".join(str(rng.randint(1000, 9999)) for _ in range(4))
+        elif kind == 2:
+            line = f"Address: {rng.randint(1, 9999)} Oak Street, Springfield ZIP: {rng.randint(10000, 99999)}"
+        elif kind == 3:
+            line = f"call {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(1000, 9999)} or mail to {rng.randint(10000, 99999)}"
+        else:
+            line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 16)))
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+def legacy_conservative(text):
+    redacted_text = text
+    redacted_text = re.sub(r'\bSSN:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b', '[REDACTED SSN]', redacted_text, flags=re.IGNORECASE)
+    redacted_text = re.sub(r'\bSocial Security:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b', '[REDACTED SSN]', redacted_text, flags=re.IGNORECASE)
+    redacted_text = re.sub(r'\bCredit Card:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', '[REDACTED CREDIT CARD]', redacted_text, flags=re.IGNORECASE)
+    redacted_text = re.sub(r'\bCard Number:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', '[REDACTED CREDIT CARD]', redacted_text, flags=re.IGNORECASE)
+    redacted_text = re.sub(r'\bAddress:\s*[^\n]+', '[REDACTED ADDRESS]', redacted_text, flags=re.IGNORECASE)
+    redacted_text = re.sub(r'\bZIP:\s*\d{5}(?:-\d{4})?\b', '[REDACTED ZIP]', redacted_text, flags=re.IGNORECASE)
+    return redacted_text
+
+
+def legacy_aggressive(text):
+    redacted_text = text
+    for match in re.finditer(r'\b\d{3}[-\s<>o]\d{2}[-\s<>o]\d{4}\b', text, re.IGNORECASE):
+        redacted_text = redacted_text.replace(match.group(), '[REDACTED SSN]')
+    for match in re.finditer(r'\b\d{4}[\s\-]\d{4}[\s\-]\d{3}[A-Za-z0-9][\s\-][A-Za-z0-9]\d{2,3}\b', text):
+        redacted_text = redacted_text.replace(match.group(), '[REDACTED CREDIT CARD]')
+    for match in re.finditer(r'\b\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', text):
+        redacted_text = redacted_text.replace(match.group(), '[REDACTED CREDIT CARD]')
+    for match in re.finditer(r'\b\d{1,4}\s+[A-Za-z]+\s+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd)\b', text, re.IGNORECASE):
+        redacted_text = redacted_text.replace(match.group(), '[REDACTED ADDRESS]')
+    for match in re.finditer(r'\b\d{5}(?:-\d{4})?\b', text):
+        context = text[max(0, match.start() - 10):match.end() + 10].lower()
+        if any(indicator in context for indicator in ['zip', 'postal', 'address', 'mail']):
+            redacted_text = redacted_text.replace(match.group(), '[REDACTED ZIP]')
+    return redacted_text
+
+
+def best_time(fn, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=4.0, help="Size of the synthetic text")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per implementation, the best one is reported")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the single-pass engine")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    text = synthetic_text(int(args.size_mb * 1024 * 1024))
+    mb = len(text.encode("utf-8")) / (1024 * 1024)
+    cases = [
+        ("conservative", "engine", CONSERVATIVE.redact),
+        ("aggressive", "engine", AGGRESSIVE.redact),
+    ]
+    if not args.skip_legacy:
+        cases += [
+            ("conservative", "legacy", legacy_conservative),
+            ("aggressive", "legacy", legacy_aggressive),
+        ]
+
+    results = []
+    print(f"{mb:.1f} MB of synthetic text")
+    for mode, implementation, fn in cases:
+        seconds = best_time(fn, text, args.repeat)
+        results.append({"mode": mode, "implementation": implementation, "seconds": seconds, "mb_per_s": mb / seconds})
+        print(f"{mode:<13} {implementation:<7} {seconds:8.3f} s  {mb / seconds:8.2f} MB/s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"text_mb": mb, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
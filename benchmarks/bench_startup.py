@@ -0,0 +1,93 @@
+"""
+Import/startup-time budget for the Streamlit app.
+
+Streamlit re-executes main.py on every interaction and every cold start
+imports it fresh, so the time to `import main` is paid constantly. This
+script measures it in clean subprocesses, lists the heaviest imports and
+fails when the median exceeds the budget.
+
+    python benchmarks/bench_startup.py --budget-ms 1500 --json startup.json
+    python benchmarks/bench_startup.py --reader   # also time the first get_reader()
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_BUDGET_MS = 1500
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+READER_SNIPPET = (
+    "import time; import ocr_engine; t = time.perf_counter(); ocr_engine.get_reader(); "
+    "print(time.perf_counter() - t)"
+)
+
+
+def run_python(args, env=None):
+    return subprocess.run(
+        [sys.executable] + args, cwd=REPO_DIR, capture_output=True, text=True, check=True, env=env,
+    )
+
+
+def time_snippet(snippet, runs):
+    env = dict(os.environ, REDACTOR_WARMUP="0")
+    return [float(run_python(["-c", snippet], env).stdout.strip().splitlines()[-1]) * 1000 for _ in range(runs)]
+
+
+def heaviest_imports(top):
+    """Parse `python -X importtime` and return the top-level packages with the largest cumulative time."""
+    env = dict(os.environ, REDACTOR_WARMUP="0")
+    stderr = run_python(["-X", "importtime", "-c", "import main"], env).stderr
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        package = name.strip().split(".")[0]
+        if package == "main":
+            continue
+        # The outermost import of a package carries the cumulative time of everything below it
+        totals[package] = max(totals.get(package, 0), int(cumulative) / 1000)
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreter runs, the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Fail when the median import time exceeds this")
+    parser.add_argument("--reader", action="store_true", help="Also time loading the EasyOCR reader")
+    parser.add_argument("--top", type=int, default=10, help="Number of heaviest imports to list")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    import_ms = time_snippet(IMPORT_SNIPPET, args.runs)
+    results = {
+        "import_main_ms": statistics.median(import_ms),
+        "import_main_runs_ms": import_ms,
+        "budget_ms": args.budget_ms,
+        "heaviest_imports_ms": dict(heaviest_imports(args.top)),
+    }
+    print(f"import main: median {results['import_main_ms']:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for package, ms in results["heaviest_imports_ms"].items():
+        print(f"  {package:<24} {ms:8.1f} ms")
+
+    if args.reader:
+        results["first_reader_ms"] = time_snippet(READER_SNIPPET, 1)[0]
+        print(f"first get_reader(): {results['first_reader_ms']:.0f} ms")
+
+    results["within_budget"] = results["import_main_ms"] <= args.budget_ms
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if not results["within_budget"]:
+        print("Startup budget exceeded", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Throughput of native .docx and .txt ingestion against the PDF paths.
+
+The same synthetic documents are produced as a Word file (one paragraph per
+line, with bold and italic runs), a plain-text file, the born-digital PDF
+and a scan of it. Each is redacted the way the app would: documents.redact_document
+for the native files, pipeline.redact_pdf for the PDFs (the scan going
+through rendering and OCR) without the OCR cache. Reported per path:
+seconds, pages and characters per second, redactions found, and the
+speed-up over the OCR path.
+
+    python benchmarks/bench_text_ingestion.py --documents 3 --pages 10 --workers 2 --json text_ingestion.json
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fitz  # noqa: E402  PyMuPDF
+
+from documents import KIND_DOCX, KIND_TEXT, redact_document  # noqa: E402
+from exporters import FORMAT_DOCX  # noqa: E402
+from pipeline import redact_pdf  # noqa: E402
+from synthetic import generate_document, scan_document  # noqa: E402
+
+
+def make_docx(pages):
+    """A Word document of the pages' lines, a page break between pages, every other run bold or italic."""
+    from docx import Document
+    doc = Document()
+    for number, text in enumerate(pages):
+        if number:
+            doc.add_page_break()
+        for index, line in enumerate(text.splitlines()):
+            paragraph = doc.add_paragraph()
+            for word_index, word in enumerate(line.split(" ")):
+                run = paragraph.add_run(word if not word_index else " " + word)
+                run.bold = (index + word_index) % 4 == 1
+                run.italic = (index + word_index) % 4 == 3
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def run_native(files, kind, mode):
+    redactions = 0
+    start = time.perf_counter()
+    for data in files:
+        redactions += len(redact_document(io.BytesIO(data), kind, mode).redactions)
+    return time.perf_counter() - start, redactions
+
+
+def run_pdf(files, mode, workers):
+    redactions = 0
+    start = time.perf_counter()
+    for data in files:
+        pages, _ = redact_pdf(data, mode, workers=workers, export_formats=(FORMAT_DOCX,))
+        redactions += sum(len(page["matches"]) for page in pages)
+    return time.perf_counter() - start, redactions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10, help="Pages per document")
+    parser.add_argument("--mode", choices=["conservative", "aggressive"], default="aggressive")
+    parser.add_argument("--degradation", type=float, default=0.2, help="0..1 scan degradation")
+    parser.add_argument("--workers", type=int, default=1, help="OCR worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    files = {"docx": [], "txt": [], "pdf_text_layer": [], "pdf_ocr": []}
+    characters = 0
+    for index in range(args.documents):
+        pdf_bytes, _ = generate_document(args.pages, seed=args.seed + index)
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            pages = [page.get_text("text") for page in doc]
+        characters += sum(len(text) for text in pages)
+        files["docx"].append(make_docx(pages))
+        files["txt"].append("\n\n".join(pages).encode("utf-8"))
+        files["pdf_text_layer"].append(pdf_bytes)
+        files["pdf_ocr"].append(scan_document(pdf_bytes, args.degradation, seed=args.seed + index))
+
+    run_pdf(files["pdf_text_layer"][:1], args.mode, args.workers)  # Imports and the OCR reader, not timed
+    run_pdf(files["pdf_ocr"][:1], args.mode, args.workers)
+    timings = {
+        "docx": run_native(files["docx"], KIND_DOCX, args.mode),
+        "txt": run_native(files["txt"], KIND_TEXT, args.mode),
+        "pdf_text_layer": run_pdf(files["pdf_text_layer"], args.mode, args.workers),
+        "pdf_ocr": run_pdf(files["pdf_ocr"], args.mode, args.workers),
+    }
+    pages_total = args.documents * args.pages
+    ocr_seconds = timings["pdf_ocr"][0]
+    results = {
+        "config": {
+            "documents": args.documents, "pages": args.pages, "mode": args.mode,
+            "degradation": args.degradation, "workers": args.workers, "seed": args.seed,
+        },
+        "paths": {},
+    }
+    for path, (seconds, redactions) in timings.items():
+        entry = {
+            "seconds": round(seconds, 4),
+            "pages_per_second": round(pages_total / seconds, 2) if seconds else 0.0,
+            "characters_per_second": round(characters / seconds) if seconds else 0,
+            "redactions": redactions,
+            "speedup_over_ocr": round(ocr_seconds / seconds, 1) if seconds else 0.0,
+        }
+        results["paths"][path] = entry
+        print(f"{path:<15} {entry['seconds']:>8.3f}s   {entry['pages_per_second']:>9} pages/s   "
+              f"{entry['redactions']:>5} redactions   {entry['speedup_over_ocr']}x the OCR path")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
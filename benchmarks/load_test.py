@@ -0,0 +1,146 @@
+"""
+Load test of the local redaction service (service.py).
+
+Drives a running service with synthetic scanned documents from several
+client threads at once and reports throughput, request latency percentiles,
+how many requests were refused with 503 (backpressure), and how the
+service's shared OCR batches filled up, from its /stats before and after.
+Refused requests are retried after the Retry-After the service sends, up to
+--retries times.
+
+Start the service first, e.g.
+
+    python service.py --workers 2 --max-active 4
+    python benchmarks/load_test.py --concurrency 8 --requests 32 --pages 3 --json load.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import generate_document, scan_document  # noqa: E402
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.load(response)
+
+
+def post(url, pdf_bytes, retries):
+    """POST one document. Returns (HTTP status, seconds, pages, times refused)."""
+    refused = 0
+    start = time.perf_counter()
+    while True:
+        request = urllib.request.Request(url, data=pdf_bytes, headers={"Content-Type": "application/pdf"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                body = json.load(response)
+            return response.status, time.perf_counter() - start, len(body["pages"]), refused
+        except urllib.error.HTTPError as e:
+            e.read()
+            if e.code != 503 or refused >= retries:
+                return e.code, time.perf_counter() - start, 0, refused
+            refused += 1
+            time.sleep(float(e.headers.get("Retry-After") or 1))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765", help="Where the service listens")
+    parser.add_argument("--mode", choices=["conservative", "aggressive"], default="aggressive")
+    parser.add_argument("--concurrency", type=int, default=8, help="Client threads")
+    parser.add_argument("--requests", type=int, default=32, help="Documents sent in total")
+    parser.add_argument("--documents", type=int, default=8, help="Distinct documents, sent in turn")
+    parser.add_argument("--pages", type=int, default=3, help="Pages per document")
+    parser.add_argument("--degradation", type=float, default=0.2, help="0..1 scan degradation")
+    parser.add_argument("--retries", type=int, default=10, help="Retries of a request refused with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    documents = [
+        scan_document(generate_document(args.pages, seed=args.seed + index)[0], args.degradation, seed=args.seed + index)
+        for index in range(args.documents)
+    ]
+    url = f"{args.url.rstrip('/')}/redact?mode={args.mode}"
+    before = get_json(f"{args.url.rstrip('/')}/stats")
+
+    outcomes = []
+    lock = threading.Lock()
+    next_request = iter(range(args.requests))
+
+    def client():
+        while True:
+            with lock:
+                index = next(next_request, None)
+            if index is None:
+                return
+            outcome = post(url, documents[index % len(documents)], args.retries)
+            with lock:
+                outcomes.append(outcome)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    after = get_json(f"{args.url.rstrip('/')}/stats")
+
+    statuses = Counter(status for status, _, _, _ in outcomes)
+    latencies = [latency for status, latency, _, _ in outcomes if status == 200]
+    pages = sum(count for _, _, count, _ in outcomes)
+    batches = after["batcher"]["batches"] - before["batcher"]["batches"]
+    batch_pages = after["batcher"]["pages"] - before["batcher"]["pages"]
+    batch_regions = after["batcher"]["regions"] - before["batcher"]["regions"]
+    results = {
+        "config": {
+            "mode": args.mode, "concurrency": args.concurrency, "requests": args.requests,
+            "documents": args.documents, "pages": args.pages, "degradation": args.degradation, "seed": args.seed,
+        },
+        "seconds": round(seconds, 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "refusals": sum(refused for _, _, _, refused in outcomes),
+        "documents_per_second": round(statuses[200] / seconds, 3) if seconds else 0.0,
+        "pages_per_second": round(pages / seconds, 3) if seconds else 0.0,
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.5), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(max(latencies, default=0.0), 3),
+        },
+        "batches": batches,
+        "mean_batch_pages": round(batch_pages / batches, 2) if batches else 0.0,
+        "mean_batch_regions": round(batch_regions / batches, 2) if batches else 0.0,
+    }
+    print(f"{statuses[200]} of {args.requests} documents in {results['seconds']}s   "
+          f"{results['documents_per_second']} documents/s   {results['pages_per_second']} pages/s")
+    print("latency " + "   ".join(f"{name} {value}s" for name, value in results["latency_seconds"].items()))
+    print(f"refused with 503: {results['refusals']} times   statuses: {results['statuses']}")
+    print(f"OCR batches: {batches}, {results['mean_batch_pages']} pages and {results['mean_batch_regions']} regions each")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if statuses[200] == args.requests else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+"""
+Reproducible benchmark suite for the redaction pipeline.
+
+Builds a synthetic corpus (see synthetic.py), then measures every stage the
+app runs: rendering/triage, OCR, redaction in both modes and the exporters.
+Throughput is reported in pages/s (MB/s of text for redaction) together with
+the peak Python heap per stage, and redaction recall is checked against the
+known PII of the same corpus. Results are written as JSON; with --baseline
+the run fails when throughput or recall regresses beyond the tolerance.
+
+    python benchmarks/run_benchmarks.py --documents 3 --pages 10 --json bench.json
+    python benchmarks/run_benchmarks.py --json new.json --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_IN_PLACE, PDF_OUTPUT_RETYPESET, create_writer  # noqa: E402
+from pipeline import ocr_stage, render_pages  # noqa: E402
+from redaction import get_engine  # noqa: E402
+from synthetic import generate_corpus  # noqa: E402
+
+MODES = ("conservative", "aggressive")
+
+# Redaction of a small corpus is repeated until it has run at least this long
+MIN_REDACTION_SECONDS = 0.5
+
+# Recall may drop by this much against the baseline before the run fails
+RECALL_TOLERANCE = 0.005
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def measure(fn, trace_memory):
+    """Run fn once; return (result, seconds, peak traced heap in MB or None)."""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def stage_entry(pages, seconds, peak_mb):
+    return {
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "pages_per_s": round(pages / seconds, 3) if seconds else None,
+        "peak_heap_mb": round(peak_mb, 2) if peak_mb is not None else None,
+    }
+
+
+def bench_render(corpus, trace_memory):
+    """Triage, text-layer extraction and rasterization of the regions that need OCR."""
+    def run():
+        return {entry["name"]: list(render_pages(entry["pdf_bytes"])) for entry in corpus}
+
+    rendered, seconds, _ = measure(run, False)
+    peak = measure(run, True)[2] if trace_memory else None
+    pages = sum(len(doc_pages) for doc_pages in rendered.values())
+    return rendered, stage_entry(pages, seconds, peak)
+
+
+def bench_ocr(rendered, workers, batch_size):
+    """OCR every rendered region, bypassing the cache."""
+    todo = [page for doc_pages in rendered.values() for page in doc_pages if page["images"]]
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    done = list(ocr_stage(iter(todo), workers=workers, batch_size=batch_size, cache=None))
+    seconds = time.perf_counter() - start
+    entry = stage_entry(len(done), seconds, None)
+    entry["peak_rss_growth_mb"] = round(peak_rss_mb() - rss_before, 1)
+    return entry
+
+
+def bench_redaction(documents, trace_memory):
+    """Throughput of both redaction modes over all extracted page text."""
+    texts = [page["text"] for doc_pages in documents.values() for page in doc_pages]
+    mb = sum(len(text.encode("utf-8")) for text in texts) / (1024 * 1024)
+    results = {}
+    for mode in MODES:
+        engine = get_engine(mode)
+
+        def run():
+            return [engine.apply(text, list(engine.find(text))) for text in texts]
+
+        rounds = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            rounds += 1
+            seconds = time.perf_counter() - start
+            if seconds >= MIN_REDACTION_SECONDS:
+                break
+        peak = measure(run, True)[2] if trace_memory else None
+        results[mode] = {
+            "text_mb": round(mb, 4),
+            "rounds": rounds,
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(mb * rounds / seconds, 3),
+            "pages_per_s": round(len(texts) * rounds / seconds, 3),
+            "peak_heap_mb": round(peak, 2) if peak is not None else None,
+        }
+    return results
+
+
+def redact_documents(documents, mode):
+    engine = get_engine(mode)
+    for doc_pages in documents.values():
+        for page in doc_pages:
+            page["matches"] = list(engine.find(page["text"]))
+            page["redacted"] = engine.apply(page["text"], page["matches"])
+
+
+def bench_export(corpus, documents, trace_memory):
+    """Build every output format for every document."""
+    pdf_bytes = {entry["name"]: entry["pdf_bytes"] for entry in corpus}
+    variants = {
+        "pdf": (FORMAT_PDF, PDF_OUTPUT_RETYPESET),
+        "pdf_in_place": (FORMAT_PDF, PDF_OUTPUT_IN_PLACE),
+        "docx": (FORMAT_DOCX, PDF_OUTPUT_RETYPESET),
+    }
+    pages = sum(len(doc_pages) for doc_pages in documents.values())
+    results = {}
+    for name, (fmt, pdf_output) in variants.items():
+        def run():
+            sizes = 0
+            for doc_name, doc_pages in documents.items():
+                writer = create_writer(fmt, pdf_bytes[doc_name], pdf_output)
+                for page in doc_pages:
+                    writer.write_page(page)
+                sizes += len(writer.to_bytes())
+            return sizes
+
+        output_bytes, seconds, _ = measure(run, False)
+        peak = measure(run, True)[2] if trace_memory else None
+        results[name] = stage_entry(pages, seconds, peak)
+        results[name]["output_mb"] = round(output_bytes / (1024 * 1024), 3)
+    return results
+
+
+def recall(corpus, documents, mode):
+    """
+    Share of the ground-truth values no longer present in the redacted text, overall and per category.
+
+    Conservative mode is only expected to catch labeled values, aggressive mode all of them.
+    Values that never made it into the extracted text (OCR misreads) are not
+    counted against the redaction rules; their share is reported as "extracted".
+    """
+    found = {}
+    total = {}
+    expected = extracted = 0
+    for entry in corpus:
+        pages = documents[entry["name"]]
+        for item in entry["truth"]:
+            if mode == "conservative" and not item["labeled"]:
+                continue
+            expected += 1
+            page = pages[item["page"]] if item["page"] < len(pages) else None
+            if page is None or item["value"] not in page["text"]:
+                continue
+            extracted += 1
+            hit = item["value"] not in page["redacted"]
+            for key in ("overall", item["category"]):
+                total[key] = total.get(key, 0) + 1
+                found[key] = found.get(key, 0) + hit
+    scores = {key: round(found[key] / total[key], 4) for key in total}
+    scores["extracted"] = round(extracted / expected, 4) if expected else 1.0
+    return scores
+
+
+def run_suite(args):
+    corpus = list(generate_corpus(args.documents, args.pages, args.noise, args.degradation, not args.no_scans, args.seed))
+    results = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {
+            "documents": args.documents, "pages": args.pages, "noise": args.noise,
+            "degradation": args.degradation, "scans": not args.no_scans, "seed": args.seed,
+            "ocr_workers": args.ocr_workers, "ocr_batch_size": args.ocr_batch_size,
+        },
+        "stages": {},
+        "recall": {},
+    }
+    trace_memory = not args.no_memory
+
+    rendered, results["stages"]["render"] = bench_render(corpus, trace_memory)
+
+    # Text as the app would see it: the text layer, completed by OCR where it ran
+    documents = {name: doc_pages for name, doc_pages in rendered.items()}
+    needs_ocr = any(page["images"] for doc_pages in rendered.values() for page in doc_pages)
+    if args.skip_ocr or not needs_ocr:
+        results["stages"]["ocr"] = {"skipped": "disabled" if args.skip_ocr else "no page needs OCR"}
+    else:
+        try:
+            results["stages"]["ocr"] = bench_ocr(rendered, args.ocr_workers, args.ocr_batch_size)
+        except Exception as e:  # No models available, no easyocr installed, ...
+            results["stages"]["ocr"] = {"skipped": f"{type(e).__name__}: {e}"}
+    ocr_ran = "skipped" not in results["stages"]["ocr"]
+    if not ocr_ran:
+        # Recall on scans is meaningless without OCR
+        documents = {entry["name"]: rendered[entry["name"]] for entry in corpus if not entry["scanned"]}
+        corpus = [entry for entry in corpus if not entry["scanned"]]
+    for doc_pages in documents.values():
+        for page in doc_pages:
+            page.setdefault("ocr_results", [])
+            page.setdefault("segments", [{"source": "text", "region": None, "start": 0, "end": len(page["text"])}])
+
+    results["stages"]["redaction"] = bench_redaction(documents, trace_memory)
+
+    for mode in MODES:
+        redact_documents(documents, mode)
+        for source, scanned in (("digital", False), ("scanned", True)):
+            subset = [entry for entry in corpus if entry["scanned"] == scanned]
+            if subset:
+                results["recall"].setdefault(source, {})[mode] = recall(subset, documents, mode)
+
+    # Exports of the aggressive result, the mode with the most matches to draw
+    results["stages"]["export"] = bench_export(corpus, documents, trace_memory)
+    results["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return results
+
+
+def _metrics(results):
+    """Flatten throughput and recall values to {dotted.path: value}."""
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                walk(f"{prefix}.{key}" if prefix else key, child)
+        elif isinstance(value, (int, float)) and value is not None:
+            if prefix.endswith("_per_s") or prefix.startswith("recall."):
+                flat[prefix] = value
+
+    walk("", {"stages": results.get("stages", {}), "recall": results.get("recall", {})})
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions against the baseline results."""
+    current, previous = _metrics(results), _metrics(baseline)
+    regressions = []
+    for key, old in previous.items():
+        new = current.get(key)
+        if new is None:
+            continue
+        if key.startswith("recall."):
+            if new < old - RECALL_TOLERANCE:
+                regressions.append(f"{key}: {old} -> {new}")
+        elif new < old * (1 - tolerance):
+            regressions.append(f"{key}: {old} -> {new} ({(new / old - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def print_summary(results):
+    for stage, entry in results["stages"].items():
+        if "skipped" in entry:
+            print(f"{stage:<10} skipped ({entry['skipped']})")
+        elif "pages_per_s" in entry:
+            memory = entry["peak_heap_mb"] if entry.get("peak_heap_mb") is not None else entry.get("peak_rss_growth_mb")
+            print(f"{stage:<10} {entry['pages_per_s']:>10} pages/s   peak memory {memory} MB")
+        else:
+            for name, sub in entry.items():
+                rate = f"{sub['mb_per_s']} MB/s" if "mb_per_s" in sub else f"{sub['pages_per_s']} pages/s"
+                print(f"{stage:<10} {name:<13} {rate:>16}   peak memory {sub['peak_heap_mb']} MB")
+    for source, modes in results["recall"].items():
+        for mode, values in modes.items():
+            print(f"recall     {source:<8} {mode:<13} " + "  ".join(f"{k}={v}" for k, v in values.items()))
+    print(f"peak RSS   {results['peak_rss_mb']} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=5, help="Pages per document")
+    parser.add_argument("--noise", type=float, default=0.2, help="0..1 clutter in the filler text")
+    parser.add_argument("--degradation", type=float, default=0.2, help="0..1 scan degradation")
+    parser.add_argument("--no-scans", action="store_true", help="Only benchmark born-digital documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-ocr", action="store_true")
+    parser.add_argument("--ocr-workers", type=int, default=1)
+    parser.add_argument("--ocr-batch-size", type=int, default=8)
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc passes")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative throughput drop")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args)
+    print_summary(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Synthetic PII documents with known ground truth.
+
+Generates PDFs with fpdf that contain SSNs, credit card numbers, street
+addresses and ZIP codes, both labeled ("SSN: ...") and unlabeled, mixed
+with filler text. Every inserted value is returned as ground truth so that
+redaction recall can be measured. Scanned copies are produced by rendering
+the pages and degrading the pixels (noise, speckles, faded contrast) before
+wrapping them in an image-only PDF.
+
+    python benchmarks/synthetic.py corpus/ --documents 5 --pages 20 --degradation 0.3
+"""
+import argparse
+import json
+import os
+import random
+
+import fitz  # PyMuPDF
+import numpy as np
+from fpdf import FPDF
+
+SSN = "SSN"
+CREDIT_CARD = "CREDIT CARD"
+ADDRESS = "ADDRESS"
+ZIP = "ZIP"
+
+FILLER_WORDS = (
+    "the", "account", "holder", "was", "notified", "on", "record", "payment", "due", "form", "signature",
+    "date", "policy", "number", "reference", "claim", "please", "review", "attached", "statement", "balance",
+)
+STREETS = ("Oak", "Elm", "Maple", "Pine", "Cedar", "Main", "Park", "Lake", "Hill", "Washington")
+STREET_TYPES = ("Street", "Avenue", "Road", "Drive", "Lane", "Boulevard")
+CITIES = ("Springfield", "Riverside", "Fairview", "Georgetown", "Salem", "Madison")
+
+PII_LINES_PER_PAGE = 6
+LINES_PER_PAGE = 30
+
+
+def _ssn(rng):
+    return f"{rng.randint(100, 899)}-{rng.randint(10, 99)}-{rng.randint(1000, 9999)}"
+
+
+def _card(rng, separator=" "):
+    return separator.join(str(rng.randint(1000, 9999)) for _ in range(4))
+
+
+def _street(rng):
+    return f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(STREET_TYPES)}"
+
+
+def _zip(rng):
+    return str(rng.randint(10000, 99999))
+
+
+def _pii_line(rng):
+    """Return (line, [(category, value, labeled)]) for one line carrying PII."""
+    kind = rng.randrange(8)
+    if kind == 0:
+        value = _ssn(rng)
+        return f"SSN: {value}", [(SSN, value, True)]
+    if kind == 1:
+        value = _ssn(rng)
+        return f"The applicant's number {value} was verified.", [(SSN, value, False)]
+    if kind == 2:
+        value = _card(rng)
+        return f"Credit Card: {value}", [(CREDIT_CARD, value, True)]
+    if kind == 3:
+        value = _card(rng, "-")
+        return f"Charged to {value} on file.", [(CREDIT_CARD, value, False)]
+    if kind == 4:
+        if rng.random() < 0.5:
+            street = _street(rng)
+            return f"Address: {street}, {rng.choice(CITIES)}", [(ADDRESS, street, True)]
+        zip_code = _zip(rng)
+        return f"ZIP: {zip_code}", [(ZIP, zip_code, True)]
+    if kind == 5:
+        street = _street(rng)
+        return f"Deliver to {street} before noon.", [(ADDRESS, street, False)]
+    if kind == 6:
+        zip_code = _zip(rng)
+        return f"Postal code {zip_code} on the mail label.", [(ZIP, zip_code, False)]
+    zip_code = _zip(rng)
+    return f"{rng.choice(CITIES)}, IL {zip_code}", [(ZIP, zip_code, False)]
+
+
+def _noise_line(rng, noise):
+    """Filler text; higher noise adds reference numbers and stray symbols that look like data."""
+    words = [rng.choice(FILLER_WORDS) for _ in range(rng.randint(6, 14))]
+    if rng.random() < noise:
+        words.insert(rng.randrange(len(words)), f"#{rng.randint(1000, 999999)}")
+    if rng.random() < noise:
+        words.insert(rng.randrange(len(words)), rng.choice(("|", "~", "°", "%", "/")) * rng.randint(1, 3))
+    return " ".join(words)
+
+
+def generate_document(pages=10, seed=0, noise=0.2):
+    """
+    Build a born-digital PDF with known PII.
+
+    Args:
+        pages: Number of pages
+        seed: Random seed, the same arguments always give the same document
+        noise: 0..1, amount of number-like clutter in the filler text
+
+    Returns:
+        (pdf_bytes, truth): truth is a list of dicts with page, category, value and labeled
+    """
+    rng = random.Random(seed)
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False)
+    pdf.set_font("Arial", size=11)
+    truth = []
+    for page_num in range(pages):
+        pdf.add_page()
+        pii_rows = set(rng.sample(range(LINES_PER_PAGE), PII_LINES_PER_PAGE))
+        for row in range(LINES_PER_PAGE):
+            if row in pii_rows:
+                line, values = _pii_line(rng)
+                truth.extend(
+                    {"page": page_num, "category": category, "value": value, "labeled": labeled}
+                    for category, value, labeled in values
+                )
+            else:
+                line = _noise_line(rng, noise)
+            pdf.cell(0, 8, line, ln=1)
+    data = pdf.output(dest="S")
+    return (data.encode("latin-1") if isinstance(data, str) else bytes(data)), truth
+
+
+FORM_LETTERHEAD = ("ACME MUTUAL INSURANCE COMPANY", "1200 Harbor Boulevard, Suite 400, Springfield", "Claims Department")
+FORM_BOILERPLATE = (
+    "Please complete every field of this form and return it within thirty days.",
+    "Incomplete forms will be returned to the sender without further review.",
+)
+FORM_FOOTER = ("Form CL-7 rev. 2024. Confidential: contains personal information.",)
+
+
+def generate_form(pages=10, seed=0):
+    """
+    Build a born-digital form: the same letterhead, boilerplate and footer on
+    every page, with a PII line and filler filled in per page.
+
+    Returns:
+        (pdf_bytes, truth), as generate_document
+    """
+    rng = random.Random(seed)
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=False)
+    truth = []
+    for page_num in range(pages):
+        pdf.add_page()
+        pdf.set_font("Arial", "B", size=14)
+        pdf.cell(0, 8, FORM_LETTERHEAD[0], ln=1)
+        pdf.set_font("Arial", size=10)
+        for line in FORM_LETTERHEAD[1:]:
+            pdf.cell(0, 6, line, ln=1)
+        pdf.ln(24)
+        pdf.set_font("Arial", size=11)
+        for line in FORM_BOILERPLATE:
+            pdf.cell(0, 8, line, ln=1)
+        pdf.ln(8)
+        line, values = _pii_line(rng)
+        truth.extend({"page": page_num, "category": c, "value": v, "labeled": l} for c, v, l in values)
+        pdf.cell(0, 8, line, ln=1)
+        for _ in range(8):
+            pdf.cell(0, 8, _noise_line(rng, 0.2), ln=1)
+        pdf.set_y(-30)
+        pdf.set_font("Arial", size=9)
+        for line in FORM_FOOTER:
+            pdf.cell(0, 6, line, ln=1)
+    data = pdf.output(dest="S")
+    return (data.encode("latin-1") if isinstance(data, str) else bytes(data)), truth
+
+
+def degrade_pixels(samples, degradation, rng):
+    """Add scanner noise to a grayscale uint8 image: gaussian noise, speckles and faded contrast."""
+    image = samples.astype(np.float32)
+    image = 255 - (255 - image) * (1 - 0.5 * degradation)  # Faded ink
+    image += rng.normal(0, 40 * degradation, image.shape)
+    speckles = rng.random(image.shape) < 0.01 * degradation
+    image[speckles] = rng.choice([0, 255], size=int(speckles.sum()))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def scan_document(pdf_bytes, degradation=0.2, dpi=150, seed=0, skew=0.0):
+    """
+    Turn a born-digital PDF into an image-only "scan" of it.
+
+    Args:
+        degradation: 0 (clean render) .. 1 (heavily degraded)
+        dpi: Scan resolution
+        skew: Largest tilt of a page in degrees; each page gets a random one up to it, either way
+    """
+    rng = np.random.default_rng(seed)
+    source = fitz.open(stream=pdf_bytes, filetype="pdf")
+    scanned = fitz.open()
+    for page in source:
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        if skew:
+            matrix.prerotate(rng.uniform(-skew, skew))  # The tilted page is squeezed back into the page size
+        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY)
+        samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+        degraded = degrade_pixels(samples, degradation, rng)
+        image = fitz.Pixmap(fitz.csGRAY, pix.width, pix.height, degraded.tobytes(), False)
+        out_page = scanned.new_page(width=page.rect.width, height=page.rect.height)
+        out_page.insert_image(out_page.rect, stream=image.tobytes("jpeg", jpg_quality=75))  # Scanners write JPEG
+    data = scanned.tobytes(deflate=True)
+    scanned.close()
+    source.close()
+    return data
+
+
+def generate_corpus(documents=3, pages=10, noise=0.2, degradation=0.2, scanned=True, seed=0):
+    """
+    Yield corpus entries: dicts with name, pdf_bytes, truth and scanned.
+
+    Every document is produced born-digital and, if scanned is set, also as a degraded scan.
+    """
+    for index in range(documents):
+        pdf_bytes, truth = generate_document(pages, seed=seed + index, noise=noise)
+        yield {"name": f"doc{index:03d}", "pdf_bytes": pdf_bytes, "truth": truth, "scanned": False}
+        if scanned:
+            yield {
+                "name": f"doc{index:03d}_scan",
+                "pdf_bytes": scan_document(pdf_bytes, degradation, seed=seed + index),
+                "truth": truth,
+                "scanned": True,
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic PII corpus with ground truth.")
+    parser.add_argument("output_dir")
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.2)
+    parser.add_argument("--degradation", type=float, default=0.2)
+    parser.add_argument("--no-scans", action="store_true", help="Only write the born-digital documents")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for entry in generate_corpus(args.documents, args.pages, args.noise, args.degradation, not args.no_scans, args.seed):
+        with open(os.path.join(args.output_dir, entry["name"] + ".pdf"), "wb") as f:
+            f.write(entry["pdf_bytes"])
+        with open(os.path.join(args.output_dir, entry["name"] + ".truth.json"), "w") as f:
+            json.dump(entry["truth"], f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Near-duplicate detection of rendered regions, so repeated boilerplate is OCR'd once.
+
+Forms repeat the same letterhead, paragraphs and footers on every page and in
+every document. The OCR cache (ocr_cache) only helps when the pixels are
+identical, and two scans of the same letterhead never are. Here every
+rendered region (whole pages, and the header and footer bands rasterize
+splits off) is summarized by a digest of its pixels, a block signature (the
+mean gray level of each BLOCK x BLOCK pixel block) and a 256-bit difference
+hash computed from the signature.
+
+A region with the same digest as an earlier one reuses its results, from any
+document. Anything looser is only trusted for the header and footer bands of
+the same document (NEAR_DUPLICATE_BANDS): a band whose hash is within
+HASH_MAX_DISTANCE bits of an earlier band of the same kind, with a signature
+of about the same size, is a candidate, and it is reused when no block of the
+two signatures differs by more than BLOCK_TOLERANCE gray levels. Block means
+cannot tell one digit of a number from another, so bodies, whole regions and
+anything of another document are always OCR'd fresh unless their pixels are
+identical: a form must never be read with another person's text.
+
+The index lives in memory, is shared by every document of the process and
+evicts the least recently used signatures beyond REDACTOR_DEDUP_MB. Regions
+still being OCR'd are in the index too, as futures, so the pages of one
+document that are in flight together share one OCR of their letterhead.
+
+    REDACTOR_DEDUP      0 disables near-duplicate reuse
+    REDACTOR_DEDUP_MB   memory for signatures (default 64)
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+
+import numpy as np
+
+from rasterize import BAND_FOOTER, BAND_HEADER
+
+DEDUP_ENABLED = os.environ.get("REDACTOR_DEDUP", "1") != "0"
+DEDUP_MAX_BYTES = int(float(os.environ.get("REDACTOR_DEDUP_MB", "64")) * 1024 * 1024)
+
+BLOCK = 8  # Pixels per side of a signature block
+HASH_SIZE = 16  # The difference hash compares HASH_SIZE + 1 columns on HASH_SIZE rows: 256 bits
+HASH_MARGIN = 8  # Gray levels a block must exceed its left neighbour by; keeps the bits of blank paper stable
+HASH_MAX_DISTANCE = 24
+BLOCK_TOLERANCE = 24
+# Signatures this many blocks apart in height or width are still compared, on their common part
+SHAPE_TOLERANCE = 1
+# Bands compared by signature, within one document; everything else only matches its exact pixels
+NEAR_DUPLICATE_BANDS = (BAND_HEADER, BAND_FOOTER)
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def block_signature(frame):
+    """Mean gray level of every BLOCK x BLOCK block of a grayscale frame; None for anything else or anything smaller."""
+    if getattr(frame, "ndim", 0) != 2:
+        return None
+    rows, cols = frame.shape[0] // BLOCK, frame.shape[1] // BLOCK
+    if not rows or not cols:
+        return None
+    blocks = frame[:rows * BLOCK, :cols * BLOCK].reshape(rows, BLOCK, cols, BLOCK)
+    return blocks.mean(axis=(1, 3), dtype=np.float32).astype(np.uint8)
+
+
+def difference_hash(signature):
+    """256-bit difference hash of a block signature: is each sampled block clearly brighter than its left neighbour."""
+    rows = ((np.arange(HASH_SIZE) + 0.5) * signature.shape[0] / HASH_SIZE).astype(int)
+    cols = ((np.arange(HASH_SIZE + 1) + 0.5) * signature.shape[1] / (HASH_SIZE + 1)).astype(int)
+    grid = signature[np.ix_(rows, cols)].astype(np.int16)
+    return int.from_bytes(np.packbits(grid[:, 1:] - grid[:, :-1] > HASH_MARGIN).tobytes(), "big")
+
+
+def pixel_digest(frame):
+    """Digest of a frame's dimensions and pixels, a band or crop of a larger frame included."""
+    digest = hashlib.blake2b(str(frame.shape).encode("utf-8"), digest_size=16)
+    digest.update(np.ascontiguousarray(frame))
+    return digest.digest()
+
+
+def _same_content(signature, other):
+    """True when no block of the common part of two signatures differs by more than BLOCK_TOLERANCE."""
+    rows = min(signature.shape[0], other.shape[0])
+    cols = min(signature.shape[1], other.shape[1])
+    difference = signature[:rows, :cols].astype(np.int16) - other[:rows, :cols]
+    return np.abs(difference).max() <= BLOCK_TOLERANCE
+
+
+class _Entry:
+    __slots__ = ("signature", "hash", "digest", "band", "future", "owner")
+
+    def __init__(self, signature, hash_value, digest, band, owner):
+        self.signature = signature
+        self.hash = hash_value
+        self.digest = digest
+        self.band = band
+        self.future = Future()
+        self.owner = owner
+
+
+class DedupIndex:
+    """
+    In-memory index of the regions OCR'd so far, looked up by perceptual similarity.
+
+    Args:
+        max_bytes: Memory for signatures before the least recently used are evicted
+    """
+
+    def __init__(self, max_bytes=DEDUP_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()  # id(entry) -> (bucket, entry), least recently used first
+        self._buckets = defaultdict(list)  # context -> entries
+        self._lock = threading.Lock()
+
+    def _matches(self, entry, signature, hash_value, digest, band, owner):
+        future = entry.future
+        if future.done() and future.exception() is not None:
+            return False
+        if entry.owner is not owner:
+            # Another document: only identical pixels, and never while its OCR is still running
+            return future.done() and entry.digest == digest
+        if entry.digest == digest:
+            return True
+        if band not in NEAR_DUPLICATE_BANDS or entry.band != band:
+            return False
+        if (abs(entry.signature.shape[0] - signature.shape[0]) > SHAPE_TOLERANCE
+                or abs(entry.signature.shape[1] - signature.shape[1]) > SHAPE_TOLERANCE):
+            return False
+        if bin(hash_value ^ entry.hash).count("1") > HASH_MAX_DISTANCE:
+            return False
+        return _same_content(signature, entry.signature)
+
+    def claim(self, context, image, owner, band=None):
+        """
+        Look a rendered region up, or register it as about to be OCR'd.
+
+        Args:
+            context: What else the OCR result depends on, e.g. the engine version and render settings
+            image: The rendered region
+            owner: Token of the caller's document; near-duplicates and unfinished OCR are only shared within it
+            band: The region's band (see rasterize.split_bands); only NEAR_DUPLICATE_BANDS match near-duplicates
+
+        Returns:
+            (future, owned): a Future of the region's OCR results and whether the
+            caller owns it, i.e. must set its result (or exception) after OCR'ing
+            the region. When owned is False the results come from an identical
+            region, or a near-duplicate header or footer of the same document.
+            (None, True) when the region cannot be indexed: too small, or not a grayscale array.
+        """
+        signature = block_signature(image)
+        if signature is None:
+            return None, True
+        hash_value = difference_hash(signature)
+        digest = pixel_digest(image)
+        bucket = context
+        with self._lock:
+            for entry in reversed(self._buckets.get(bucket, ())):
+                if not self._matches(entry, signature, hash_value, digest, band, owner):
+                    continue
+                self._entries.move_to_end(id(entry))
+                self.hits += 1
+                return entry.future, False
+            self.misses += 1
+            entry = _Entry(signature, hash_value, digest, band, owner)
+            self._buckets[bucket].append(entry)
+            self._entries[id(entry)] = (bucket, entry)
+            self.bytes += signature.nbytes
+            self._evict()
+        return entry.future, True
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            _, (bucket, entry) = self._entries.popitem(last=False)
+            self._buckets[bucket].remove(entry)
+            if not self._buckets[bucket]:
+                del self._buckets[bucket]
+            self.bytes -= entry.signature.nbytes  # A pending future still reaches whoever already holds it
+
+    def map(self, context, images, run, bands=None):
+        """
+        OCR a list of images, reusing identical images, and near-duplicate bands within the list.
+
+        Args:
+            context: See claim()
+            images: Images to OCR, all of one document
+            run: Called with the images that need OCR, returns their results in order
+            bands: The band of every image, see claim() (None = none is a header or footer)
+
+        Returns:
+            The results of every image, in order
+        """
+        owner = object()
+        bands = bands or [None] * len(images)
+        claims = [self.claim(context, image, owner, band) for image, band in zip(images, bands)]
+        todo = [i for i, (_, owned) in enumerate(claims) if owned]
+        results = [None] * len(images)
+        try:
+            for i, result in zip(todo, run([images[i] for i in todo])):
+                results[i] = result
+                resolve(claims[i][0], result)
+        except Exception as e:
+            for i in todo:
+                resolve(claims[i][0], error=e)
+            raise
+        for i, (future, owned) in enumerate(claims):
+            if not owned:
+                results[i] = future.result()
+        return results
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self.bytes = 0
+
+
+def resolve(future, result=None, error=None):
+    """
+    Complete an owned future from claim() with the region's OCR results, or
+    with the error that stopped its OCR; failed entries are never reused.
+    """
+    if future is None or future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def get_default_index():
+    """Return the process-wide DedupIndex, or None when disabled with REDACTOR_DEDUP=0."""
+    global _default_index
+    if not DEDUP_ENABLED:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = DedupIndex()
+        return _default_index
@@ -0,0 +1,346 @@
+"""
+Native ingestion of Word (.docx) and plain-text documents.
+
+Text that already exists as text is not rendered and OCR'd: each paragraph
+is redacted on its own with the engine of the selected mode (the rules
+redact_sensitive_information applies), and the redacted document is written
+in the format it came in.
+
+Word documents: every paragraph of every part that holds text (DOCX_TEXT_PARTS:
+the body with its tables and text boxes, headers, footers, footnotes,
+endnotes and comments). A paragraph's text is that of its own w:t and
+w:delText (tracked deletions) elements, those of a text box anchored in it
+being a paragraph of their own. A redacted span is rewritten inside those
+elements: its label goes into the element where the span starts and the rest
+of the span is removed from the elements after it, so every run keeps its
+formatting and only the characters of the span change. Documents with text
+this cannot reach (charts, SmartArt, embedded objects) are refused with
+UnsupportedDocument rather than passed through; pictures are kept as they
+are. python-docx holds the parsed XML of the document; no copy of the
+document's text is built besides the preview.
+
+Plain text: read line by line and redacted one paragraph (lines up to a
+blank line, at most MAX_PARAGRAPH_CHARS) at a time, each written out as soon
+as it is done, so a file of any size needs memory for one paragraph. Line
+endings, the encoding and any byte order mark are kept as they are. The
+encoding is told from a byte order mark, else from the first
+ENCODING_SAMPLE_BYTES: UTF-16 when it holds NUL bytes, UTF-8 when it decodes
+as such, Windows-1252 otherwise. Bytes that do not decode raise
+UnicodeDecodeError instead of being replaced.
+
+python-docx is imported when a Word document is read, not when the app starts.
+"""
+import codecs
+import io
+import os
+import time
+from collections import Counter
+
+from metrics import STAGE_REDACT, STAGE_WRITE, PipelineMetrics
+from redaction import get_engine, redaction_label
+
+KIND_DOCX = "docx"
+KIND_TEXT = "txt"
+DOCUMENT_KINDS = {".docx": KIND_DOCX, ".txt": KIND_TEXT}
+
+# Byte order marks, longest first: the UTF-32 LE mark starts with the UTF-16 LE one
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+)
+# Bytes looked at to tell the encoding of a plain-text file without a byte order mark
+ENCODING_SAMPLE_BYTES = 64 * 1024
+# Single-byte encoding of text that is not UTF-8
+LEGACY_ENCODING = "cp1252"
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+# Parts whose paragraphs are redacted
+DOCX_TEXT_PARTS = (
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.endnotes+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.comments+xml",
+)
+# Parts with text that is not in WordprocessingML paragraphs
+DOCX_UNSUPPORTED_PARTS = {
+    "application/vnd.openxmlformats-officedocument.drawingml.chart+xml": "charts",
+    "application/vnd.openxmlformats-officedocument.drawingml.chartshapes+xml": "charts",
+    "application/vnd.openxmlformats-officedocument.drawingml.diagramData+xml": "SmartArt",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document.glossary+xml": "building blocks",
+    "application/vnd.openxmlformats-officedocument.oleObject": "embedded objects",
+    "application/vnd.openxmlformats-officedocument.package": "embedded documents",
+}
+
+# A plain-text paragraph is cut at the next line end once it is this long
+MAX_PARAGRAPH_CHARS = 64 * 1024
+# Characters of redacted text kept for the preview
+PREVIEW_CHARS = 200 * 1024
+
+
+class UnsupportedDocument(ValueError):
+    """Raised for a Word document with text that cannot be redacted in place, see DOCX_UNSUPPORTED_PARTS."""
+
+
+def document_kind(name):
+    """KIND_DOCX or KIND_TEXT for a file name handled natively, None for anything else (e.g. PDFs)."""
+    return DOCUMENT_KINDS.get(os.path.splitext(name)[1].lower())
+
+
+class TextRedaction:
+    """
+    What was redacted in a native document, and the redacted file.
+
+    Attributes:
+        kind: KIND_DOCX or KIND_TEXT
+        encoding: Text encoding of a plain-text document, also that of data; None for Word
+        data: The redacted document, in the input's format
+        paragraphs: Paragraphs read
+        characters: Characters read
+        redactions: One dict per redacted span: paragraph, start, end (within the paragraph), category, rule
+        counts: Redactions per category
+        preview: The start of the redacted text, at most PREVIEW_CHARS characters
+        seconds: Wall time of the whole document
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.encoding = None
+        self.data = b""
+        self.paragraphs = 0
+        self.characters = 0
+        self.redactions = []
+        self.counts = Counter()
+        self.preview = ""
+        self.seconds = 0.0
+        self._preview_parts = []
+        self._preview_chars = 0
+
+    def _record(self, text, redacted, matches):
+        for match in matches:
+            self.redactions.append({
+                "paragraph": self.paragraphs, "start": match.start, "end": match.end,
+                "category": match.category, "rule": match.rule,
+            })
+            self.counts[match.category] += 1
+        self.paragraphs += 1
+        self.characters += len(text)
+        if self._preview_chars < PREVIEW_CHARS:
+            part = redacted[:PREVIEW_CHARS - self._preview_chars]
+            self._preview_parts.append(part)
+            self._preview_chars += len(part)
+
+    def _finish(self, data, started, separator):
+        self.data = data
+        self.preview = separator.join(self._preview_parts)
+        self._preview_parts = []
+        self.seconds = time.perf_counter() - started
+        return self
+
+
+def rewrite_spans(texts, matches):
+    """
+    Apply matches found in "".join(texts) to the pieces themselves.
+
+    Each match's label goes into the piece where the match starts; the rest
+    of the match is removed from the pieces it runs into. Returns the new
+    pieces, as many as before.
+    """
+    rewritten = []
+    start = 0
+    for text in texts:
+        end = start + len(text)
+        parts = []
+        position = start
+        for match in matches:
+            if match.end <= start or match.start >= end:
+                continue
+            parts.append(text[position - start:max(match.start, start) - start])
+            if start <= match.start:
+                parts.append(redaction_label(match.category))
+            position = min(match.end, end)
+        parts.append(text[position - start:])
+        rewritten.append("".join(parts))
+        start = end
+    return rewritten
+
+
+def _load_docx(source):
+    """Open a Word document with every part of DOCX_TEXT_PARTS parsed, refusing those with unsupported parts."""
+    from docx import Document
+    from docx.opc.part import PartFactory, XmlPart
+    for content_type in DOCX_TEXT_PARTS:
+        # Footnotes and endnotes have no part class of their own; as XML parts they are parsed and saved back
+        PartFactory.part_type_for.setdefault(content_type, XmlPart)
+    doc = Document(source)
+    found = sorted({
+        DOCX_UNSUPPORTED_PARTS[part.content_type] for part in doc.part.package.iter_parts()
+        if part.content_type in DOCX_UNSUPPORTED_PARTS
+    })
+    if found:
+        raise UnsupportedDocument(
+            f"the document has {', '.join(found)}, whose text cannot be redacted in place; "
+            "convert it to PDF and upload that instead"
+        )
+    return doc
+
+
+def _docx_paragraphs(doc):
+    """Every w:p of every part of DOCX_TEXT_PARTS, each with its own text elements."""
+    paragraph_tag = f"{{{W_NS}}}p"
+    text_tags = (f"{{{W_NS}}}t", f"{{{W_NS}}}delText")
+    for part in doc.part.package.iter_parts():
+        if part.content_type not in DOCX_TEXT_PARTS:
+            continue
+        for paragraph in part.element.iter(paragraph_tag):
+            # Not the elements of a text box anchored in the paragraph: that box's paragraphs come on their own
+            yield paragraph, [
+                element for element in paragraph.iter(*text_tags)
+                if next(element.iterancestors(paragraph_tag)) is paragraph
+            ]
+
+
+def redact_docx(source, mode="conservative", metrics=None):
+    """
+    Redact a Word document paragraph by paragraph, keeping its formatting.
+
+    Args:
+        source: Path or binary file object of the .docx
+        mode: "conservative" or "aggressive"
+        metrics: Optional metrics.PipelineMetrics, the redaction and writing are timed in it
+
+    Returns:
+        TextRedaction; its data is the redacted .docx
+
+    Raises:
+        UnsupportedDocument: when the document has text outside DOCX_TEXT_PARTS
+    """
+    started = time.perf_counter()
+    metrics = metrics or PipelineMetrics()
+    engine = get_engine(mode)
+    result = TextRedaction(KIND_DOCX)
+    doc = _load_docx(source)
+    for paragraph, elements in _docx_paragraphs(doc):
+        with metrics.time(STAGE_REDACT, pages=0):
+            texts = [element.text or "" for element in elements]
+            text = "".join(texts)
+            matches = list(engine.find(text))
+            if matches:
+                for element, old, new in zip(elements, texts, rewrite_spans(texts, matches)):
+                    if new != old:
+                        element.text = new
+                        element.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+        metrics.observe_redaction(text, matches)
+        result._record(text, engine.apply(text, matches) if matches else text, matches)
+    with metrics.time(STAGE_WRITE, pages=0):
+        buffer = io.BytesIO()
+        doc.save(buffer)
+    return result._finish(buffer.getvalue(), started, "\n")
+
+
+def _text_paragraphs(lines):
+    """Group lines into paragraphs: up to and including a blank line, or MAX_PARAGRAPH_CHARS."""
+    paragraph = []
+    size = 0
+    for line in lines:
+        paragraph.append(line)
+        size += len(line)
+        if not line.strip() or size >= MAX_PARAGRAPH_CHARS:
+            yield "".join(paragraph)
+            paragraph = []
+            size = 0
+    if paragraph:
+        yield "".join(paragraph)
+
+
+def detect_encoding(head, final=False):
+    """
+    Tell the encoding of plain text from its first bytes, see the module docstring.
+
+    Args:
+        head: The first bytes of the file, at most ENCODING_SAMPLE_BYTES
+        final: True when head is the whole file
+
+    Returns:
+        A codec name; a byte order mark is decoded as U+FEFF and so written back as it was
+    """
+    for mark, encoding in BYTE_ORDER_MARKS:
+        if head.startswith(mark):
+            return encoding
+    if b"\x00" in head:
+        # ASCII text in UTF-16 has a NUL in every other byte: after the character (LE) or before it (BE)
+        encoding = "utf-16-le" if head[1::2].count(0) >= head[0::2].count(0) else "utf-16-be"
+    else:
+        encoding = "utf-8"
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(head, final)
+        return encoding
+    except UnicodeDecodeError:
+        if encoding != "utf-8":
+            raise
+    codecs.getincrementaldecoder(LEGACY_ENCODING)().decode(head, final)  # Raises if not even that
+    return LEGACY_ENCODING
+
+
+def redact_text(source, out, mode="conservative", metrics=None, encoding=None):
+    """
+    Redact a plain-text file paragraph by paragraph, streaming it from source to out.
+
+    Args:
+        source: Seekable binary file object to read, from its current position
+        out: Binary file object the redacted text is written to
+        mode: "conservative" or "aggressive"
+        metrics: Optional metrics.PipelineMetrics
+        encoding: Text encoding of source, also used for out (None = detect_encoding)
+
+    Returns:
+        TextRedaction; its data is empty, the redacted text went to out
+
+    Raises:
+        UnicodeDecodeError: when source does not decode in its encoding; part of it may have gone to out
+    """
+    started = time.perf_counter()
+    metrics = metrics or PipelineMetrics()
+    engine = get_engine(mode)
+    result = TextRedaction(KIND_TEXT)
+    if encoding is None:
+        position = source.tell()
+        head = source.read(ENCODING_SAMPLE_BYTES)
+        source.seek(position)
+        encoding = detect_encoding(head, final=len(head) < ENCODING_SAMPLE_BYTES)
+    result.encoding = encoding
+    encoder = codecs.getincrementalencoder(encoding)()
+    lines = io.TextIOWrapper(source, encoding=encoding, errors="strict", newline="")
+    try:
+        for text in _text_paragraphs(lines):
+            with metrics.time(STAGE_REDACT, pages=0):
+                matches = list(engine.find(text))
+                redacted = engine.apply(text, matches) if matches else text
+            metrics.observe_redaction(text, matches)
+            with metrics.time(STAGE_WRITE, pages=0):
+                out.write(encoder.encode(redacted))
+            result._record(text, redacted, matches)
+    finally:
+        lines.detach()  # Leave source open for the caller
+    return result._finish(b"", started, "")
+
+
+def redact_document(source, kind, mode="conservative", metrics=None):
+    """
+    Redact a native document held in memory or on disk, see redact_docx and redact_text.
+
+    Returns:
+        TextRedaction with the redacted document as its data
+    """
+    if kind == KIND_DOCX:
+        return redact_docx(source, mode, metrics)
+    if kind == KIND_TEXT:
+        out = io.BytesIO()
+        result = redact_text(source, out, mode, metrics)
+        result.data = out.getvalue()
+        return result
+    raise ValueError(f"Unknown document kind: {kind!r}")
@@ -0,0 +1,306 @@
+"""
+Page-by-page writers for the redacted output.
+
+Each writer accepts redacted pages one at a time through add_page(text), or
+write_page(page) for the page dicts of the streaming pipeline, so it can sit
+at the end of the pipeline and build its document while later pages are
+still being rendered and OCR'd. Every input page starts a new output page.
+
+BackgroundWriter runs a writer on a thread of its own, so the pipeline only
+queues pages for it, and the PDF and the Word document of a document are
+built (and serialized) side by side rather than one after the other.
+
+The typeset PDF uses a TrueType font so that any text the font covers comes
+out as it is: REDACTOR_PDF_FONT, else the first of PDF_FONT_CANDIDATES that
+is installed. Only without any of them does it fall back to the core Arial
+font, which is limited to Latin-1.
+
+    REDACTOR_PDF_FONT   path of a .ttf font for the typeset PDF
+
+fpdf and python-docx are imported when a writer is created, not when the
+app starts. All output is produced in memory; nothing is written to disk.
+"""
+import io
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from metrics import STAGE_EXPORT, PipelineMetrics
+from visual_redaction import VisualRedactor
+
+FORMAT_PDF = "pdf"
+FORMAT_DOCX = "docx"
+
+# How the redacted PDF is produced
+PDF_OUTPUT_RETYPESET = "retypeset"  # Redacted text typeset into a new document
+PDF_OUTPUT_IN_PLACE = "in_place"  # Redaction boxes applied to the original pages
+
+PDF_FONT = os.environ.get("REDACTOR_PDF_FONT")
+# Unicode TrueType fonts looked for when REDACTOR_PDF_FONT is not set, the first one found is used
+PDF_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Debian, Ubuntu
+    "/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf",  # Fedora
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",  # Arch
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",  # macOS
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+)
+PDF_FONT_FAMILY = "Redactor"  # Name the TrueType font is registered under in each PDF
+
+# Pages a BackgroundWriter holds before write_page() waits for it
+WRITER_QUEUE_SIZE = 64
+
+_FINISH = object()  # Ends a BackgroundWriter's page queue
+
+
+def pdf_font_path():
+    """The TrueType font the typeset PDF uses, or None when only the Latin-1 core font is available."""
+    if PDF_FONT:
+        return PDF_FONT
+    return next((path for path in PDF_FONT_CANDIDATES if os.path.exists(path)), None)
+
+
+class _GlyphSubset(list):
+    """
+    The code points fpdf 1.x records as used by a TrueType font, each once.
+
+    fpdf appends every character it typesets to a plain list and, when the
+    document is written, tests each of the font's code points against that
+    list, which is quadratic in the length of the text. Duplicates are
+    dropped here and membership is looked up in a set.
+    """
+
+    def __init__(self, items=()):
+        super().__init__(dict.fromkeys(items))
+        self._seen = set(self)
+
+    def append(self, uni):
+        if uni not in self._seen:
+            self._seen.add(uni)
+            super().append(uni)
+
+    def __contains__(self, uni):
+        return uni in self._seen
+
+
+class PdfWriter:
+    """
+    Typesets redacted pages into a new PDF, one output page (or more, when the text runs over) per input page.
+
+    Args:
+        font_path: TrueType font to typeset with, defaults to pdf_font_path()
+    """
+
+    def __init__(self, font_path=None):
+        from fpdf import FPDF
+        self.pdf = FPDF()
+        self.pdf.set_auto_page_break(auto=True, margin=15)
+        self.unicode = False
+        font_path = font_path or pdf_font_path()
+        if font_path:
+            try:
+                self.pdf.add_font(PDF_FONT_FAMILY, "", font_path, uni=True)
+            except TypeError:
+                self.pdf.add_font(PDF_FONT_FAMILY, "", font_path)  # fpdf2 versions without the uni flag
+            self.pdf.set_font(PDF_FONT_FAMILY, size=12)
+            self.unicode = True
+            font = self.pdf.current_font
+            if isinstance(font.get("subset"), list):
+                font["subset"] = _GlyphSubset(font["subset"])
+        else:
+            self.pdf.set_font("Arial", size=12)
+
+    def add_page(self, text):
+        self.pdf.add_page()
+        if not self.unicode:
+            # The core font only has Latin-1 glyphs
+            text = text.encode("latin-1", "replace").decode("latin-1")
+        self.pdf.multi_cell(0, 10, text)
+
+    def write_page(self, page):
+        self.add_page(page["redacted"])
+
+    def to_bytes(self):
+        if self.pdf.page == 0:
+            self.pdf.add_page()  # FPDF cannot write a document without pages
+        data = self.pdf.output(dest="S")
+        # fpdf 1.x returns a latin-1 str, fpdf2 a bytearray
+        return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+class WordWriter:
+    """Writes redacted pages into a Word document, separated by page breaks."""
+
+    def __init__(self):
+        from docx import Document
+        self.doc = Document()
+        self.pages = 0
+
+    def add_page(self, text):
+        if self.pages:
+            self.doc.add_page_break()
+        self.doc.add_paragraph(text)  # One paragraph per page: python-docx slows down with every paragraph added
+        self.pages += 1
+
+    def write_page(self, page):
+        self.add_page(page["redacted"])
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        self.doc.save(buffer)
+        return buffer.getvalue()
+
+    def save(self, path):
+        self.doc.save(path)
+
+
+def create_writer(fmt, pdf_bytes=None, pdf_output=PDF_OUTPUT_RETYPESET):
+    """Return a fresh writer for FORMAT_PDF or FORMAT_DOCX."""
+    if fmt == FORMAT_DOCX:
+        return WordWriter()
+    if fmt == FORMAT_PDF:
+        return VisualRedactor(pdf_bytes) if pdf_output == PDF_OUTPUT_IN_PLACE else PdfWriter()
+    raise ValueError(f"Unknown export format: {fmt!r}")
+
+
+class BackgroundWriter:
+    """
+    Runs a writer on a thread of its own.
+
+    write_page() queues the page and returns; the thread hands the pages to
+    the writer in order and, once finish() has been called, serializes the
+    document. to_bytes() waits for that. An error of the writer is raised by
+    the next write_page() or by to_bytes().
+
+    Args:
+        writer: A writer from create_writer()
+        queue_size: Pages queued before write_page() waits
+    """
+
+    def __init__(self, writer, queue_size=WRITER_QUEUE_SIZE):
+        self.writer = writer
+        self._pages = queue.Queue(queue_size)
+        self._data = Future()
+        self._cancelled = False
+        self._finished = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            page = self._pages.get()
+            if page is _FINISH:
+                break
+            if self._cancelled or self._data.done():
+                continue  # Pages are still taken so that write_page() never blocks for good
+            try:
+                self.writer.write_page(page)
+            except Exception as e:
+                self._data.set_exception(e)
+        if self._data.done():
+            return
+        if self._cancelled:
+            self._data.cancel()
+            return
+        try:
+            self._data.set_result(self.writer.to_bytes())
+        except Exception as e:
+            self._data.set_exception(e)
+
+    def write_page(self, page):
+        if self._data.done():
+            self._data.result()  # The writer failed
+        self._pages.put(page)
+
+    def finish(self):
+        """Start serializing the document once the queued pages are written."""
+        if not self._finished:
+            self._finished = True
+            self._pages.put(_FINISH)
+
+    def cancel(self):
+        """Drop the queued pages and stop the thread; to_bytes() is no longer possible."""
+        self._cancelled = True
+        self.finish()
+
+    def to_bytes(self):
+        self.finish()
+        return self._data.result()
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+
+class ResultExports:
+    """
+    The downloadable files of one processed document, built on demand.
+
+    Each format is generated the first time it is asked for, from the
+    redacted pages kept with the result, and cached from then on; build()
+    generates several formats side by side. Writers that already received
+    every page (from the pipeline's write stage) can be handed in with
+    add_writer() so that their output is not built twice.
+
+    Args:
+        pages: Pipeline page dicts of the document, in order
+        pdf_bytes: The original PDF (bytes or file path), needed for PDF_OUTPUT_IN_PLACE
+        pdf_output: PDF_OUTPUT_RETYPESET or PDF_OUTPUT_IN_PLACE
+        metrics: Optional metrics.PipelineMetrics the builds are timed in
+    """
+
+    def __init__(self, pages, pdf_bytes=None, pdf_output=PDF_OUTPUT_RETYPESET, metrics=None):
+        self.pages = pages
+        self.pdf_bytes = pdf_bytes
+        self.pdf_output = pdf_output
+        self.metrics = metrics or PipelineMetrics()
+        self.unlocated = 0  # Matches the in-place PDF could not place, see VisualRedactor
+        self._writers = {}
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add_writer(self, fmt, writer):
+        self._writers[fmt] = writer
+
+    def is_ready(self, fmt):
+        return fmt in self._data
+
+    def _writer(self, fmt):
+        """The writer of a format, with every page written to it, running on a thread of its own."""
+        with self._lock:
+            writer = self._writers.pop(fmt, None)
+        if writer is None:
+            writer = BackgroundWriter(create_writer(fmt, self.pdf_bytes, self.pdf_output))
+            for page in self.pages:
+                writer.write_page(page)
+        if isinstance(writer, BackgroundWriter):
+            writer.finish()
+        return writer
+
+    def _store(self, fmt, writer):
+        data = writer.to_bytes()
+        writer = getattr(writer, "writer", writer)
+        if isinstance(writer, VisualRedactor):
+            self.unlocated = writer.unlocated
+        self._data[fmt] = data
+
+    def get(self, fmt):
+        """Return the bytes of the given format, generating them on first use."""
+        if fmt not in self._data:
+            self.build((fmt,))
+        return self._data[fmt]
+
+    def build(self, formats):
+        """Generate every format not generated yet, at the same time."""
+        formats = [fmt for fmt in dict.fromkeys(formats) if fmt not in self._data]
+        if not formats:
+            return
+        with self.metrics.time(STAGE_EXPORT, pages=len(self.pages)):
+            writers = {fmt: self._writer(fmt) for fmt in formats}  # All of them start before any is waited for
+            for fmt, writer in writers.items():
+                self._store(fmt, writer)
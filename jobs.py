@@ -0,0 +1,269 @@
+"""
+Background redaction jobs shared by every Streamlit session of the server.
+
+Submitting a document returns a job ID straight away; the work happens on a
+small, bounded set of scheduler threads and the UI polls the job's status
+page by page. Jobs live in the process, not in the session, so a result
+survives reruns and reloads of the browser tab for JOB_TTL_SECONDS.
+
+Scheduling is round-robin at page granularity: a scheduler thread takes the
+job at the head of the run queue, advances it by one page and puts it back
+at the tail. A 300-page document and a 3-page one therefore progress at the
+same rate, and the small one finishes first. Each job's pipeline runs at
+most a few pages ahead of what has been taken from it (see pipeline), so
+no job can flood the shared OCR pool.
+
+Jobs submitted with an estimated cost (see admission) also have to fit the
+process's memory and CPU budgets. A job that does not fit waits, queued but
+not yet in the run queue, until finished jobs give their share back, and is
+then admitted in submission order; under policy "reject", or when it could
+never fit, submit() raises AdmissionRejected instead.
+
+    REDACTOR_JOB_THREADS   concurrent page steps (default: OCR workers, at least 2)
+    REDACTOR_MAX_JOBS      queued and running jobs accepted before submit() refuses
+"""
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from admission import get_admission
+from metrics import PipelineMetrics, publish, publish_failure
+from ocr_engine import default_workers
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_EMPTY = "empty"  # Finished, but no text could be extracted
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED = (JOB_DONE, JOB_EMPTY, JOB_FAILED, JOB_CANCELLED)
+
+PAGE_PENDING = "pending"
+PAGE_DONE = "done"
+
+DEFAULT_JOB_THREADS = int(os.environ.get("REDACTOR_JOB_THREADS", "0")) or max(2, default_workers())
+MAX_JOBS = int(os.environ.get("REDACTOR_MAX_JOBS", "32"))
+
+# Finished jobs are kept this long after they were last looked at
+JOB_TTL_SECONDS = 3600
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+class JobQueueFull(Exception):
+    """Raised by JobQueue.submit when MAX_JOBS jobs are already queued or running."""
+
+
+class Job:
+    """
+    One document being redacted.
+
+    Args:
+        name: Display name, e.g. the uploaded file name
+        steps: Factory called with the job's PipelineMetrics when the job starts.
+            It returns a generator that yields each page as it is done (as
+            pipeline.iter_redact_pdf does) and returns the job's result, or
+            None when no text could be extracted
+        key: Anything the submitter uses to recognize the job later, e.g. the upload
+        cost: admission.JobCost estimated for the document, or None to skip admission
+    """
+
+    def __init__(self, name, steps, key=None, cost=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.key = key
+        self.cost = cost
+        self.waiting = False  # Queued until the memory and CPU budgets have room
+        self.status = JOB_QUEUED
+        self.error = None
+        self.pages = []
+        self.result = None
+        self.total_pages = None
+        self.metrics = PipelineMetrics()
+        self.created = time.time()
+        self.last_seen = self.created
+        self._steps_factory = steps
+        self._steps = None
+        self._cancelled = False
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def cancel(self):
+        self._cancelled = True
+
+    def status_dict(self):
+        """Snapshot for polling: overall state and one entry per page."""
+        self.last_seen = time.time()
+        total = self.total_pages if self.total_pages is not None else self.metrics.total_pages
+        done = {page["page"]: page for page in self.pages}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "pages_total": total,
+            "pages_done": len(done),
+            "elapsed_seconds": round(self.metrics.wall_seconds, 2) if self.status != JOB_QUEUED else 0.0,
+            "waiting": self.waiting,
+            "estimate": self.cost.as_dict() if self.cost is not None else None,
+            "pages": [
+                {
+                    "page": number,
+                    "status": PAGE_DONE if number in done else PAGE_PENDING,
+                    "kind": done[number]["triage"]["kind"] if number in done else None,
+                    "matches": len(done[number]["matches"]) if number in done else None,
+                }
+                for number in range(total or 0)
+            ],
+        }
+
+    def _step(self):
+        """Advance the job by one page. Returns True while there is more to do."""
+        if self._cancelled:
+            self._finish(JOB_CANCELLED)
+            return False
+        try:
+            if self._steps is None:
+                self.status = JOB_RUNNING
+                self.metrics = PipelineMetrics()
+                self.metrics.estimate = self.cost
+                self._steps = self._steps_factory(self.metrics)
+            self.pages.append(next(self._steps))
+            return True
+        except StopIteration as done:
+            self.result = done.value
+            self.total_pages = len(self.pages)
+            publish(self.metrics)
+            self._finish(JOB_DONE if self.result is not None else JOB_EMPTY)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            publish_failure()
+            self._finish(JOB_FAILED)
+        return False
+
+    def _finish(self, status):
+        if self._steps is not None:
+            self._steps.close()  # Stops the pipeline threads of a cancelled job
+            self._steps = None
+        self._steps_factory = None  # Drops the document bytes
+        self.status = status
+
+
+class JobQueue:
+    """
+    Round-robin scheduler of redaction jobs.
+
+    Args:
+        threads: Number of page steps run concurrently
+        max_jobs: Queued plus running jobs accepted before submit() raises JobQueueFull
+        admission: admission.AdmissionController the costs of jobs are reserved from
+    """
+
+    def __init__(self, threads=DEFAULT_JOB_THREADS, max_jobs=MAX_JOBS, admission=None):
+        self.max_jobs = max_jobs
+        self.admission = admission or get_admission()
+        self._jobs = {}
+        self._run_queue = deque()
+        self._waiting = deque()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self.admission.add_listener(self._admit_waiting)
+        for _ in range(threads):
+            threading.Thread(target=self._schedule, daemon=True).start()
+
+    def submit(self, name, steps, key=None, cost=None):
+        """
+        Queue a job and return its ID. See Job for the arguments.
+
+        Raises:
+            JobQueueFull: when max_jobs jobs are already queued or running
+            admission.AdmissionRejected: when the job's cost does not fit and may not wait
+        """
+        with self._lock:
+            self._prune()
+            active = sum(not job.finished for job in self._jobs.values())
+            if active >= self.max_jobs:
+                raise JobQueueFull(f"{active} documents are already being processed, try again shortly")
+            if cost is not None:
+                self.admission.check(cost)  # Refused now, not after queueing, if it could never fit
+            job = Job(name, steps, key, cost)
+            # Jobs waiting already keep their turn; there are none under policy "reject"
+            if cost is not None and (self._waiting or not self.admission.try_reserve(cost)):
+                job.waiting = True
+                self._waiting.append(job)
+            else:
+                self._run_queue.append(job)
+                self._ready.notify()
+            self._jobs[job.id] = job
+        return job.id
+
+    def cancel(self, job_id):
+        """Cancel a job; one still waiting for admission is finished at once."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.cancel()
+            if job.waiting:
+                self._waiting.remove(job)
+                job.waiting = False
+                job._finish(JOB_CANCELLED)
+
+    def get(self, job_id):
+        """Return the Job with that ID, or None if it is unknown or has expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.last_seen = time.time()
+        return job
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+            waiting = len(self._waiting)
+        counts = {status: statuses.count(status) for status in set(statuses)}
+        counts["waiting_for_admission"] = waiting
+        return counts
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.last_seen > JOB_TTL_SECONDS:
+                del self._jobs[job_id]
+
+    def _schedule(self):
+        while True:
+            with self._lock:
+                while not self._run_queue:
+                    self._ready.wait()
+                job = self._run_queue.popleft()
+            # A job is in the run queue or being stepped by one thread, never both
+            if job._step():
+                with self._lock:
+                    self._run_queue.append(job)
+                    self._ready.notify()
+            elif job.cost is not None:
+                self.admission.release(job.cost)  # Admits waiting jobs, see _admit_waiting
+
+    def _admit_waiting(self):
+        """Move waiting jobs to the run queue, oldest first, while their costs fit."""
+        with self._lock:
+            while self._waiting and self.admission.try_reserve(self._waiting[0].cost):
+                job = self._waiting.popleft()
+                job.waiting = False
+                self._run_queue.append(job)
+                self._ready.notify()
+
+
+def get_job_queue():
+    """Return the process-wide JobQueue, starting its threads on first use."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
@@ -1,121 +1,110 @@
-import easyocr
 import fitz  # PyMuPDF for PDF handling
-import re
-import tempfile
-from fpdf import FPDF
 import streamlit as st
 import os
-from transformers import pipeline
-from docx import Document
+from triage import summarize_triage
+from ocr_engine import DEFAULT_BATCH_SIZE, OCR_BACKEND, correct_ocr_text, default_workers, engine_version, get_pool, get_reader, ocr_sequential, result_text, warm_up
+from pipeline import iter_redact_pdf, ocr_stage, redact_pdf, render_pages
+from rasterize import MIN_DPI, pixmap_frame, plan_region
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_IN_PLACE, PDF_OUTPUT_RETYPESET, PdfWriter, WordWriter
+from redaction import ADDRESS, AGGRESSIVE, CATEGORIES, CONSERVATIVE, CREDIT_CARD, SSN
+from results import RedactionResult
+from ocr_cache import get_default_cache
+from dedup import get_default_index
+from metrics import STAGES, PipelineMetrics, publish, publish_failure
+from ner import NER_MODEL, NER_MODELS, NER_OFF
+from shards import SHARD_PAGES, is_large, iter_redact_large, spool_upload
+from documents import KIND_DOCX, document_kind, redact_document
+from preview import PREVIEW_PAGES
+from jobs import JOB_CANCELLED, JOB_DONE, JOB_EMPTY, JOB_FAILED, JOB_QUEUED, PAGE_DONE, JobQueueFull, get_job_queue
+from admission import AdmissionRejected, InvalidDocument, estimate, get_admission
 
-# Optional: Load NER model for more sophisticated address detection (commented out for now)
-# ner_model = pipeline("ner", model="dbmdz/bert-large-cased-finetuned-conll03-english")
+# Optional NER model for more sophisticated address detection, run only on the lines a cheap prefilter flags.
+# transformers is imported and the model loaded on first use, once per server, see ner.get_ner_pipeline.
 
-# Initialize EasyOCR (English language)
-reader = easyocr.Reader(['en'])  # Use CPU (-1)
+# EasyOCR (English language) is loaded on first use and shared by all sessions, see ocr_engine.get_reader.
+# Streamlit re-executes this script on every interaction, so nothing heavy may be created at module level.
+# Set REDACTOR_WARMUP=1 to load the reader (and start the OCR workers) as soon as the server starts.
+if os.environ.get("REDACTOR_WARMUP") == "1":
+    warm_up()  # Only the first call does anything
 
-# Enhanced regex patterns that account for OCR errors
-ssn_patterns = [
-    r"\b\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b",  # Handles OCR errors like < > instead of -
-    r"\b\d{3}\s*\d{2}\s*\d{4}\b"  # More flexible spacing
-]
-
-credit_card_patterns = [
-    r"\b\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b",  # Standard 4-4-4-4 format
-    r"\b\d{4}[\s\-]\d{4}[\s\-]\d{3}[A-Za-z0-9][\s\-][A-Za-z0-9]\d{3}\b"  # Handles OCR errors in last groups
-]
-
-# More precise address patterns to avoid false positives
-address_patterns = [
-    r"\b\d{1,5}\s+[A-Za-z]+\s+(?:[A-Za-z]+\s+)?(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd|Way|Court|Ct|Place|Pl|Circle|Cir)\b",
-    r"\b\d{5}(?:[-\s]\d{4})?\b"  # ZIP codes only (5 digits or 5-4 format)
-]
-
-# Function to convert PDF pages to images
+# Function to convert PDF pages to images, one whole page per image
 def pdf_to_images(pdf_file):
     doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
     images = []
     for page_num in range(doc.page_count):  # Loop through all pages
         page = doc.load_page(page_num)  # Load each page
-        pix = page.get_pixmap()  # Convert page to image (pixmap)
-        img = pix.tobytes("ppm")  # Convert to ppm image bytes
-        images.append(img)  # Append image to list
+        plan = plan_region(page, page.rect)  # Resolution that suits its text; None for a blank page
+        pix = page.get_pixmap(dpi=plan[0] if plan else MIN_DPI, colorspace=fitz.csGRAY)
+        images.append(pixmap_frame(pix))  # Grayscale array sharing the pixmap memory, EasyOCR reads it as it is
     return images
 
+# Function to run EasyOCR on each image, in parallel when more than one worker is configured
+def ocr_pages(images, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    OCR a list of page images and return the raw (box, text, confidence) results.
+
+    Args:
+        images: Page images in any format EasyOCR accepts
+        workers: Number of OCR processes (None = derive from the CPU count, 1 = run in-process)
+        batch_size: Number of text boxes recognized per batch within a page
+    """
+    workers = workers or default_workers()
+    
+    def run(todo):
+        if workers == 1 or len(todo) < 2:
+            return ocr_sequential(get_reader(), todo, batch_size)
+        return get_pool(workers).map(todo, batch_size)  # Results come back in page order
+    
+    dedup = get_default_index()
+    if dedup is None:
+        return run(images)
+    return dedup.map(engine_version(), images, run)  # Identical pages are recognized once
+
+# Function to run EasyOCR on each image and return one text per image
+def ocr_images(images, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    return [result_text(result) for result in ocr_pages(images, workers, batch_size)]  # Ignore bounding box and confidence score
+
 # Function to extract text from images using EasyOCR
-def ocr_from_images(images):
-    results = []
-    for img in images:
-        result = reader.readtext(img)  # Run OCR on the image
-        extracted_text = " ".join([text[1] for text in result])  # Extract text (ignoring bounding box and confidence score)
-        results.append(extracted_text)
-    return "\n".join(results)
+def ocr_from_images(images, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    return "\n".join(ocr_images(images, workers, batch_size))
+
+# Function to extract text page by page, using the embedded text layer where possible
+def extract_pages(pdf_file, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Extract the text of every page, only running OCR where triage says it is needed.
+
+    Text-layer pages are read straight from PyMuPDF, blank pages are skipped,
+    image pages are OCR'd whole and mixed pages get their text layer plus OCR
+    of the image regions the text layer does not cover.
+
+    Args:
+        pdf_file: File-like object holding the PDF
+        workers, batch_size: OCR parallelism, see ocr_pages
+
+    Returns:
+        (page_texts, page_report): one string per page and the triage report
+    """
+    page_texts = []
+    page_report = []
+    for page in ocr_stage(render_pages(pdf_file.read()), None, workers, batch_size, get_default_cache(), dedup=get_default_index()):
+        page_texts.append(page["text"])
+        page_report.append(page["triage"])
+    return page_texts, page_report
 
 # Function to clean OCR text and improve accuracy
 def clean_ocr_text(text):
     """Clean common OCR errors before processing"""
-    # Dictionary of common OCR character substitutions
-    ocr_corrections = {
-        '0': ['O', 'o', '°'],
-        '1': ['l', 'I', '|'],
-        '5': ['S', 's'],
-        '6': ['G', 'b'],
-        '8': ['B'],
-        'S': ['5'],
-        'O': ['0'],
-        'I': ['1', 'l'],
-        '<': ['-'],
-        '>': ['-'],
-    }
-    
-    cleaned_text = text
-    # Apply corrections (be careful not to over-correct)
-    for correct, errors in ocr_corrections.items():
-        for error in errors:
-            # Only replace in specific contexts (like potential SSN/CC patterns)
-            pass  # We'll be more conservative here
-    
-    return cleaned_text
+    # Only in number-shaped text (potential SSN/CC patterns), one character for one; the pipeline does the same to OCR text
+    return correct_ocr_text(text, enabled=True)
 
 # Enhanced function to detect sensitive patterns with OCR error tolerance
 def detect_and_redact_patterns(text):
-    """More sophisticated pattern detection that handles OCR errors"""
-    redacted_text = text
-    
-    # SSN Detection with OCR error tolerance
-    # Look for patterns like XXX-XX-XXXX but allow some OCR errors
-    import re
-    
-    # Find potential SSN patterns (even with OCR errors)
-    potential_ssns = re.finditer(r'\b\d{3}[-\s<>o]\d{2}[-\s<>o]\d{4}\b', text, re.IGNORECASE)
-    for match in potential_ssns:
-        redacted_text = redacted_text.replace(match.group(), '[REDACTED SSN]')
-    
-    # Find potential credit card patterns
-    potential_ccs = re.finditer(r'\b\d{4}[\s\-]\d{4}[\s\-]\d{3}[A-Za-z0-9][\s\-][A-Za-z0-9]\d{2,3}\b', text)
-    for match in potential_ccs:
-        redacted_text = redacted_text.replace(match.group(), '[REDACTED CREDIT CARD]')
-    
-    # Standard credit card patterns
-    potential_ccs_standard = re.finditer(r'\b\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', text)
-    for match in potential_ccs_standard:
-        redacted_text = redacted_text.replace(match.group(), '[REDACTED CREDIT CARD]')
-    
-    # Address patterns - be more conservative
-    # Only redact clear address patterns
-    address_matches = re.finditer(r'\b\d{1,4}\s+[A-Za-z]+\s+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd)\b', text, re.IGNORECASE)
-    for match in address_matches:
-        redacted_text = redacted_text.replace(match.group(), '[REDACTED ADDRESS]')
-    
-    # ZIP codes (5 digits, but not standalone numbers that might be something else)
-    zip_matches = re.finditer(r'\b\d{5}(?:-\d{4})?\b', text)
-    for match in zip_matches:
-        # Additional context check - only redact if it looks like a ZIP
-        context = text[max(0, match.start()-10):match.end()+10].lower()
-        if any(indicator in context for indicator in ['zip', 'postal', 'address', 'mail']):
-            redacted_text = redacted_text.replace(match.group(), '[REDACTED ZIP]')
-    
-    return redacted_text
+    """
+    More sophisticated pattern detection that handles OCR errors.
+    SSNs, credit cards, street addresses and ZIP codes (when the context says so)
+    are found in a single scan with the precompiled aggressive rules.
+    """
+    return AGGRESSIVE.redact(text)
 
 # SIMPLE CONSERVATIVE APPROACH - only redacts very obvious patterns
 def redact_sensitive_information_simple(text):
@@ -123,21 +112,8 @@ def redact_sensitive_information_simple(text):
     Very conservative redaction - only redacts very obvious patterns
     Use this function if you want minimal false positives
     """
-    redacted_text = text
-    
-    # Only redact very clear SSN patterns
-    redacted_text = re.sub(r'\bSSN:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b', '[REDACTED SSN]', redacted_text, flags=re.IGNORECASE)
-    redacted_text = re.sub(r'\bSocial Security:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b', '[REDACTED SSN]', redacted_text, flags=re.IGNORECASE)
-    
-    # Only redact when explicitly labeled as credit card
-    redacted_text = re.sub(r'\bCredit Card:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', '[REDACTED CREDIT CARD]', redacted_text, flags=re.IGNORECASE)
-    redacted_text = re.sub(r'\bCard Number:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b', '[REDACTED CREDIT CARD]', redacted_text, flags=re.IGNORECASE)
-    
-    # Only redact when explicitly labeled as address
-    redacted_text = re.sub(r'\bAddress:\s*[^\n]+', '[REDACTED ADDRESS]', redacted_text, flags=re.IGNORECASE)
-    redacted_text = re.sub(r'\bZIP:\s*\d{5}(?:-\d{4})?\b', '[REDACTED ZIP]', redacted_text, flags=re.IGNORECASE)
-    
-    return redacted_text
+    # Only values explicitly labeled as SSN, credit card, address or ZIP
+    return CONSERVATIVE.redact(text)
 
 # Main redaction function - now accepts mode parameter
 def redact_sensitive_information(text, mode="conservative"):
@@ -156,70 +132,303 @@ def redact_sensitive_information(text, mode="conservative"):
 
 # Function to export redacted text to PDF
 def export_to_pdf(redacted_text):
-    print(f"Redacted Text: {redacted_text[:100]}...") 
-    # Create a temporary file for PDF
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmpfile:
-        tmpfile.close()  # Close the file to ensure it's saved to disk
-        output_pdf_path = tmpfile.name  # Get the path of the temporary file
-
     # Create PDF
-    pdf = FPDF()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-
-    # Set font
-    pdf.set_font("Arial", size=12)
+    pdf = PdfWriter()
+    pdf.add_page(redacted_text)
 
-    # Add text to the PDF (handle encoding issues)
-    try:
-        pdf.multi_cell(0, 10, redacted_text.encode('latin-1', 'replace').decode('latin-1'))
-    except:
-        # Fallback for special characters
-        cleaned_text = ''.join(char if ord(char) < 128 else '?' for char in redacted_text)
-        pdf.multi_cell(0, 10, cleaned_text)
-
-    # Save the redacted PDF to the temporary file path
-    pdf.output(output_pdf_path)
-    
-    return output_pdf_path  # Return the path to the generated PDF
+    return pdf.to_bytes()  # Return the generated PDF, built in memory
 
 # Function to export redacted text to Word
 def export_to_word(redacted_text):
-    # Create a temporary file for Word
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmpfile:
-        tmpfile.close()  # Close the file to ensure it's saved to disk
-        output_word_path = tmpfile.name  # Get the path of the temporary file
-
     # Create a Word document
-    doc = Document()
-    doc.add_paragraph(redacted_text)
-    
-    # Save the redacted Word document to the temporary file path
-    doc.save(output_word_path)
+    doc = WordWriter()
+    doc.add_page(redacted_text)
     
-    return output_word_path  # Return the path to the generated Word document
+    return doc.to_bytes()  # Return the generated Word document, built in memory
 
 # Function to handle the entire document processing
-def process_pdf(pdf_file, redaction_mode="conservative"):
+def process_pdf(pdf_file, redaction_mode="conservative", ocr_workers=None, ocr_batch_size=DEFAULT_BATCH_SIZE,
+                pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), metrics=None, ner_model=None):
+    """
+    Extract, redact and prepare exports for one PDF.
+
+    Args:
+        ner_model: NER model for addresses ("off", "distilled" or "large"), defaults to REDACTOR_NER
+        export_formats: Formats written while the pages stream through the pipeline.
+            Any other format is built on demand from the result, see ResultExports.
+        metrics: Optional PipelineMetrics filled with the per-stage timings and
+            counts; its on_page callback reports progress page by page
+
+    Returns:
+        (redacted_text, exports, page_report); redacted_text and exports are None
+        when no text could be extracted
+    """
+    page_report = []
+    metrics = metrics or PipelineMetrics()
     try:
-        images = pdf_to_images(pdf_file)  # Convert PDF to images
-        extracted_text = ocr_from_images(images)  # Extract text from images using EasyOCR
-        
-        if not extracted_text.strip():
-            return None, None, None
-        
         # Use the selected redaction mode
-        mode = "conservative" if "Conservative" in redaction_mode else "aggressive"
-        redacted_text = redact_sensitive_information(extracted_text, mode=mode)  # Redact sensitive info
+        mode = "conservative" if "conservative" in redaction_mode.lower() else "aggressive"
 
-        # Export the redacted text to PDF and Word
-        output_pdf = export_to_pdf(redacted_text)
-        output_word = export_to_word(redacted_text)
+        # Wait for (or be refused) room in the server's memory and CPU budgets, see admission
+        pdf_bytes = pdf_file.read()
+        metrics.estimate = estimate(pdf_bytes, ocr_workers)
+        
+        # Pages stream through rendering, OCR, redaction and writing, so only a few are in memory at once
+        with get_admission().reserved(metrics.estimate):
+            pages, exports = redact_pdf(
+                pdf_bytes,
+                mode,
+                workers=ocr_workers,
+                batch_size=ocr_batch_size,
+                pdf_output=pdf_output,
+                export_formats=export_formats,
+                cache=get_default_cache(),  # Pages OCR'd before are not OCR'd again
+                dedup=get_default_index(),  # Nor are repeated letterheads, footers and boilerplate
+                metrics=metrics,
+                ner_model=ner_model,
+            )
+        publish(metrics)  # Totals for the dashboards, see REDACTOR_METRICS_FILE
+        page_report = [page["triage"] for page in pages]
         
-        return redacted_text, output_pdf, output_word
+        if exports is None:
+            return None, None, page_report
+        
+        redacted_text = "\n".join(page["redacted"] for page in pages)
+        
+        return redacted_text, exports, page_report
     except Exception as e:
+        publish_failure()
         st.error(f"Error processing PDF: {str(e)}")
-        return None, None, None
+        return None, None, page_report
+
+# Function to queue a document on the shared background job queue
+def submit_pdf_job(pdf_source, name, redaction_mode="conservative", ocr_workers=None, ocr_batch_size=DEFAULT_BATCH_SIZE,
+                   pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), key=None, ner_model=None):
+    """
+    Queue one PDF for redaction in the background and return the job ID.
+
+    pdf_source is the PDF as bytes, or the path of a spooled upload, which is
+    processed in large-document mode: shard by shard, resuming from the
+    checkpoints of an earlier, interrupted run (see shards). The other
+    arguments are those of process_pdf; key is stored with the job so the
+    session can recognize it on later reruns. The job's result is a
+    results.RedactionResult, or None when no text could be extracted.
+
+    The job's memory and CPU cost is estimated first; it waits in the queue
+    until the server's budgets have room for it (see admission).
+    
+    Raises:
+        JobQueueFull: when the server already has its maximum of jobs
+        AdmissionRejected: when the document does not fit the server's budgets and may not wait
+        InvalidDocument: when the upload is not a readable PDF
+    """
+    mode = "conservative" if "conservative" in redaction_mode.lower() else "aggressive"
+    
+    redact = iter_redact_large if isinstance(pdf_source, str) else iter_redact_pdf
+    
+    def steps(metrics):
+        pages, exports = yield from redact(
+            pdf_source, mode, ocr_workers, ocr_batch_size, pdf_output, export_formats,
+            cache=get_default_cache(), metrics=metrics, ner_model=ner_model, dedup=get_default_index()
+        )
+        return RedactionResult(pages, exports, mode) if exports is not None else None
+    
+    return get_job_queue().submit(name, steps, key, cost=estimate(pdf_source, ocr_workers))
+
+# Function to redact a Word or text upload directly, without rendering or OCR
+def show_text_document(uploaded_file, kind, redaction_mode, stats_placeholder):
+    """
+    Redact a .docx or .txt upload paragraph by paragraph and show the result.
+
+    It takes a fraction of the time of a PDF, so it runs in the session
+    instead of on the job queue; the result is kept in the session until the
+    upload or the mode changes.
+    """
+    mode = "conservative" if "conservative" in redaction_mode.lower() else "aggressive"
+    result_key = (uploaded_file.name, uploaded_file.size, mode)
+    
+    if st.button("🚀 Process Document", type="primary", use_container_width=True):
+        metrics = PipelineMetrics()
+        try:
+            with st.spinner("Redacting paragraphs..."):
+                uploaded_file.seek(0)
+                result = redact_document(uploaded_file, kind, mode, metrics)
+            publish(metrics)
+            st.session_state["text_result"] = (result_key, result)
+        except Exception as e:
+            publish_failure()
+            st.error(f"Error processing document: {str(e)}")
+    
+    stored = st.session_state.get("text_result")
+    if stored is None or stored[0] != result_key:
+        return
+    result = stored[1]
+    
+    st.markdown("""
+    <div class="success-message">
+        <strong>🎉 Processing completed successfully!</strong><br>
+        The text was redacted directly, no OCR was needed.
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.markdown("### 📋 Results")
+    col_metric1, col_metric2, col_metric3, col_metric4 = st.columns(4)
+    with col_metric1:
+        st.metric("SSN Redacted", result.counts[SSN])
+    with col_metric2:
+        st.metric("Credit Cards", result.counts[CREDIT_CARD])
+    with col_metric3:
+        st.metric("Addresses", result.counts[ADDRESS])
+    with col_metric4:
+        st.metric("Total Redactions", len(result.redactions))
+    
+    st.markdown("**Redacted Text:**")
+    st.text_area("", result.preview, height=300, disabled=True)
+    if len(result.preview) < result.characters:
+        st.caption("Preview of the start of the document; the download holds all of it.")
+    if result.redactions:
+        with st.expander("🔎 Redacted Items"):
+            st.dataframe(
+                [
+                    {
+                        "Paragraph": redaction["paragraph"] + 1,
+                        "Span": f"{redaction['start']}-{redaction['end']}",
+                        "Category": redaction["category"],
+                        "Rule": redaction["rule"],
+                    }
+                    for redaction in result.redactions
+                ],
+                use_container_width=True
+            )
+    
+    # The redacted document comes back in the format it was uploaded in, formatting included
+    stem = os.path.splitext(uploaded_file.name)[0]
+    if kind == KIND_DOCX:
+        st.download_button(
+            "📝 Download Redacted Word Document",
+            result.data,
+            file_name=f"{stem}.redacted.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            use_container_width=True
+        )
+    else:
+        st.download_button(
+            "📄 Download Redacted Text",
+            result.data,
+            file_name=f"{stem}.redacted.txt",
+            mime=f"text/plain; charset={result.encoding}",  # The upload's own encoding, see documents
+            use_container_width=True
+        )
+    
+    stats_placeholder.markdown(f"""
+    <div class="stats-card">
+        <strong>{len(result.redactions)}</strong><br>
+        <small>Items Redacted</small>
+    </div>
+    <div class="stats-card" style="margin-top: 0.5rem;">
+        <strong>{result.characters:,}</strong><br>
+        <small>Characters Processed</small>
+    </div>
+    <div class="stats-card" style="margin-top: 0.5rem;">
+        <strong>{result.paragraphs:,} paragraphs in {result.seconds:.2f}s</strong><br>
+        <small>Read as text, no rendering or OCR</small>
+    </div>
+    """, unsafe_allow_html=True)
+
+# Seconds between two status polls of a running job
+JOB_POLL_SECONDS = 1.0
+
+# Progress of a background job, refreshed on its own without rerunning the whole page
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None or job.finished:
+        st.rerun()  # Show the result (or the error) in a full run
+    status = job.status_dict()
+    total = status["pages_total"] or 0
+    st.progress(status["pages_done"] / total if total else 0.0)
+    if status["waiting"]:
+        st.text(f"⏳ Waiting for memory: about {status['estimate']['memory_bytes'] / 2**20:.0f} MB needed...")
+    elif status["status"] == JOB_QUEUED:
+        st.text("⏳ Waiting for a free worker...")
+    else:
+        found = sum(page["matches"] or 0 for page in status["pages"])
+        st.text(
+            f"📖 Page {status['pages_done']} of {total or '?'} · "
+            f"{found} item(s) found · {status['elapsed_seconds']:.1f}s elapsed"
+        )
+    with st.expander("Page status"):
+        st.dataframe(
+            [
+                {
+                    "Page": page["page"] + 1,
+                    "Status": "✅" if page["status"] == PAGE_DONE else "⏳",
+                    "Kind": page["kind"],
+                    "Items Found": page["matches"],
+                }
+                for page in status["pages"]
+            ],
+            use_container_width=True
+        )
+    if st.button("✖️ Cancel", key=f"cancel_{job_id}"):
+        get_job_queue().cancel(job_id)
+
+# Redacted text, a window of pages at a time; paging and jumping to a hit only rerun this fragment
+@st.fragment
+def show_preview(view, show_original, key):
+    """
+    Page through a RedactionView's preview and jump to any redaction by category.
+
+    Only PREVIEW_PAGES pages of escaped HTML are sent per run, rendered once
+    and cached on the view (see preview.PagePreview). key tells the widgets
+    of different documents and views apart.
+    """
+    preview = view.preview
+    page_key = f"preview_page_{key}"
+    hit_key = f"preview_hit_{key}"
+    hits = preview.hits
+    
+    def jump():
+        category = st.session_state[f"preview_category_{key}"]
+        index, number, _ = hits[category][st.session_state[f"preview_hit_number_{key}"]]
+        st.session_state[page_key] = index + 1
+        st.session_state[hit_key] = (index, number)
+    
+    if hits:
+        col_category, col_hit = st.columns(2)
+        with col_category:
+            category = st.selectbox(
+                "Jump to a redaction",
+                list(hits),
+                format_func=lambda category: f"{category.title()} ({len(hits[category])})",
+                key=f"preview_category_{key}"
+            )
+        with col_hit:
+            st.selectbox(
+                "Hit",
+                range(len(hits[category])),
+                format_func=lambda i: f"#{i + 1} · page {hits[category][i][0] + 1} · {hits[category][i][2].rule}",
+                key=f"preview_hit_number_{key}",
+                on_change=jump
+            )
+    
+    page = st.number_input("Page", min_value=1, max_value=max(1, preview.page_count), key=page_key)
+    first = max(0, min(int(page) - 1, preview.page_count - PREVIEW_PAGES))
+    last = min(preview.page_count, first + PREVIEW_PAGES)
+    selected = st.session_state.get(hit_key)
+    st.caption(f"Pages {first + 1}-{last} of {preview.page_count}")
+    
+    if show_original:
+        col_orig, col_red = st.columns(2)
+        with col_orig:
+            st.markdown("**Original Text (Preview):**")
+            st.markdown(f'<div class="redaction-preview">{preview.window(first, original=True, selected=selected)}</div>', unsafe_allow_html=True)
+        with col_red:
+            st.markdown("**Redacted Text:**")
+            st.markdown(f'<div class="redaction-preview">{preview.window(first, selected=selected)}</div>', unsafe_allow_html=True)
+    else:
+        st.markdown("**Redacted Text:**")
+        st.markdown(f'<div class="redaction-preview">{preview.window(first, selected=selected)}</div>', unsafe_allow_html=True)
 
 # Streamlit app function to handle file upload and download
 def main():
@@ -292,6 +501,34 @@ def main():
         color: var(--text-color);
     }
     
+    .preview-page {
+        margin-bottom: 1rem;
+    }
+    
+    .preview-page-number {
+        font-size: 0.8rem;
+        opacity: 0.7;
+        border-bottom: 1px solid var(--secondary-background-color);
+        margin-bottom: 0.25rem;
+    }
+    
+    .preview-page-text {
+        white-space: pre-wrap;
+        font-family: monospace;
+        font-size: 0.85rem;
+    }
+    
+    .redaction-hit {
+        background: rgba(0, 0, 0, 0.75);
+        color: white;
+        border-radius: 3px;
+        padding: 0 2px;
+    }
+    
+    .redaction-hit.hit-selected {
+        outline: 2px solid #667eea;
+    }
+    
     .upload-section {
         border: 2px dashed #667eea;
         border-radius: 10px;
@@ -364,7 +601,7 @@ def main():
     st.markdown("""
     <div class="main-header">
         <h1>🔒 AI-Powered Document Redaction System</h1>
-        <p>Securely redact sensitive information from your PDF documents</p>
+        <p>Securely redact sensitive information from your PDF, Word and text documents</p>
     </div>
     """, unsafe_allow_html=True)
     
@@ -380,6 +617,58 @@ def main():
             help="Conservative mode only redacts explicitly labeled sensitive data. Aggressive mode uses pattern matching to find unlabeled sensitive information."
         )
         
+        # Optional NER address detection
+        ner_options = [NER_OFF] + list(NER_MODELS)
+        ner_model = st.selectbox(
+            "NER address detection",
+            ner_options,
+            index=ner_options.index(NER_MODEL) if NER_MODEL in ner_options else 0,
+            format_func={NER_OFF: "Off", "distilled": "Distilled (faster)", "large": "BERT-large (slower)"}.get,
+            help="Also find addresses with a named-entity model. Only lines that look like they could hold an address are sent to it."
+        )
+        
+        # OCR performance settings
+        with st.expander("⚡ OCR Performance"):
+            ocr_workers = st.number_input(
+                "OCR worker processes",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=default_workers(),
+                help="Pages are spread across this many processes. Use 1 to run OCR in-process."
+            )
+            ocr_batch_size = st.number_input(
+                "Recognition batch size",
+                min_value=1,
+                max_value=64,
+                value=DEFAULT_BATCH_SIZE,
+                help="Number of text boxes recognized together within a page."
+            )
+            st.caption(f"OCR backend: {OCR_BACKEND} (set with REDACTOR_OCR_BACKEND)")
+            
+            # OCR result cache
+            ocr_cache = get_default_cache()
+            if ocr_cache is not None:
+                cache_stats = ocr_cache.stats()
+                st.caption(
+                    f"OCR cache: {cache_stats['entries']} pages, "
+                    f"{cache_stats['bytes'] / (1024 * 1024):.1f} / {cache_stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+                    f"{cache_stats['hits']} hits / {cache_stats['misses']} misses"
+                )
+                if st.button("🧹 Clear OCR cache", use_container_width=True):
+                    ocr_cache.clear()
+                    if get_default_index() is not None:
+                        get_default_index().clear()
+                    st.success("OCR cache cleared.")
+            
+            # Near-duplicate regions (letterheads, footers, boilerplate) reused across pages and documents
+            dedup_index = get_default_index()
+            if dedup_index is not None:
+                dedup_stats = dedup_index.stats()
+                st.caption(
+                    f"Near-duplicate reuse: {dedup_stats['hits']} of {dedup_stats['hits'] + dedup_stats['misses']} regions "
+                    f"({dedup_stats['hit_rate']:.0%}), {dedup_stats['entries']} signatures kept"
+                )
+        
         st.markdown("---")
         
         # Features info
@@ -403,7 +692,7 @@ def main():
         
         # Security notice
         st.markdown("### 🛡️ Security Notice")
-        st.info("Your documents are processed locally and are not stored or transmitted to external servers.")
+        st.info("Your documents are processed locally and are not transmitted to external servers. OCR results are cached on this machine to speed up re-runs; clear the cache under OCR Performance.")
     
     # Main content area
     col1, col2 = st.columns([2, 1])
@@ -413,19 +702,23 @@ def main():
         st.markdown("""
         <div class="upload-section">
             <h3>📄 Upload Your Document</h3>
-            <p>Select a PDF document to redact sensitive information</p>
+            <p>Select a PDF, Word (.docx) or text document to redact sensitive information</p>
         </div>
         """, unsafe_allow_html=True)
         
         uploaded_pdf = st.file_uploader(
             "",
-            type="pdf",
-            help="Upload a PDF document containing sensitive information"
+            type=["pdf", "docx", "txt"],
+            help="Upload a document containing sensitive information. Word and text files are redacted directly, without OCR."
         )
         
-        if uploaded_pdf is not None:
+        text_kind = document_kind(uploaded_pdf.name) if uploaded_pdf is not None else None
+        if text_kind is not None:
+            st.success(f"✅ File uploaded: **{uploaded_pdf.name}** ({uploaded_pdf.size / 1024:.1f} KB)")
+            show_text_document(uploaded_pdf, text_kind, redaction_mode, stats_placeholder)
+        elif uploaded_pdf is not None:
             # File info
-            file_size = len(uploaded_pdf.getvalue()) / 1024  # KB
+            file_size = uploaded_pdf.size / 1024  # KB, without copying the upload
             st.success(f"✅ File uploaded: **{uploaded_pdf.name}** ({file_size:.1f} KB)")
             
             # Processing section
@@ -435,139 +728,246 @@ def main():
                     show_original = st.checkbox("Show original text", value=False)
                 with col_b:
                     auto_download = st.checkbox("Auto-generate downloads", value=True)
+                pdf_output_label = st.radio(
+                    "Redacted PDF",
+                    ["Re-typeset redacted text", "Black out on the original pages"],
+                    horizontal=True,
+                    help="Blacking out keeps the original layout: detected spans are located through the text layer or the OCR boxes and removed from the original PDF."
+                )
+                if is_large(uploaded_pdf.size):
+                    st.caption(
+                        f"📚 Large document: it is copied to disk and processed in shards of {SHARD_PAGES} pages. "
+                        "Finished shards are checkpointed, so an interrupted run picks up where it stopped."
+                    )
             
             # Process button
+            upload_key = (uploaded_pdf.name, uploaded_pdf.size)
             if st.button("🚀 Process Document", type="primary", use_container_width=True):
-                # Progress bar and status
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                status_text.text("🔄 Initializing OCR engine...")
-                progress_bar.progress(10)
+                # The document is processed in the background; downloads are only built up front when auto-generate is on
+                try:
+                    if is_large(uploaded_pdf.size):
+                        uploaded_pdf.seek(0)
+                        pdf_source = spool_upload(uploaded_pdf)  # Opened by path from here on
+                    else:
+                        pdf_source = uploaded_pdf.getvalue()
+                    job_id = submit_pdf_job(
+                        pdf_source, uploaded_pdf.name, redaction_mode,
+                        ocr_workers=int(ocr_workers), ocr_batch_size=int(ocr_batch_size),
+                        pdf_output=PDF_OUTPUT_IN_PLACE if pdf_output_label.startswith("Black out") else PDF_OUTPUT_RETYPESET,
+                        export_formats=(FORMAT_PDF, FORMAT_DOCX) if auto_download else (),
+                        key=upload_key,
+                        ner_model=ner_model
+                    )
+                    # The job lives on the server; the session and the URL only keep its ID
+                    st.session_state["job_id"] = job_id
+                    st.query_params["job"] = job_id
+                except JobQueueFull as e:
+                    st.warning(f"⏳ The server is busy: {e}")
+                except AdmissionRejected as e:
+                    st.warning(f"⏳ The document cannot be processed right now: {e}")
+                except InvalidDocument as e:
+                    st.error(f"This upload cannot be processed: {e}")
+                except Exception as e:
+                    st.error(f"Error processing PDF: {str(e)}")
+            
+            job_id = st.session_state.get("job_id") or st.query_params.get("job")
+            job = get_job_queue().get(job_id) if job_id else None
+            if job is not None and job.key != upload_key:
+                job = None  # A job for another upload
+            
+            if job is not None and not job.finished:
+                show_job_progress(job.id)
+            elif job is not None and job.status == JOB_EMPTY:
+                st.error("❌ No text could be extracted. Please ensure the document contains readable text.")
+            elif job is not None and job.status == JOB_FAILED:
+                st.error(f"Error processing PDF: {job.error}")
+            elif job is not None and job.status == JOB_CANCELLED:
+                st.info("Processing was cancelled.")
+            
+            if job is not None and job.status == JOB_DONE:
+                result = job.result
+                page_report = result.page_report
+                metrics = job.metrics
                 
-                status_text.text("📖 Extracting text from PDF...")
-                progress_bar.progress(30)
+                # Success message
+                st.markdown("""
+                <div class="success-message">
+                    <strong>🎉 Processing completed successfully!</strong><br>
+                    Your document has been processed and sensitive information has been redacted.
+                </div>
+                """, unsafe_allow_html=True)
                 
-                # Process the PDF
-                redacted_text, output_pdf, output_word = process_pdf(uploaded_pdf, redaction_mode)
+                # Changing the mode or the categories re-applies only the redaction step to the cached pages
+                categories = st.multiselect(
+                    "Categories to redact",
+                    CATEGORIES,
+                    default=list(CATEGORIES),
+                    format_func=str.title,
+                    help="Switching categories (or the redaction mode in the sidebar) does not run OCR again."
+                )
+                view = result.view("conservative" if "conservative" in redaction_mode.lower() else "aggressive", categories)
+                exports = view.exports
+                redactions_count = len(view.redactions)
                 
-                status_text.text("🔍 Applying redaction patterns...")
-                progress_bar.progress(70)
+                # Results section
+                st.markdown("### 📋 Results")
                 
-                status_text.text("📄 Generating output files...")
-                progress_bar.progress(90)
+                # Tabs for different views
+                tab1, tab2, tab3 = st.tabs(["📄 Redacted Text", "📊 Summary", "⚙️ Settings"])
                 
-                progress_bar.progress(100)
-                status_text.text("✅ Processing complete!")
+                with tab1:
+                    show_preview(view, show_original, f"{job.id}_{id(view)}")
                 
-                if redacted_text is None:
-                    st.error("❌ No text could be extracted. Please ensure the document contains readable text.")
-                else:
-                    # Success message
-                    st.markdown("""
-                    <div class="success-message">
-                        <strong>🎉 Processing completed successfully!</strong><br>
-                        Your document has been processed and sensitive information has been redacted.
-                    </div>
-                    """, unsafe_allow_html=True)
+                with tab2:
+                    # Summary metrics
+                    col_metric1, col_metric2, col_metric3, col_metric4 = st.columns(4)
                     
-                    # Display statistics
-                    original_length = len(uploaded_pdf.getvalue())
-                    redacted_length = len(redacted_text)
-                    redactions_count = redacted_text.count('[REDACTED')
+                    with col_metric1:
+                        ssn_count = view.counts[SSN]
+                        st.metric("SSN Redacted", ssn_count)
                     
-                    stats_placeholder.markdown(f"""
-                    <div class="stats-card">
-                        <strong>{redactions_count}</strong><br>
-                        <small>Items Redacted</small>
-                    </div>
-                    <div class="stats-card" style="margin-top: 0.5rem;">
-                        <strong>{redacted_length:,}</strong><br>
-                        <small>Characters Processed</small>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    with col_metric2:
+                        cc_count = view.counts[CREDIT_CARD]
+                        st.metric("Credit Cards", cc_count)
                     
-                    # Results section
-                    st.markdown("### 📋 Results")
+                    with col_metric3:
+                        addr_count = view.counts[ADDRESS]
+                        st.metric("Addresses", addr_count)
                     
-                    # Tabs for different views
-                    tab1, tab2, tab3 = st.tabs(["📄 Redacted Text", "📊 Summary", "⚙️ Settings"])
+                    with col_metric4:
+                        total_redactions = redactions_count
+                        st.metric("Total Redactions", total_redactions)
                     
-                    with tab1:
-                        if show_original:
-                            col_orig, col_red = st.columns(2)
-                            with col_orig:
-                                st.markdown("**Original Text (Preview):**")
-                                # Show first part of original (you'd need to store this)
-                                st.text_area("", "Original text would be shown here...", height=300, disabled=True)
-                            with col_red:
-                                st.markdown("**Redacted Text:**")
-                                st.text_area("", redacted_text, height=300, disabled=True)
-                        else:
-                            st.markdown("**Redacted Text:**")
-                            st.markdown(f'<div class="redaction-preview">{redacted_text}</div>', unsafe_allow_html=True)
-                    
-                    with tab2:
-                        # Summary metrics
-                        col_metric1, col_metric2, col_metric3, col_metric4 = st.columns(4)
-                        
-                        with col_metric1:
-                            ssn_count = redacted_text.count('[REDACTED SSN]')
-                            st.metric("SSN Redacted", ssn_count)
-                        
-                        with col_metric2:
-                            cc_count = redacted_text.count('[REDACTED CREDIT CARD]')
-                            st.metric("Credit Cards", cc_count)
+                    # Redaction breakdown
+                    if redactions_count > 0:
+                        st.markdown("### 📊 Redaction Breakdown")
+                        redaction_data = {
+                            "Type": ["SSN", "Credit Cards", "Addresses", "Other"],
+                            "Count": [ssn_count, cc_count, addr_count, max(0, total_redactions - ssn_count - cc_count - addr_count)]
+                        }
+                        st.bar_chart(redaction_data, x="Type", y="Count")
                         
-                        with col_metric3:
-                            addr_count = redacted_text.count('[REDACTED ADDRESS]')
-                            st.metric("Addresses", addr_count)
-                        
-                        with col_metric4:
-                            total_redactions = redactions_count
-                            st.metric("Total Redactions", total_redactions)
-                        
-                        # Redaction breakdown
-                        if redactions_count > 0:
-                            st.markdown("### 📊 Redaction Breakdown")
-                            redaction_data = {
-                                "Type": ["SSN", "Credit Cards", "Addresses", "Other"],
-                                "Count": [ssn_count, cc_count, addr_count, max(0, total_redactions - ssn_count - cc_count - addr_count)]
-                            }
-                            st.bar_chart(redaction_data, x="Type", y="Count")
-                    
-                    with tab3:
-                        st.markdown("**Current Settings:**")
-                        st.write(f"- Redaction Mode: {redaction_mode}")
-                        st.write(f"- Show Original: {show_original}")
-                        st.write(f"- Auto Download: {auto_download}")
-                    
-                    # Download section
-                    st.markdown("### 💾 Download Files")
-                    
-                    download_col1, download_col2 = st.columns(2)
-                    
-                    with download_col1:
-                        if output_pdf and os.path.exists(output_pdf):
-                            with open(output_pdf, "rb") as f:
-                                st.download_button(
-                                    "📄 Download Redacted PDF",
-                                    f.read(),
-                                    file_name="redacted_document.pdf",
-                                    mime="application/pdf",
-                                    use_container_width=True
-                                )
+                        # Every redacted span, with where it was found and how sure OCR was
+                        st.markdown("### 🔎 Redacted Items")
+                        st.dataframe(
+                            [
+                                {
+                                    "Page": redaction.page + 1,
+                                    "Span": f"{redaction.start}-{redaction.end}",
+                                    "Category": redaction.category,
+                                    "Rule": redaction.rule,
+                                    "Confidence": redaction.confidence,
+                                    "Located": bool(redaction.boxes),
+                                }
+                                for redaction in view.redactions
+                            ],
+                            use_container_width=True
+                        )
                     
-                    with download_col2:
-                        if output_word and os.path.exists(output_word):
-                            with open(output_word, "rb") as f:
-                                st.download_button(
-                                    "📝 Download Word Document",
-                                    f.read(),
-                                    file_name="redacted_document.docx",
-                                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                    use_container_width=True
-                                )
+                    # Per-page triage decisions
+                    st.markdown("### 🗂️ Page Triage")
+                    triage_counts = summarize_triage(page_report)
+                    col_t1, col_t2, col_t3, col_t4 = st.columns(4)
+                    col_t1.metric("Text Layer", triage_counts["text"])
+                    col_t2.metric("OCR (Image)", triage_counts["image"])
+                    col_t3.metric("Mixed", triage_counts["mixed"])
+                    col_t4.metric("Blank (Skipped)", triage_counts["blank"])
+                    st.dataframe(
+                        [
+                            {
+                                "Page": entry["page"] + 1,
+                                "Kind": entry["kind"],
+                                "Text Layer Chars": entry["text_chars"],
+                                "OCR Regions": len(entry["ocr_regions"]),
+                            }
+                            for entry in page_report
+                        ],
+                        use_container_width=True
+                    )
+                
+                with tab3:
+                    st.markdown("**Current Settings:**")
+                    st.write(f"- Redaction Mode: {redaction_mode}")
+                    st.write(f"- Show Original: {show_original}")
+                    st.write(f"- Auto Download: {auto_download}")
+                
+                # Download section
+                st.markdown("### 💾 Download Files")
+                
+                download_col1, download_col2 = st.columns(2)
+                if auto_download:
+                    exports.build((FORMAT_PDF, FORMAT_DOCX))  # Both at once rather than one after the other
+                
+                # Each format is built in memory the first time it is requested and cached with the result
+                with download_col1:
+                    if auto_download or exports.is_ready(FORMAT_PDF) or st.button("📄 Prepare Redacted PDF", use_container_width=True):
+                        st.download_button(
+                            "📄 Download Redacted PDF",
+                            exports.get(FORMAT_PDF),
+                            file_name="redacted_document.pdf",
+                            mime="application/pdf",
+                            use_container_width=True
+                        )
+                        if exports.unlocated:
+                            st.warning(f"{exports.unlocated} detected item(s) could not be located on the original pages. Review the redacted PDF before sharing.")
+                
+                with download_col2:
+                    if auto_download or exports.is_ready(FORMAT_DOCX) or st.button("📝 Prepare Word Document", use_container_width=True):
+                        st.download_button(
+                            "📝 Download Word Document",
+                            exports.get(FORMAT_DOCX),
+                            file_name="redacted_document.docx",
+                            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                            use_container_width=True
+                        )
+                
+                # Sidebar statistics, from the pipeline metrics (filled last so that export timings are included)
+                stats = metrics.snapshot()
+                band_hits = ", ".join(
+                    f"{band} {stats['band_dedup_hits'].get(band, 0)}/{count}"
+                    for band, count in sorted(stats["band_regions"].items())
+                )
+                band_hits = f" ({band_hits})" if band_hits else ""
+                ner_card = ""
+                if "ner" in stats["stages"]:
+                    ner_share = stats["ner_characters"] / stats["characters"] if stats["characters"] else 0.0
+                    ner_card = f"""
+                <div class="stats-card" style="margin-top: 0.5rem;">
+                    <strong>NER: {stats['stages']['ner']['seconds']:.2f}s</strong><br>
+                    <small>{stats['ner_candidates']} candidate spans, {ner_share:.0%} of the text, {stats['ner_entities']} entities</small>
+                </div>"""
+                memory = stats["memory"]
+                estimated = f"estimated {memory['estimate']['memory_bytes'] / 2**20:.0f} MB, " if memory["estimate"] else ""
+                memory_card = f"""
+                <div class="stats-card" style="margin-top: 0.5rem;">
+                    <strong>Peak memory: {memory['peak_rss_bytes'] / 2**20:.0f} MB</strong><br>
+                    <small>{estimated}whole server process</small>
+                </div>"""
+                stage_rows = "".join(
+                    f"<tr><td>{stage}</td><td>{stats['stages'][stage]['pages']}</td><td>{stats['stages'][stage]['seconds']:.2f}s</td>"
+                    f"<td>{memory['stage_peak_rss_bytes'].get(stage, 0) / 2**20:.0f} MB</td></tr>"
+                    for stage in STAGES if stage in stats["stages"]
+                )
+                stats_placeholder.markdown(f"""
+                <div class="stats-card">
+                    <strong>{redactions_count}</strong><br>
+                    <small>Items Redacted</small>
+                </div>
+                <div class="stats-card" style="margin-top: 0.5rem;">
+                    <strong>{stats['characters']:,}</strong><br>
+                    <small>Characters Processed</small>
+                </div>
+                <div class="stats-card" style="margin-top: 0.5rem;">
+                    <strong>{stats['pages']} pages in {stats['wall_seconds']:.1f}s</strong><br>
+                    <small>{stats['cache_hits']} of {stats['ocr_regions']} OCR regions from cache, {stats['dedup_hits']} reused from near-duplicates{band_hits}</small>
+                </div>
+                {ner_card}
+                {memory_card}
+                <table style="margin-top: 0.5rem; width: 100%;">
+                    <tr><th>Stage</th><th>Pages</th><th>Time</th><th>Peak RSS</th></tr>
+                    {stage_rows}
+                </table>
+                """, unsafe_allow_html=True)
     
     with col2:
         # Tips and information
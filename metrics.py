@@ -0,0 +1,428 @@
+"""
+Per-stage instrumentation of the redaction pipeline.
+
+A PipelineMetrics object travels with one document through the pipeline and
+records, per stage (render, ocr, ner, redact, write, export), the time spent
+working and the pages handled, plus the per-page OCR latency, characters
+extracted, matches per category, OCR cache hits, regions reused from a
+near-duplicate (per band: header, body, footer or whole region) and how
+much text the optional NER stage sent to its model. The stages run in
+separate threads, so every update takes a lock.
+
+Memory: while a stage of a document is working, the process's resident set
+size (RSS) is sampled every MEMORY_SAMPLE_SECONDS by one background thread,
+and the peak seen during each stage is kept with the document, along with
+the estimate it was admitted with (see admission). RSS is process-wide: with
+several documents at once, each stage's peak includes what the others held
+at the time, and the OCR workers are separate processes that are not
+counted. With REDACTOR_TRACE_MEMORY=1, tracemalloc is started too and the
+peak of Python allocations traced during each stage is kept as well; it is
+more precise but slows allocation-heavy code down.
+
+    REDACTOR_MEMORY_SAMPLE_MS   RSS sampling interval (default 50)
+    REDACTOR_TRACE_MEMORY       1 to trace Python allocations with tracemalloc
+
+Finished documents are folded into the process-wide REGISTRY, which renders
+the totals in the Prometheus text exposition format. When REDACTOR_METRICS_FILE
+is set the registry is written there after every document, for node_exporter's
+textfile collector or any other scraper that reads files.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+STAGE_RENDER = "render"
+STAGE_OCR = "ocr"
+STAGE_NER = "ner"
+STAGE_REDACT = "redact"
+STAGE_WRITE = "write"
+STAGE_EXPORT = "export"
+STAGES = (STAGE_RENDER, STAGE_OCR, STAGE_NER, STAGE_REDACT, STAGE_WRITE, STAGE_EXPORT)
+
+# Upper bounds (seconds) of the per-page OCR latency histogram
+OCR_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_FILE = os.environ.get("REDACTOR_METRICS_FILE")
+
+MEMORY_SAMPLE_SECONDS = float(os.environ.get("REDACTOR_MEMORY_SAMPLE_MS", "50")) / 1000
+TRACE_MEMORY = os.environ.get("REDACTOR_TRACE_MEMORY", "0") == "1"
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes.
+
+    Read from /proc on Linux. Elsewhere the resource module only knows the
+    peak so far, which is returned instead; 0 where neither is available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+
+
+class _MemorySampler:
+    """Samples RSS (and traced memory) for every PipelineMetrics with a stage at work."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_SECONDS, trace=TRACE_MEMORY):
+        self.interval = interval
+        self.trace = trace
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.rss = current_rss()
+        self.traced = self._traced()
+        self._watched = weakref.WeakSet()
+        self._busy = threading.Event()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _traced(self):
+        return tracemalloc.get_traced_memory()[0] if self.trace and tracemalloc.is_tracing() else 0
+
+    def watch(self, metrics):
+        with self._lock:
+            self._watched.add(metrics)
+        self._busy.set()
+
+    def _run(self):
+        while True:
+            self._busy.wait()
+            time.sleep(self.interval)
+            self.rss = current_rss()
+            self.traced = self._traced()
+            with self._lock:
+                watched = list(self._watched)
+            if not any([metrics._sample(self.rss, self.traced) for metrics in watched]):
+                with self._lock:
+                    if not any(metrics._active for metrics in self._watched):
+                        self._busy.clear()
+
+
+def get_sampler():
+    """Return the process-wide memory sampler, starting its thread on first use."""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _MemorySampler()
+        return _sampler
+
+
+class PipelineMetrics:
+    """
+    Timings and counts of one document.
+
+    Args:
+        on_page: Optional callback(page, metrics) called by the consumer of the
+            pipeline for each finished page, see pipeline.redact_pdf
+    """
+
+    def __init__(self, on_page=None):
+        self.on_page = on_page
+        self.total_pages = None  # Known once the document is opened
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stage_seconds = Counter()
+        self.stage_pages = Counter()
+        self.ocr_latency_buckets = [0] * (len(OCR_LATENCY_BUCKETS) + 1)  # The last one is +Inf
+        self.ocr_latency_sum = 0.0
+        self.ocr_regions = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.dedup_hits = 0
+        self.band_regions = Counter()
+        self.band_dedup_hits = Counter()
+        self.characters = 0
+        self.matches = Counter()
+        self.ner_candidates = 0
+        self.ner_characters = 0
+        self.ner_entities = 0
+        self.estimate = None  # admission.JobCost the document was admitted with, if any
+        self.stage_peak_rss = Counter()
+        self.stage_peak_traced = Counter()
+        self._active = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage, pages=1):
+        """Add the duration of the block to the stage, counting pages as handled, and watch its memory."""
+        sampler = get_sampler()
+        with self._lock:
+            self._active[stage] += 1
+        sampler.watch(self)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stage_seconds[stage] += elapsed
+                self.stage_pages[stage] += pages
+                # The latest sample, so that blocks shorter than the interval have a peak too
+                self.stage_peak_rss[stage] = max(self.stage_peak_rss[stage], sampler.rss)
+                self.stage_peak_traced[stage] = max(self.stage_peak_traced[stage], sampler.traced)
+                self._active[stage] -= 1
+                if not self._active[stage]:
+                    del self._active[stage]
+
+    def _sample(self, rss, traced):
+        """Raise the peaks of the stages at work. Returns whether any were."""
+        with self._lock:
+            for stage in self._active:
+                self.stage_peak_rss[stage] = max(self.stage_peak_rss[stage], rss)
+                self.stage_peak_traced[stage] = max(self.stage_peak_traced[stage], traced)
+            return bool(self._active)
+
+    def observe_ocr(self, seconds, regions, cache_hits, dedup_hits=0):
+        """Record one page's OCR latency, from submission to result, and where its regions' results came from."""
+        with self._lock:
+            self.ocr_latency_sum += seconds
+            for i, bound in enumerate(OCR_LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.ocr_latency_buckets[i] += 1
+                    break
+            else:
+                self.ocr_latency_buckets[-1] += 1
+            self.ocr_regions += regions
+            self.cache_hits += cache_hits
+            self.dedup_hits += dedup_hits
+            self.cache_misses += regions - cache_hits - dedup_hits
+
+    def observe_bands(self, bands, reused):
+        """Count one page's regions per band, and those reused from a near-duplicate."""
+        with self._lock:
+            self.band_regions.update(bands)
+            self.band_dedup_hits.update(reused)
+
+    def observe_redaction(self, text, matches):
+        with self._lock:
+            self.characters += len(text)
+            self.matches.update(match.category for match in matches)
+
+    def observe_ner(self, candidates, characters, entities):
+        """Record one batched NER call: candidate spans and their characters sent to the model, entities kept."""
+        with self._lock:
+            self.ner_candidates += candidates
+            self.ner_characters += characters
+            self.ner_entities += entities
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def pages_done(self):
+        return self.stage_pages[STAGE_WRITE]
+
+    @property
+    def wall_seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def snapshot(self):
+        """Plain, JSON-serializable copy of the numbers, e.g. for the batch manifest."""
+        with self._lock:
+            return {
+                "pages": self.total_pages or self.stage_pages[STAGE_RENDER],
+                "wall_seconds": round(self.wall_seconds, 4),
+                "stages": {
+                    stage: {"seconds": round(self.stage_seconds[stage], 4), "pages": self.stage_pages[stage]}
+                    for stage in STAGES if stage in self.stage_pages
+                },
+                "ocr_latency_buckets": list(self.ocr_latency_buckets),
+                "ocr_latency_sum": round(self.ocr_latency_sum, 4),
+                "ocr_regions": self.ocr_regions,
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "dedup_hits": self.dedup_hits,
+                "band_regions": dict(self.band_regions),
+                "band_dedup_hits": dict(self.band_dedup_hits),
+                "characters": self.characters,
+                "matches": dict(self.matches),
+                "ner_candidates": self.ner_candidates,
+                "ner_characters": self.ner_characters,
+                "ner_entities": self.ner_entities,
+                "memory": {
+                    "peak_rss_bytes": max(self.stage_peak_rss.values(), default=0),
+                    "stage_peak_rss_bytes": {stage: self.stage_peak_rss[stage] for stage in STAGES if stage in self.stage_peak_rss},
+                    "stage_peak_traced_bytes": (
+                        {stage: self.stage_peak_traced[stage] for stage in STAGES if stage in self.stage_peak_traced}
+                        if any(self.stage_peak_traced.values()) else None
+                    ),
+                    "estimate": self.estimate.as_dict() if self.estimate is not None else None,
+                },
+            }
+
+
+class MetricsRegistry:
+    """Process-wide totals over every document, rendered for Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.failures = 0
+        self.pages = 0
+        self.wall_seconds = 0.0
+        self.last_document_seconds = 0.0
+        self.stage_seconds = Counter()
+        self.stage_pages = Counter()
+        self.ocr_latency_buckets = [0] * (len(OCR_LATENCY_BUCKETS) + 1)
+        self.ocr_latency_sum = 0.0
+        self.ocr_regions = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.band_regions = Counter()
+        self.band_dedup_hits = Counter()
+        self.characters = 0
+        self.matches = Counter()
+        self.ner_candidates = 0
+        self.ner_characters = 0
+        self.peak_rss = 0
+        self.stage_peak_rss = Counter()
+        self.estimated_memory_bytes = 0
+
+    def record(self, snapshot):
+        """Add one document, given as PipelineMetrics.snapshot()."""
+        with self._lock:
+            self.documents += 1
+            self.pages += snapshot["pages"]
+            self.wall_seconds += snapshot["wall_seconds"]
+            self.last_document_seconds = snapshot["wall_seconds"]
+            for stage, entry in snapshot["stages"].items():
+                self.stage_seconds[stage] += entry["seconds"]
+                self.stage_pages[stage] += entry["pages"]
+            for i, count in enumerate(snapshot["ocr_latency_buckets"]):
+                self.ocr_latency_buckets[i] += count
+            self.ocr_latency_sum += snapshot["ocr_latency_sum"]
+            self.ocr_regions += snapshot["ocr_regions"]
+            self.cache_hits += snapshot["cache_hits"]
+            self.cache_misses += snapshot["cache_misses"]
+            self.band_regions.update(snapshot["band_regions"])
+            self.band_dedup_hits.update(snapshot["band_dedup_hits"])
+            self.characters += snapshot["characters"]
+            self.matches.update(snapshot["matches"])
+            self.ner_candidates += snapshot["ner_candidates"]
+            self.ner_characters += snapshot["ner_characters"]
+            memory = snapshot.get("memory")  # Absent from manifests written before it was measured
+            if memory:
+                self.peak_rss = max(self.peak_rss, memory["peak_rss_bytes"])
+                for stage, peak in memory["stage_peak_rss_bytes"].items():
+                    self.stage_peak_rss[stage] = max(self.stage_peak_rss[stage], peak)
+                if memory["estimate"]:
+                    self.estimated_memory_bytes = max(self.estimated_memory_bytes, memory["estimate"]["memory_bytes"])
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def to_prometheus(self):
+        """The totals in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            metric("redactor_documents_total", "counter", "Documents processed.", [({}, self.documents)])
+            metric("redactor_document_failures_total", "counter", "Documents that failed.", [({}, self.failures)])
+            metric("redactor_pages_total", "counter", "Pages processed.", [({}, self.pages)])
+            metric("redactor_document_seconds_total", "counter", "Wall time spent on documents.",
+                   [({}, round(self.wall_seconds, 6))])
+            metric("redactor_last_document_seconds", "gauge", "Wall time of the last document.",
+                   [({}, round(self.last_document_seconds, 6))])
+            metric("redactor_stage_seconds_total", "counter", "Time spent working in each pipeline stage.",
+                   [({"stage": stage}, round(self.stage_seconds[stage], 6)) for stage in STAGES])
+            metric("redactor_stage_pages_total", "counter", "Pages handled by each pipeline stage.",
+                   [({"stage": stage}, self.stage_pages[stage]) for stage in STAGES])
+
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(OCR_LATENCY_BUCKETS + ("+Inf",), self.ocr_latency_buckets):
+                cumulative += count
+                buckets.append(({"le": str(bound)}, cumulative))
+            lines.append("# HELP redactor_ocr_page_seconds OCR latency per page, from submission to result.")
+            lines.append("# TYPE redactor_ocr_page_seconds histogram")
+            for labels, value in buckets:
+                lines.append(f'redactor_ocr_page_seconds_bucket{{le="{labels["le"]}"}} {value}')
+            lines.append(f"redactor_ocr_page_seconds_sum {round(self.ocr_latency_sum, 6)}")
+            lines.append(f"redactor_ocr_page_seconds_count {cumulative}")
+
+            metric("redactor_ocr_regions_total", "counter", "Rendered regions sent to OCR or found in the cache.",
+                   [({}, self.ocr_regions)])
+            metric("redactor_ocr_cache_hits_total", "counter", "OCR regions served from the cache.",
+                   [({}, self.cache_hits)])
+            metric("redactor_ocr_cache_misses_total", "counter", "OCR regions that had to be OCR'd.",
+                   [({}, self.cache_misses)])
+            metric("redactor_ocr_band_regions_total", "counter", "OCR regions by band (header, body, footer, region).",
+                   [({"band": band}, count) for band, count in sorted(self.band_regions.items())])
+            metric("redactor_ocr_dedup_hits_total", "counter", "OCR regions reused from a near-duplicate, by band.",
+                   [({"band": band}, count) for band, count in sorted(self.band_dedup_hits.items())])
+            metric("redactor_characters_total", "counter", "Characters of extracted text redacted.",
+                   [({}, self.characters)])
+            metric("redactor_matches_total", "counter", "Sensitive spans found, by category.",
+                   [({"category": category}, count) for category, count in sorted(self.matches.items())])
+            metric("redactor_ner_candidates_total", "counter", "Candidate spans the prefilter sent to the NER model.",
+                   [({}, self.ner_candidates)])
+            metric("redactor_ner_characters_total", "counter", "Characters of text the NER model ran on.",
+                   [({}, self.ner_characters)])
+            metric("redactor_peak_rss_bytes", "gauge", "Highest resident set size seen while a document was processed.",
+                   [({}, self.peak_rss)])
+            metric("redactor_stage_peak_rss_bytes", "gauge", "Highest resident set size seen during each pipeline stage.",
+                   [({"stage": stage}, self.stage_peak_rss[stage]) for stage in STAGES if stage in self.stage_peak_rss])
+            metric("redactor_estimated_memory_bytes", "gauge", "Largest memory estimate a document was admitted with.",
+                   [({}, self.estimated_memory_bytes)])
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write the exposition atomically, so a scraper never reads half a file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # A temp file of its own per call: concurrent jobs publish from several threads at once
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.to_prometheus())
+            os.chmod(tmp_path, 0o644)  # Read by the node exporter, which may run as another user
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+REGISTRY = MetricsRegistry()
+
+
+def publish(metrics, path=METRICS_FILE):
+    """
+    Fold a finished document into REGISTRY and rewrite the metrics file, if one is configured.
+
+    Args:
+        metrics: PipelineMetrics, or a snapshot of one
+        path: Text file to write, defaults to REDACTOR_METRICS_FILE
+    """
+    REGISTRY.record(metrics.snapshot() if isinstance(metrics, PipelineMetrics) else metrics)
+    if path:
+        REGISTRY.write_textfile(path)
+
+
+def publish_failure(path=METRICS_FILE):
+    REGISTRY.record_failure()
+    if path:
+        REGISTRY.write_textfile(path)
@@ -0,0 +1,147 @@
+"""
+Optional NER detection of addresses, gated by a cheap prefilter.
+
+Running a BERT-large token classifier over every line of every page costs
+far more than rendering, OCR'ing and regex-scanning the same page, and
+almost all of those lines hold no address. A single regular expression
+(house numbers before a capitalized word, street and unit words, PO boxes,
+"ship to" and similar phrases) first marks the candidate spans of a page:
+the lines it hits, cut down to a window around the hit when a line is very
+long, as OCR'd regions are. Only the candidates go to the model, collected
+across pages and run as one batched pipeline call, and LOC entities found in
+them become ADDRESS matches next to the regex ones.
+
+Models are loaded once per process and shared, like the OCR reader.
+"large" is the original BERT-large CoNLL-03 model; "distilled" is a
+DistilBERT CoNLL-03 model, several times faster for slightly lower recall.
+Any other value is taken as a Hugging Face model name or local path.
+
+    REDACTOR_NER              off, distilled, large, or a model name (default off)
+    REDACTOR_NER_BATCH_SIZE   candidate spans per forward pass
+
+transformers (and torch) are only imported by get_ner_pipeline(), the first
+time a document is run with NER enabled.
+"""
+import os
+import re
+import threading
+
+from redaction import ADDRESS, Match
+
+NER_OFF = "off"
+NER_MODELS = {
+    "distilled": "elastic/distilbert-base-cased-finetuned-conll03-english",
+    "large": "dbmdz/bert-large-cased-finetuned-conll03-english",
+}
+NER_MODEL = os.environ.get("REDACTOR_NER", NER_OFF)
+NER_BATCH_SIZE = int(os.environ.get("REDACTOR_NER_BATCH_SIZE", "16"))
+# The pipeline holds pages back until they have NER_BATCH_SIZE candidates between them, at most this many pages
+NER_MAX_PAGES = 8
+
+# Entity groups kept, and the category their matches are redacted as
+NER_CATEGORIES = {"LOC": ADDRESS}
+# Entities the model is less sure of are dropped
+NER_MIN_SCORE = 0.6
+
+# Lines longer than this are cut to CANDIDATE_CONTEXT characters around each hit
+MAX_CANDIDATE_CHARS = 256
+CANDIDATE_CONTEXT = 96
+
+PREFILTER = re.compile(
+    r"\b\d{1,6}\s+[A-Z][a-z]+"  # House number and a capitalized name
+    r"|\b[A-Z][a-z]+,\s*[A-Z]{2}\b"  # City, ST
+    r"|(?i:\b(?:street|st|avenue|ave|road|rd|drive|dr|lane|ln|boulevard|blvd|way|court|ct|place|pl|square|sq"
+    r"|highway|hwy|suite|ste|apt|apartment|floor|p\.?\s?o\.?\s+box)\b)"
+    r"|(?i:\b(?:address|located|lives?|lived|resides?|resided|residence|(?:ship|deliver|mail|send)(?:ed|ing)?\s+to)\b)"
+)
+
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+def model_name(model=None):
+    """The Hugging Face model name or path behind a REDACTOR_NER value."""
+    model = model or NER_MODEL
+    return NER_MODELS.get(model, model)
+
+
+def enabled(model=None):
+    return (model or NER_MODEL) != NER_OFF
+
+
+def candidate_spans(text):
+    """
+    The (start, end) spans of text worth running the model on, in order and non-overlapping.
+
+    Each prefilter hit selects its line; over-long lines are cut to a window
+    around the hit, widened to whole words.
+    """
+    spans = []
+    for hit in PREFILTER.finditer(text):
+        start = text.rfind("\n", 0, hit.start()) + 1
+        end = text.find("\n", hit.end())
+        end = len(text) if end < 0 else end
+        if end - start > MAX_CANDIDATE_CHARS:
+            low = max(start, hit.start() - CANDIDATE_CONTEXT)
+            high = min(end, hit.end() + CANDIDATE_CONTEXT)
+            if low > start:
+                space = text.find(" ", low, hit.start())
+                low = space + 1 if space >= 0 else low
+            if high < end:
+                space = text.rfind(" ", hit.end(), high)
+                high = space if space >= 0 else high
+            start, end = low, high
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+        else:
+            spans.append((start, end))
+    return spans
+
+
+def get_ner_pipeline(model=None):
+    """
+    Return the process-wide transformers token-classification pipeline for a model, loading it on first use.
+
+    Sub-word tokens are aggregated into whole entities with character offsets.
+    """
+    name = model_name(model)
+    with _pipelines_lock:
+        if name not in _pipelines:
+            from transformers import pipeline
+            _pipelines[name] = pipeline("ner", model=name, aggregation_strategy="simple")
+        return _pipelines[name]
+
+
+def find_entities(texts, spans, model=None, batch_size=NER_BATCH_SIZE):
+    """
+    Run the model once over the candidate spans of several texts.
+
+    Args:
+        texts: Page texts
+        spans: candidate_spans() of each text
+        model: REDACTOR_NER value, defaults to NER_MODEL
+        batch_size: Candidate spans per forward pass
+
+    Returns:
+        For each text, the Matches of the entities found in it, in text order
+    """
+    flat = [(index, start, end) for index, text_spans in enumerate(spans) for start, end in text_spans]
+    found = [[] for _ in texts]
+    if not flat:
+        return found
+    model = model or NER_MODEL
+    rule = f"ner_{model}" if model in NER_MODELS else "ner"
+    ner = get_ner_pipeline(model)
+    results = ner([texts[index][start:end] for index, start, end in flat], batch_size=batch_size)
+    for (index, offset, _), entities in zip(flat, results):
+        for entity in entities:
+            category = NER_CATEGORIES.get(entity["entity_group"])
+            if category is None or entity["score"] < NER_MIN_SCORE or entity["start"] is None:
+                continue
+            start, end = offset + entity["start"], offset + entity["end"]
+            previous = found[index][-1] if found[index] else None
+            if previous and previous.category == category and not texts[index][previous.end:start].strip(" ,"):
+                found[index][-1] = Match(previous.start, end, category, rule)  # "Springfield, IL" is one address
+            else:
+                found[index].append(Match(start, end, category, rule))
+    return found
@@ -0,0 +1,195 @@
+"""
+Persistent, content-addressed cache of per-page OCR results.
+
+Each entry holds the full EasyOCR output of one rendered page region (boxes,
+text and confidences). The key is a hash of the rendered pixels, the render
+settings and the OCR engine version, so re-uploading the same document, or
+re-running it in another redaction mode, skips OCR for every page already
+seen, while a change in rendering or in the engine never returns stale results.
+
+Entries live in a single SQLite file, created 0o600 in a 0o700 directory
+since it holds unredacted text. The cache is capped in size and evicts the
+least recently used entries first. The total size is kept in a one-row table
+that triggers update on every insert, update and delete, so checking the cap
+after a put is one row read, and every process sharing the file sees the
+same total.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "REDACTOR_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "redactor", "ocr_cache.sqlite3"),
+)
+DEFAULT_MAX_BYTES = int(float(os.environ.get("REDACTOR_CACHE_MAX_MB", "512")) * 1024 * 1024)
+CACHE_ENABLED = os.environ.get("REDACTOR_CACHE", "1") != "0"
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def cache_key(image, render_settings, engine):
+    """
+    Content address of one OCR input.
+
+    Args:
+        image: Rendered page region (bytes, a NumPy array, or a slice of one, or any contiguous buffer)
+        render_settings: JSON-serializable dict of the settings it was rendered with
+        engine: OCR engine version string, see ocr_engine.engine_version
+    """
+    digest = hashlib.sha256()
+    digest.update(str(getattr(image, "shape", "")).encode("utf-8"))  # Same samples, other dimensions
+    if getattr(image, "flags", None) is not None and not image.flags.c_contiguous:
+        for row in image:  # A band or crop of a frame: its rows are contiguous, the whole is not
+            digest.update(row)
+    else:
+        digest.update(image)
+    digest.update(json.dumps(render_settings, sort_keys=True).encode("utf-8"))
+    digest.update(engine.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    Size-capped LRU cache of OCR results stored in SQLite.
+
+    Args:
+        path: Database file, created on first use
+        max_bytes: Total size of the stored results before eviction starts
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)  # Holds unredacted text, keep it private
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))  # SQLite gives its WAL files the same mode
+        if os.stat(path).st_mode & 0o077:
+            os.chmod(path, 0o600)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("BEGIN IMMEDIATE")  # Another process may be creating the same tables
+        try:
+            self._create_tables()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _create_tables(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_pages ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_pages_lru ON ocr_pages (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_totals ("
+            " id INTEGER PRIMARY KEY CHECK (id = 0),"
+            " entries INTEGER NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_pages_insert AFTER INSERT ON ocr_pages BEGIN"
+            " UPDATE ocr_totals SET entries = entries + 1, size = size + new.size; END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_pages_update AFTER UPDATE OF size ON ocr_pages BEGIN"
+            " UPDATE ocr_totals SET size = size - old.size + new.size; END"
+        )
+        self._conn.execute(
+            "CREATE TRIGGER IF NOT EXISTS ocr_pages_delete AFTER DELETE ON ocr_pages BEGIN"
+            " UPDATE ocr_totals SET entries = entries - 1, size = size - old.size; END"
+        )
+        if self._conn.execute("SELECT 1 FROM ocr_totals").fetchone() is None:
+            # A new file, or one from before the totals were kept: counted once
+            self._conn.execute(
+                "INSERT INTO ocr_totals (id, entries, size) SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM ocr_pages"
+            )
+
+    def _totals(self):
+        return self._conn.execute("SELECT entries, size FROM ocr_totals").fetchone()
+
+    def get(self, key):
+        """Return the cached (box, text, confidence) results for key, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM ocr_pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr_pages SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return [tuple(item) for item in json.loads(row[0])]
+
+    def put(self, key, result):
+        """Store the results for key and evict least recently used entries beyond max_bytes."""
+        payload = json.dumps(result, separators=(",", ":"))
+        with self._lock:
+            # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the trigger
+            self._conn.execute(
+                "INSERT INTO ocr_pages (key, result, size, last_access) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET"
+                " result = excluded.result, size = excluded.size, last_access = excluded.last_access",
+                (key, payload, len(payload), time.time()),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._totals()[1]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        rows = self._conn.execute("SELECT key, size FROM ocr_pages ORDER BY last_access")
+        for key, size in rows:  # Only as far into the LRU index as needed
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        rows.close()
+        self._conn.executemany("DELETE FROM ocr_pages WHERE key = ?", stale)
+        self.evictions += len(stale)
+
+    def stats(self):
+        """Hit/miss counters of this process plus the current size of the cache."""
+        with self._lock:
+            entries, size = self._totals()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM ocr_pages")
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_default_cache():
+    """Return the process-wide cache, or None when disabled with REDACTOR_CACHE=0."""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = OCRCache()
+        return _default_cache
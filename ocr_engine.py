@@ -0,0 +1,447 @@
+"""
+Parallel, batched OCR engine.
+
+Pages are spread over a process pool. Every worker loads its own
+easyocr.Reader once, when the pool starts, and is pinned to a fixed share of
+the torch threads so that the workers together use the machine's cores
+without oversubscribing them. Inside a worker each page goes through
+EasyOCR's batched recognition (``readtext(..., batch_size=N)``), which feeds
+the detected text boxes of a page to the recognizer N at a time.
+
+The per-page call is exactly the one the sequential path makes, so the
+results are identical whichever path is used, and they are always returned
+in page order.
+
+Two backends are available, chosen with REDACTOR_OCR_BACKEND: "fp32" (the
+stock EasyOCR models) and "int8", which applies torch dynamic int8
+quantization to the LSTM and linear layers of the recognition network and
+always runs on the CPU. The CRAFT detection network is convolutional only,
+which dynamic quantization does not cover, so it stays in fp32. See
+benchmarks/bench_ocr_backends.py for the speed/accuracy trade-off.
+
+OCRBatcher serves several documents at once (see service): the regions
+they submit are collected into shared batches, sent when a batch is full or
+its oldest region has waited long enough, and OCR'd across the pool in one
+call instead of one pool task per page of each document.
+
+    REDACTOR_OCR_BATCH_REGIONS      regions per shared batch (default 32)
+    REDACTOR_OCR_BATCH_LATENCY_MS   longest a region waits for its batch to fill (default 50)
+    REDACTOR_OCR_MAX_PENDING        regions waiting for a batch before submit() blocks (default 256)
+    REDACTOR_OCR_CORRECT            0 to keep misread digits in number-shaped OCR text as they are
+
+Nothing heavy is imported here at module level: easyocr and torch are only
+loaded by get_reader() and by the pool workers, the first time OCR is needed
+(or by warm_up() when the server starts).
+"""
+import atexit
+import multiprocessing
+import os
+import re
+import threading
+import time
+import warnings
+from collections import deque
+from importlib import metadata
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import repeat
+
+OCR_LANGUAGES = ['en']
+
+# Defaults, overridable through the environment or per call
+DEFAULT_BATCH_SIZE = int(os.environ.get("REDACTOR_OCR_BATCH_SIZE", "8"))
+DEFAULT_THREADS_PER_WORKER = 4
+DEFAULT_WORKERS = int(os.environ.get("REDACTOR_OCR_WORKERS", "0"))  # 0 = derive from CPU count
+
+BACKEND_FP32 = "fp32"
+BACKEND_INT8 = "int8"
+BACKENDS = (BACKEND_FP32, BACKEND_INT8)
+OCR_BACKEND = os.environ.get("REDACTOR_OCR_BACKEND", BACKEND_FP32)
+if OCR_BACKEND not in BACKENDS:
+    raise ValueError(f"REDACTOR_OCR_BACKEND must be one of {', '.join(BACKENDS)}, not {OCR_BACKEND!r}")
+
+# Each worker gets several chunks so that slow pages do not leave the others idle
+CHUNKS_PER_WORKER = 4
+
+BATCH_MAX_REGIONS = int(os.environ.get("REDACTOR_OCR_BATCH_REGIONS", "32"))
+BATCH_MAX_LATENCY = float(os.environ.get("REDACTOR_OCR_BATCH_LATENCY_MS", "50")) / 1000
+BATCH_MAX_PENDING = int(os.environ.get("REDACTOR_OCR_MAX_PENDING", "256"))
+
+OCR_CORRECT = os.environ.get("REDACTOR_OCR_CORRECT", "1") != "0"
+
+# Characters OCR reads in place of digits, and in place of the dash between digit groups
+DIGIT_LOOKALIKES = {"0": "Oo°", "1": "lI|", "5": "Ss", "6": "Gb", "8": "B"}
+DASH_LOOKALIKES = "<>~=_–—o"
+_DIGIT_TABLE = str.maketrans({char: digit for digit, chars in DIGIT_LOOKALIKES.items() for char in chars})
+_DIGIT_CLASS = "[0-9" + re.escape("".join(DIGIT_LOOKALIKES.values())) + "]"
+_SEPARATOR_CLASS = "[ \\-" + re.escape(DASH_LOOKALIKES) + "]"
+# Digit groups of the numbers worth correcting (card, SSN), longest first; separator offsets by length
+_NUMBER_SHAPES = ((4, 4, 4, 4), (3, 2, 4))
+_SEPARATOR_OFFSETS = {19: (4, 9, 14), 11: (3, 6)}
+_NUMBER_LIKE = re.compile(
+    "(?<![A-Za-z0-9])(?:"
+    + "|".join(_SEPARATOR_CLASS.join(f"{_DIGIT_CLASS}{{{n}}}" for n in shape) for shape in _NUMBER_SHAPES)
+    + ")(?![A-Za-z0-9])"
+)
+
+_worker_reader = None
+_pools = {}
+_pools_lock = threading.Lock()
+_readers = {}
+_readers_lock = threading.Lock()
+_read_lock = threading.Lock()  # One in-process readtext at a time; concurrent calls only fight over torch's threads
+_warm_up_started = False
+
+
+def default_workers():
+    """Number of OCR processes to use when none is configured."""
+    if DEFAULT_WORKERS > 0:
+        return DEFAULT_WORKERS
+    return max(1, (os.cpu_count() or 1) // DEFAULT_THREADS_PER_WORKER)
+
+
+def threads_per_worker(workers):
+    """Fixed share of the CPU cores given to each worker's torch runtime."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def engine_version(languages=None, backend=None):
+    """Identify the OCR engine, so cached results are never reused across engine changes."""
+    try:
+        version = metadata.version("easyocr")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    backend = backend or OCR_BACKEND
+    suffix = "" if backend == BACKEND_FP32 else f":{backend}"
+    return f"easyocr-{version}:{'+'.join(languages or OCR_LANGUAGES)}{suffix}"
+
+
+def to_plain_result(result):
+    """Convert an EasyOCR readtext result to plain Python (box, text, confidence) tuples."""
+    return [
+        ([[float(x), float(y)] for x, y in box], text, float(confidence))
+        for box, text, confidence in result
+    ]
+
+
+def result_text(result):
+    """Join the recognized text of one readtext result, ignoring boxes and confidences."""
+    return " ".join(item[1] for item in result)
+
+
+def _correct_number(match):
+    text = match.group()
+    separators = _SEPARATOR_OFFSETS[len(text)]
+    digits = [char for i, char in enumerate(text) if i not in separators]
+    misread = sum(not char.isdigit() for char in digits)
+    if misread > len(digits) // 4:
+        return text  # Mostly letters: a word or a code, not a misread number
+    chars = list(text.translate(_DIGIT_TABLE)) if misread else list(text)
+    for i in separators:
+        chars[i] = text[i] if text[i] == " " else "-"
+    return "".join(chars)
+
+
+def correct_ocr_text(text, enabled=OCR_CORRECT):
+    """
+    Correct common OCR misreads in what is shaped like an SSN or a card number.
+
+    Within a run of digit groups shaped like 123-45-6789 or 1234 5678 9012 3456
+    in which at most a quarter of the digits are look-alikes (O for 0, l for
+    1, S for 5, ...), those become digits and dash look-alikes (<, >, ~, ...)
+    become dashes. Every character is replaced by exactly one, so offsets
+    into the text stay valid. Anything else is left as it is.
+    """
+    if not enabled:
+        return text
+    return _NUMBER_LIKE.sub(_correct_number, text)
+
+
+def quantize_reader(reader):
+    """Replace the reader's recognition network with a dynamically int8-quantized copy, in place."""
+    import torch
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # torch points eager-mode quantization users at torchao
+        reader.recognizer = torch.ao.quantization.quantize_dynamic(
+            reader.recognizer, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8
+        )
+    return reader
+
+
+def get_reader(languages=None, gpu=True, backend=None):
+    """
+    Return the process-wide easyocr.Reader, loading it on first use.
+
+    All callers (and every Streamlit session of the server) share the same
+    warm reader instead of each paying for torch and the model weights.
+    The int8 backend always runs on the CPU.
+    """
+    backend = backend or OCR_BACKEND
+    if backend == BACKEND_INT8:
+        gpu = False
+    key = (tuple(languages or OCR_LANGUAGES), gpu, backend)
+    with _readers_lock:
+        if key not in _readers:
+            import easyocr
+            reader = easyocr.Reader(list(key[0]), gpu=gpu, verbose=False)
+            _readers[key] = quantize_reader(reader) if backend == BACKEND_INT8 else reader
+        return _readers[key]
+
+
+def read_page(reader, image, batch_size=DEFAULT_BATCH_SIZE):
+    """Run OCR on one page image with batched recognition."""
+    with _read_lock:
+        result = reader.readtext(image, batch_size=batch_size)
+    return to_plain_result(result)
+
+
+def ocr_sequential(reader, images, batch_size=DEFAULT_BATCH_SIZE):
+    """OCR the images one after another on the given reader."""
+    return [read_page(reader, image, batch_size) for image in images]
+
+
+def _init_worker(languages, torch_threads, backend):
+    global _worker_reader
+    import torch
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already set by the runtime in this process
+    _worker_reader = get_reader(languages, gpu=False, backend=backend)
+
+
+def _ocr_chunk(images, batch_size):
+    return ocr_sequential(_worker_reader, images, batch_size)
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class ParallelOCR:
+    """
+    A pool of OCR worker processes, each holding its own warm reader.
+
+    Args:
+        workers: Number of processes (defaults to default_workers())
+        languages: EasyOCR language list
+        backend: BACKEND_FP32 or BACKEND_INT8, defaults to OCR_BACKEND
+    """
+
+    def __init__(self, workers=None, languages=None, backend=None):
+        self.workers = workers or default_workers()
+        self.languages = list(languages or OCR_LANGUAGES)
+        self.backend = backend or OCR_BACKEND
+        # spawn, not fork: forking a process that already runs torch threads can deadlock
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.languages, threads_per_worker(self.workers), self.backend),
+        )
+
+    def map(self, images, batch_size=DEFAULT_BATCH_SIZE):
+        """OCR the images across the pool and return their results in input order."""
+        images = list(images)
+        if not images:
+            return []
+        chunk_size = max(1, -(-len(images) // (self.workers * CHUNKS_PER_WORKER)))
+        results = []
+        for chunk_result in self._executor.map(_ocr_chunk, _chunks(images, chunk_size), repeat(batch_size)):
+            results.extend(chunk_result)
+        return results
+
+    def warm_up(self):
+        """Start every worker now, so their readers are loaded before the first document arrives."""
+        for future in [self._executor.submit(_ocr_chunk, [], 1) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, images, batch_size=DEFAULT_BATCH_SIZE):
+        """OCR the images of one page on a single worker; returns a Future of their results."""
+        return self._executor.submit(_ocr_chunk, list(images), batch_size)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _Submission:
+    __slots__ = ("images", "batch_size", "future", "enqueued")
+
+    def __init__(self, images, batch_size):
+        self.images = images
+        self.batch_size = batch_size
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class OCRBatcher:
+    """
+    Shared OCR batches for concurrent documents.
+
+    submit() takes the regions of one page, like ParallelOCR.submit, and
+    returns a Future of their results. A dispatcher thread sends the waiting
+    regions as one batch as soon as max_batch of them are waiting, or once
+    the oldest has waited max_latency seconds; while a batch is being OCR'd
+    the next one fills up. A batch is spread across the process pool, or
+    read on the shared in-process reader with a single worker. When
+    max_pending regions are waiting, submit() blocks until a batch takes
+    them, which holds the submitting pipelines back.
+
+    Args:
+        workers: OCR processes, defaults to default_workers()
+        max_batch: Regions per batch
+        max_latency: Seconds a region waits at most for its batch to fill
+        max_pending: Regions waiting before submit() blocks
+    """
+
+    def __init__(self, workers=None, max_batch=BATCH_MAX_REGIONS, max_latency=BATCH_MAX_LATENCY,
+                 max_pending=BATCH_MAX_PENDING):
+        self.workers = workers or default_workers()
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_pending = max(max_pending, max_batch)
+        # Pages each document keeps submitted ahead of the one it waits on, so that batches can fill
+        self.pages_in_flight = max(2, self.workers * CHUNKS_PER_WORKER)
+        self.batches = 0
+        self.pages = 0
+        self.regions = 0
+        self.wait_seconds = 0.0
+        self._pending = deque()
+        self._pending_regions = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        threading.Thread(target=self._dispatch, name="ocr-batcher", daemon=True).start()
+
+    @property
+    def pending_regions(self):
+        return self._pending_regions
+
+    def submit(self, images, batch_size=DEFAULT_BATCH_SIZE):
+        """Queue the images of one page for the next batch; returns a Future of their results."""
+        submission = _Submission(list(images), batch_size)
+        if not submission.images:
+            submission.future.set_result([])
+            return submission.future
+        with self._cond:
+            while self._pending_regions >= self.max_pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("OCR batcher is closed")
+            submission.enqueued = time.perf_counter()
+            self._pending.append(submission)
+            self._pending_regions += len(submission.images)
+            self._cond.notify_all()
+        return submission.future
+
+    def _take(self):
+        """Wait for the next batch: submissions of one recognition batch size, at most max_batch regions."""
+        with self._cond:
+            while True:
+                if not self._pending:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                remaining = self._pending[0].enqueued + self.max_latency - time.perf_counter()
+                if self._pending_regions >= self.max_batch or remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._pending.popleft()]
+            regions = len(batch[0].images)
+            while (self._pending and self._pending[0].batch_size == batch[0].batch_size
+                   and regions + len(self._pending[0].images) <= self.max_batch):
+                batch.append(self._pending.popleft())
+                regions += len(batch[-1].images)
+            self._pending_regions -= regions
+            self._cond.notify_all()  # Room for blocked submitters
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            images = [image for submission in batch for image in submission.images]
+            try:
+                if self.workers > 1:
+                    results = get_pool(self.workers).map(images, batch[0].batch_size)
+                else:
+                    results = ocr_sequential(get_reader(), images, batch[0].batch_size)
+            except Exception as e:
+                for submission in batch:
+                    submission.future.set_exception(e)
+                continue
+            self.batches += 1
+            self.pages += len(batch)
+            self.regions += len(images)
+            self.wait_seconds += sum(started - submission.enqueued for submission in batch)
+            offset = 0
+            for submission in batch:
+                submission.future.set_result(results[offset:offset + len(submission.images)])
+                offset += len(submission.images)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "pages": self.pages,
+            "regions": self.regions,
+            "mean_batch_pages": round(self.pages / self.batches, 2) if self.batches else 0.0,
+            "mean_batch_regions": round(self.regions / self.batches, 2) if self.batches else 0.0,
+            "mean_wait_seconds": round(self.wait_seconds / self.pages, 4) if self.pages else 0.0,
+            "pending_regions": self._pending_regions,
+            "max_batch": self.max_batch,
+            "max_latency_seconds": self.max_latency,
+            "max_pending": self.max_pending,
+        }
+
+    def close(self):
+        """Stop taking submissions; what is already queued is still OCR'd."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+def get_pool(workers=None, languages=None, backend=None):
+    """Return a process-wide pool for the given size, starting it on first use."""
+    workers = workers or default_workers()
+    key = (workers, tuple(languages or OCR_LANGUAGES), backend or OCR_BACKEND)
+    with _pools_lock:  # Concurrent jobs asking at once must not each spawn a pool
+        if key not in _pools:
+            _pools[key] = ParallelOCR(workers, key[1], key[2])
+        return _pools[key]
+
+
+def warm_up(workers=None, background=True):
+    """
+    Load the in-process reader and start the OCR pool ahead of the first request.
+
+    Only the first call does anything, so it is safe to call on every
+    Streamlit rerun. With background=True the loading happens in a daemon
+    thread and the caller returns immediately.
+    """
+    global _warm_up_started
+    with _readers_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+
+    def load():
+        get_reader()
+        workers_count = workers or default_workers()
+        if workers_count > 1:
+            get_pool(workers_count).warm_up()
+
+    if background:
+        threading.Thread(target=load, name="ocr-warm-up", daemon=True).start()
+    else:
+        load()
+
+
+@atexit.register
+def shutdown_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
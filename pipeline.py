@@ -0,0 +1,456 @@
+"""
+Streaming render -> OCR -> (NER) -> redact -> write pipeline.
+
+Every stage is a generator that runs in its own thread and hands pages to
+the next stage through a small bounded queue. Rendering of page N+1 overlaps
+with OCR of page N, and only a handful of rendered pages exist at any time,
+so peak memory stays roughly flat no matter how many pages the document has.
+
+Pages travel through the stages as dicts:
+
+    page:        0-based page number
+    triage:      the triage report entry for the page
+    text:        text-layer text, completed with the OCR text after the OCR stage
+    words:       text-layer words with their boxes, as from page.get_text("words")
+    regions:     the regions rendered for OCR: dicts with the rendered rect and dpi
+    images:      their renders, grayscale NumPy frames (dropped once OCR'd)
+    render:      settings the regions were rendered with, see rasterize
+    ocr_results: raw (box, text, confidence) results per rendered region
+    segments:    where each source sits in text: dicts with source ("text" or
+                 "ocr"), region (index into ocr_results) and start/end offsets
+    entities:    redaction.Match spans found by the optional NER stage, see ner
+    matches:     redaction.Match spans found in text
+    redacted:    redacted text, set by the redaction stage
+
+Every stage reports its timings and counts to a metrics.PipelineMetrics.
+"""
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from dedup import resolve
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_RETYPESET, BackgroundWriter, ResultExports, create_writer
+from metrics import STAGE_NER, STAGE_OCR, STAGE_REDACT, STAGE_RENDER, STAGE_WRITE, PipelineMetrics
+from ner import NER_BATCH_SIZE, NER_MAX_PAGES, NER_MODEL, NER_OFF, candidate_spans, find_entities
+from ocr_cache import cache_key
+from ocr_engine import (
+    DEFAULT_BATCH_SIZE, correct_ocr_text, default_workers, engine_version, get_pool, get_reader, ocr_sequential,
+    result_text,
+)
+from preprocess import map_results
+from rasterize import RENDER_SETTINGS, render_regions
+from redaction import get_engine, merge_matches
+from triage import PAGE_TEXT, PAGE_MIXED, open_pdf, triage_page
+
+# Pages buffered between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+# Pages submitted to the OCR pool ahead of the one being waited on, per worker
+OCR_PAGES_IN_FLIGHT_PER_WORKER = 2
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def buffered(iterable, maxsize=DEFAULT_QUEUE_SIZE):
+    """
+    Drive an iterable in a background thread and yield its items through a bounded queue.
+
+    The producer blocks once maxsize items are waiting, which is what bounds
+    the memory of the whole pipeline. Exceptions raised by the producer are
+    re-raised in the consumer; closing the consumer stops the producer.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(_StageError(e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+            put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+
+
+def render_pages(pdf_bytes, metrics=None, page_range=None):
+    """
+    Triage each page, read its text layer and render only the regions that need OCR.
+
+    pdf_bytes may also be a file path (see triage.open_pdf); page_range, a
+    (start, stop) pair, limits rendering to those pages.
+    """
+    metrics = metrics or PipelineMetrics()
+    doc = open_pdf(pdf_bytes)
+    metrics.total_pages = doc.page_count
+    try:
+        for number in range(*(page_range or (doc.page_count,))):
+            page = doc.load_page(number)
+            with metrics.time(STAGE_RENDER):
+                entry = triage_page(page)
+                has_text = entry["kind"] in (PAGE_TEXT, PAGE_MIXED)
+                text = page.get_text("text").strip() if has_text else ""
+                words = page.get_text("words") if has_text else []
+                regions, images = render_regions(page, entry["ocr_regions"])
+            yield {
+                "page": entry["page"],
+                "triage": entry,
+                "text": text,
+                "words": words,
+                "regions": regions,
+                "images": images,
+                "render": RENDER_SETTINGS,
+            }
+    finally:
+        doc.close()
+
+
+def _merge_ocr(page, ocr_results):
+    """
+    Append the OCR text of each region to the text layer, remembering where every part went.
+
+    OCR boxes are mapped back to their regions' rects (see preprocess.map_results)
+    and the OCR text corrected where it looks like a misread number (see
+    ocr_engine.correct_ocr_text; the correction keeps every offset).
+    """
+    ocr_results = [map_results(result, region) for result, region in zip(ocr_results, page["regions"])]
+    parts = [("text", None, page["text"])] + [("ocr", i, correct_ocr_text(result_text(r))) for i, r in enumerate(ocr_results)]
+    pieces = []
+    segments = []
+    offset = 0
+    for source, region, part in parts:
+        if not part:
+            continue
+        if pieces:
+            offset += 1  # The "\n" between parts
+        segments.append({"source": source, "region": region, "start": offset, "end": offset + len(part)})
+        pieces.append(part)
+        offset += len(part)
+    page["ocr_results"] = ocr_results
+    page["text"] = "\n".join(pieces)
+    page["segments"] = segments
+    return page
+
+
+def _start_ocr(page, reader, pool, batch_size, cache, engine, dedup, owner):
+    """
+    Look the page's regions up in the cache, then among the near-duplicates
+    in the dedup index, and start OCR for the ones that missed both.
+    """
+    submitted = time.perf_counter()
+    images = page.pop("images")
+    keys = [cache_key(image, page["render"], engine) for image in images] if cache else [None] * len(images)
+    results = [cache.get(key) for key in keys] if cache else [None] * len(images)
+    cache_hits = sum(result is not None for result in results)
+    claims = [(None, True)] * len(images)
+    if dedup is not None:
+        context = f"{engine}:{json.dumps(page['render'], sort_keys=True)}"
+        claims = [
+            dedup.claim(context, image, owner, region["band"]) if result is None else (None, True)
+            for image, result, region in zip(images, results, page["regions"])
+        ]
+    missing = [i for i, result in enumerate(results) if result is None and claims[i][1]]
+    todo = [images[i] for i in missing]
+    if not todo:
+        future = None
+    elif pool is not None:
+        future = pool.submit(todo, batch_size)
+    else:
+        future = Future()
+        try:
+            future.set_result(ocr_sequential(reader or get_reader(), todo, batch_size))
+        except Exception as e:
+            future.set_exception(e)
+    return page, keys, results, claims, missing, future, submitted, cache_hits
+
+
+def _abandon_ocr(pending):
+    """Fail the dedup claims of a page that will never be finished, so nobody waits for them."""
+    claims, missing = pending[3], pending[4]
+    for i in missing:
+        resolve(claims[i][0], error=RuntimeError("OCR abandoned"))
+
+
+def _finish_ocr(pending, cache, metrics):
+    page, keys, results, claims, missing, future, submitted, cache_hits = pending
+    if future is not None:
+        try:
+            ocr_results = future.result()
+        except Exception as e:
+            _abandon_ocr(pending)
+            raise e
+        for i, result in zip(missing, ocr_results):
+            results[i] = result
+            resolve(claims[i][0], result)
+            if cache:
+                cache.put(keys[i], result)
+    reused = []
+    for i, (shared, owned) in enumerate(claims):
+        if not owned:
+            results[i] = shared.result()  # OCR'd for an earlier region, on this page or before it
+            reused.append(page["regions"][i]["band"])
+            if cache:
+                cache.put(keys[i], results[i])
+    if results:
+        metrics.observe_ocr(time.perf_counter() - submitted, len(results), cache_hits, len(reused))
+        metrics.observe_bands([region["band"] for region in page["regions"]], reused)
+    return _merge_ocr(page, results)
+
+
+def ocr_stage(pages, reader=None, workers=None, batch_size=DEFAULT_BATCH_SIZE, cache=None, metrics=None, dedup=None,
+              ocr=None):
+    """
+    OCR the rendered regions of each page, keeping pages in order.
+
+    Regions found in the cache (an ocr_cache.OCRCache) are not OCR'd again,
+    nor are near-duplicates of regions OCR'd before (a dedup.DedupIndex).
+    In-process OCR uses the given reader, or the shared one from get_reader().
+    With more than one worker, up to OCR_PAGES_IN_FLIGHT_PER_WORKER pages per
+    worker are submitted to the process pool ahead of the page being waited on.
+    With an ocr_engine.OCRBatcher as ocr, pages are submitted to its shared
+    batches instead, up to its pages_in_flight ahead.
+    The stage time excludes waiting for rendered pages; the per-page latency
+    includes the time a page spent queued in the pool or the batcher.
+    """
+    metrics = metrics or PipelineMetrics()
+    if ocr is not None:
+        pool, window = ocr, ocr.pages_in_flight
+    else:
+        workers = workers or default_workers()
+        pool = get_pool(workers) if workers > 1 else None
+        window = workers * OCR_PAGES_IN_FLIGHT_PER_WORKER if pool is not None else 0
+    engine = engine_version()
+    owner = object()  # This document, for the dedup index
+    in_flight = deque()
+    try:
+        for page in pages:
+            with metrics.time(STAGE_OCR, pages=0):
+                in_flight.append(_start_ocr(page, reader, pool, batch_size, cache, engine, dedup, owner))
+            while len(in_flight) > window:
+                with metrics.time(STAGE_OCR):
+                    done = _finish_ocr(in_flight.popleft(), cache, metrics)
+                yield done
+        while in_flight:
+            with metrics.time(STAGE_OCR):
+                done = _finish_ocr(in_flight.popleft(), cache, metrics)
+            yield done
+    finally:
+        for pending in in_flight:  # Stopped early: cancelled, or a page failed
+            _abandon_ocr(pending)
+
+
+def _find_entities(batch, model, metrics):
+    with metrics.time(STAGE_NER, pages=0):
+        texts = [page["text"] for page, _ in batch]
+        spans = [spans for _, spans in batch]
+        found = find_entities(texts, spans, model)
+    metrics.observe_ner(
+        sum(len(page_spans) for page_spans in spans),
+        sum(end - start for page_spans in spans for start, end in page_spans),
+        sum(len(entities) for entities in found),
+    )
+    for (page, _), entities in zip(batch, found):
+        page["entities"] = entities
+        yield page
+
+
+def ner_stage(pages, model=None, metrics=None):
+    """
+    Find NER entities in the prefiltered candidate spans of each page, see ner.
+
+    Pages are held back until they have NER_BATCH_SIZE candidates between
+    them (or NER_MAX_PAGES pages), so that one model call covers several
+    pages. Pages without candidates pass straight through when nothing is
+    held back.
+    """
+    metrics = metrics or PipelineMetrics()
+    batch = []
+    candidates = 0
+    for page in pages:
+        with metrics.time(STAGE_NER):
+            spans = candidate_spans(page["text"])
+        if not spans and not batch:
+            page["entities"] = []
+            yield page
+            continue
+        batch.append((page, spans))
+        candidates += len(spans)
+        if candidates >= NER_BATCH_SIZE or len(batch) >= NER_MAX_PAGES:
+            yield from _find_entities(batch, model, metrics)
+            batch = []
+            candidates = 0
+    if batch:
+        yield from _find_entities(batch, model, metrics)
+
+
+def redact_stage(pages, engine, metrics=None):
+    """Find the matches of a redaction.RedactionEngine in each page, add its NER entities, and apply them."""
+    metrics = metrics or PipelineMetrics()
+    for page in pages:
+        with metrics.time(STAGE_REDACT):
+            page["matches"] = merge_matches(engine.find(page["text"]), page.get("entities"))
+            page["redacted"] = engine.apply(page["text"], page["matches"])
+        metrics.observe_redaction(page["text"], page["matches"])
+        yield page
+
+
+def write_stage(pages, writers, metrics=None):
+    """Hand each redacted page to every writer (objects with a write_page(page) method)."""
+    metrics = metrics or PipelineMetrics()
+    for page in pages:
+        with metrics.time(STAGE_WRITE):
+            for writer in writers:
+                writer.write_page(page)
+        yield page
+
+
+def run_pipeline(pdf_bytes, engine, reader=None, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                 writers=(), queue_size=DEFAULT_QUEUE_SIZE, cache=None, metrics=None, ner_model=None, page_range=None,
+                 dedup=None, ocr=None):
+    """
+    Stream a PDF through render, OCR, NER, redaction and output writing.
+
+    Args:
+        pdf_bytes: The PDF document as bytes, or its path
+        engine: redaction.RedactionEngine applied to each page's text
+        reader: easyocr.Reader used when OCR runs in-process (workers == 1),
+            defaults to the shared one from ocr_engine.get_reader()
+        workers, batch_size: OCR parallelism, see ocr_engine
+        cache: Optional ocr_cache.OCRCache consulted before OCR
+        dedup: Optional dedup.DedupIndex of near-duplicate regions, consulted next
+        ocr: Optional ocr_engine.OCRBatcher shared with other documents, replaces workers
+        writers: Output writers fed each redacted page as it is produced
+        queue_size: Pages buffered between two stages
+        metrics: Optional metrics.PipelineMetrics the stages report to
+        ner_model: NER model run on prefiltered text, see ner; defaults to
+            REDACTOR_NER, ner.NER_OFF skips the stage
+        page_range: Optional (start, stop) pages to process, e.g. one shard
+
+    Yields:
+        Page dicts in page order, once they have been written
+    """
+    metrics = metrics or PipelineMetrics()
+    pages = buffered(render_pages(pdf_bytes, metrics, page_range), queue_size)
+    pages = buffered(ocr_stage(pages, reader, workers, batch_size, cache, metrics, dedup, ocr), queue_size)
+    ner_model = ner_model or NER_MODEL
+    if ner_model != NER_OFF:
+        pages = buffered(ner_stage(pages, ner_model, metrics), queue_size)
+    pages = buffered(redact_stage(pages, engine, metrics), queue_size)
+    return buffered(write_stage(pages, writers, metrics), queue_size)
+
+
+def iter_redact_pdf(pdf_bytes, mode="conservative", workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                    pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), cache=None, metrics=None,
+                    ner_model=None, dedup=None, ocr=None):
+    """
+    Step-by-step redact_pdf: yields each page as it comes out of the pipeline.
+
+    The generator's return value (StopIteration.value) is what redact_pdf
+    returns. Closing it early stops the pipeline. Used by the job queue to
+    interleave documents page by page.
+
+    Each export format is written by a BackgroundWriter as the pages come
+    out, and all of them start serializing as soon as the last page is in.
+    """
+    metrics = metrics or PipelineMetrics()
+    writers = {fmt: BackgroundWriter(create_writer(fmt, pdf_bytes, pdf_output)) for fmt in export_formats}
+    pages = []
+    try:
+        for page in run_pipeline(
+            pdf_bytes,
+            get_engine(mode),
+            workers=workers,
+            batch_size=batch_size,
+            writers=list(writers.values()),
+            cache=cache,
+            metrics=metrics,
+            ner_model=ner_model,
+            dedup=dedup,
+            ocr=ocr,
+        ):
+            pages.append(page)
+            if metrics.on_page is not None:
+                metrics.on_page(page, metrics)
+            yield page
+    except BaseException:
+        for writer in writers.values():
+            writer.cancel()
+        raise
+    metrics.finish()
+    if not any(page["text"].strip() for page in pages):
+        for writer in writers.values():
+            writer.cancel()
+        return pages, None
+    for writer in writers.values():
+        writer.finish()
+
+    exports = ResultExports(pages, pdf_bytes, pdf_output, metrics)
+    for fmt, writer in writers.items():
+        exports.add_writer(fmt, writer)
+    return pages, exports
+
+
+def redact_pdf(pdf_bytes, mode="conservative", workers=None, batch_size=DEFAULT_BATCH_SIZE,
+               pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), cache=None, metrics=None,
+               ner_model=None, dedup=None, ocr=None):
+    """
+    Run one PDF through the whole pipeline. Errors are raised, not reported.
+
+    Args:
+        pdf_bytes: The PDF document as bytes
+        mode: "conservative" or "aggressive"
+        workers, batch_size: OCR parallelism, see ocr_engine
+        pdf_output: exporters.PDF_OUTPUT_RETYPESET or PDF_OUTPUT_IN_PLACE
+        export_formats: Formats written while the pages stream through; any
+            other format is built on demand, see exporters.ResultExports
+        cache: Optional ocr_cache.OCRCache
+        dedup: Optional dedup.DedupIndex, near-duplicate regions reuse its OCR results
+        ocr: Optional ocr_engine.OCRBatcher, for documents processed side by side (see service)
+        metrics: Optional metrics.PipelineMetrics; its on_page callback is
+            called in the caller's thread as each page comes out of the pipeline
+        ner_model: ner.NER_OFF, a ner.NER_MODELS key or a model name; defaults to REDACTOR_NER
+
+    Returns:
+        (pages, exports): the page dicts in order, and the ResultExports of the
+        document, or None when no text could be extracted
+    """
+    steps = iter_redact_pdf(
+        pdf_bytes, mode, workers, batch_size, pdf_output, export_formats, cache, metrics, ner_model, dedup, ocr,
+    )
+    try:
+        while True:
+            next(steps)
+    except StopIteration as done:
+        return done.value
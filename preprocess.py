@@ -0,0 +1,236 @@
+"""
+Clean-up of rendered regions before OCR, in NumPy.
+
+Scans come with speckles, a slight tilt and uneven paper. Every step below
+works on the whole grayscale frame with array operations (no per-pixel
+Python), and each can be switched on or off:
+
+    despeckle   isolated dark specks are turned white: a dark pixel with
+                little ink in the SPECKLE_WINDOW_PT square around it and
+                none further out along its line or above and below it
+                (counted with an integral image, in points scaled to the
+                render's dpi).
+                Periods, hyphens and the dots of i sit next to the glyphs
+                of their line and are kept; EasyOCR's detector no longer
+                proposes boxes for stray specks in the margins. Off by
+                default until bench_preprocess shows it costs no recall.
+    deskew      the tilt of the text lines is found by projection profiles:
+                the ink is projected along every candidate slope within
+                MAX_SKEW_DEGREES and the slope whose row histogram is the
+                most sharply peaked wins. Columns are then shifted by strips
+                (a vertical shear, which for a few degrees is the rotation
+                up to a fraction of a pixel) so the lines come out level.
+    binarize    global Otsu threshold: ink black, paper white. Off by
+                default, EasyOCR is trained on anti-aliased text.
+    crop        regions that are not split into bands (see rasterize) are
+                trimmed to their ink at full resolution, like bands are.
+
+Rendering already picks the resolution at which text lines come out
+TARGET_TEXT_PX high and clips to the ink found on a thumbnail (see
+rasterize), so frames are not downscaled again here. That resolution is
+capped by the scan's own and by MIN_DPI/MAX_DPI, so sizes that depend on
+the print (the speck windows) are given in points and converted with the
+render's dpi.
+
+A deskewed frame no longer lines up with the page, so its regions carry a
+"transform", an affine map (a, b, c, d, e, f) from the pixels OCR sees back
+to the pixels of the region's rect: x' = a x + b y + c, y' = d x + e y + f.
+The pipeline applies it to the OCR boxes (see map_results) before anything
+locates text on the page.
+
+    REDACTOR_PREPROCESS   comma-separated steps, or "none" (default deskew,crop)
+"""
+import math
+import os
+
+import numpy as np
+
+STEP_DESPECKLE = "despeckle"
+STEP_DESKEW = "deskew"
+STEP_BINARIZE = "binarize"
+STEP_CROP = "crop"
+STEPS = (STEP_DESPECKLE, STEP_DESKEW, STEP_BINARIZE, STEP_CROP)
+DEFAULT_STEPS = (STEP_DESKEW, STEP_CROP)
+
+
+def parse_steps(value):
+    """Steps named in a comma-separated string, in pipeline order; "none" or "" for none."""
+    names = {name.strip().lower() for name in value.split(",")} - {"", "none"}
+    unknown = names - set(STEPS)
+    if unknown:
+        raise ValueError(f"Unknown preprocessing steps: {', '.join(sorted(unknown))}")
+    return tuple(step for step in STEPS if step in names)
+
+
+PREPROCESS = parse_steps(os.environ.get("REDACTOR_PREPROCESS", ",".join(DEFAULT_STEPS)))
+
+INK_THRESHOLD = 160  # Gray level below which a pixel counts as ink, as in rasterize
+PAPER = 255
+
+# A dark pixel is a speck when no more than SPECKLE_MAX_FILL of the SPECKLE_WINDOW_PT square
+# around it is dark and there is no other ink beyond that square within SPECKLE_LINE_CLEARANCE_PT
+# to the left and right or SPECKLE_CLEARANCE_PT above and below. The clearances are what keep
+# punctuation: a period or hyphen has glyphs of its line within a word space or two, the dot
+# of an i is less than a point above its stem
+SPECKLE_WINDOW_PT = 2.0
+SPECKLE_MAX_FILL = 0.25
+SPECKLE_CLEARANCE_PT = 3.0
+SPECKLE_LINE_CLEARANCE_PT = 12.0
+
+# Tilts searched, coarse then fine around the best coarse one, and below which a frame is left as it is
+MAX_SKEW_DEGREES = 5.0
+SKEW_COARSE_STEP_DEGREES = 0.5
+SKEW_FINE_STEP_DEGREES = 0.05
+MIN_SKEW_DEGREES = 0.2
+# The skew is measured on every SKEW_STRIDE-th row and column, and on at most SKEW_MAX_POINTS ink pixels
+SKEW_STRIDE = 4
+SKEW_MAX_POINTS = 50_000
+# Less ink than this (in sampled pixels) and the skew is not measured
+SKEW_MIN_POINTS = 200
+
+
+def _angles(center, half_range, step):
+    return np.arange(center - half_range, center + half_range + step / 2, step)
+
+
+def _window_counts(integral, shape, pad, ry, rx):
+    """Dark pixels in the (2ry + 1) x (2rx + 1) window around every pixel, from an integral image padded by pad."""
+    height, width = shape
+    top, left = pad[0] - ry, pad[1] - rx
+    h, w = 2 * ry + 1, 2 * rx + 1
+    return (integral[top + h:top + h + height, left + w:left + w + width]
+            - integral[top:top + height, left + w:left + w + width]
+            - integral[top + h:top + h + height, left:left + width]
+            + integral[top:top + height, left:left + width])
+
+
+def despeckle(frame, dpi):
+    """Turn isolated dark specks white, in place. Returns the frame."""
+    dark = frame < INK_THRESHOLD
+    scale = dpi / 72
+    r = max(1, math.ceil(SPECKLE_WINDOW_PT * scale / 2))
+    pad = (r + max(1, round(SPECKLE_CLEARANCE_PT * scale)), r + max(1, round(SPECKLE_LINE_CLEARANCE_PT * scale)))
+    # Integral image with a zero row and column in front: any window sum is four lookups
+    integral = np.zeros((frame.shape[0] + 2 * pad[0] + 1, frame.shape[1] + 2 * pad[1] + 1), dtype=np.int32)
+    integral[pad[0] + 1:frame.shape[0] + pad[0] + 1, pad[1] + 1:frame.shape[1] + pad[1] + 1] = dark
+    integral.cumsum(axis=0, out=integral)
+    integral.cumsum(axis=1, out=integral)
+    near = _window_counts(integral, frame.shape, pad, r, r)
+    around = _window_counts(integral, frame.shape, pad, *pad)
+    frame[dark & (near <= SPECKLE_MAX_FILL * (2 * r + 1) ** 2) & (around == near)] = PAPER
+    return frame
+
+
+def _profile_scores(ys, xs, angles):
+    """Sum of squares of the row histogram of the points projected along each angle, in one bincount."""
+    slopes = np.tan(np.radians(angles))
+    projected = np.rint(ys[None, :] - slopes[:, None] * xs[None, :]).astype(np.int32)
+    projected -= projected.min()
+    bins = int(projected.max()) + 1
+    projected += (np.arange(len(angles), dtype=np.int32) * bins)[:, None]
+    histograms = np.bincount(projected.ravel(), minlength=len(angles) * bins).reshape(len(angles), bins)
+    return np.einsum("ij,ij->i", histograms, histograms)
+
+
+def estimate_skew(frame):
+    """
+    Slope (dy/dx) of the text lines of a frame, 0.0 when it cannot be told.
+
+    Every candidate angle projects the sampled ink pixels onto rows
+    y - tan(angle) x; the angle whose histogram has the largest sum of
+    squares, i.e. whose lines fall into the fewest rows, is the tilt.
+    """
+    ys, xs = np.nonzero(frame[::SKEW_STRIDE, ::SKEW_STRIDE] < INK_THRESHOLD)
+    if ys.size < SKEW_MIN_POINTS:
+        return 0.0
+    if ys.size > SKEW_MAX_POINTS:
+        step = -(-ys.size // SKEW_MAX_POINTS)
+        ys, xs = ys[::step], xs[::step]
+    coarse = _angles(0.0, MAX_SKEW_DEGREES, SKEW_COARSE_STEP_DEGREES)
+    scores = _profile_scores(ys, xs, coarse)
+    best = int(np.argmax(scores))
+    if scores[best] <= scores[len(coarse) // 2]:
+        return 0.0  # Level lines score as well as any tilt
+    fine = _angles(coarse[best], SKEW_COARSE_STEP_DEGREES, SKEW_FINE_STEP_DEGREES)
+    angle = fine[int(np.argmax(_profile_scores(ys, xs, fine)))]
+    return float(np.tan(np.radians(angle)))
+
+
+def deskew(frame, slope):
+    """
+    Level lines of the given slope by shifting each column down by c - slope * x.
+
+    Returns:
+        (frame, c): the new frame, taller by the largest shift and padded
+        with paper, and the shift constant c, for mapping boxes back
+    """
+    height, width = frame.shape
+    c = max(0.0, slope * (width - 1))
+    shifts = np.rint(c - slope * np.arange(width)).astype(np.int64)
+    out = np.full((height + int(shifts.max()), width), PAPER, dtype=np.uint8)
+    # Columns with the same shift form strips; a tilt of a few degrees gives a few hundred
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(shifts)) + 1))
+    ends = np.concatenate((starts[1:], [width]))
+    for start, end in zip(starts, ends):
+        shift = shifts[start]
+        out[shift:shift + height, start:end] = frame[:, start:end]
+    return out, c
+
+
+def binarize(frame):
+    """Black ink on white paper, at the Otsu threshold of the frame's histogram."""
+    histogram = np.bincount(frame.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)  # Pixels at or below each level
+    mass = np.cumsum(histogram * levels)
+    total, total_mass = weight[-1], mass[-1]
+    # Between-class variance of splitting after each level, up to a constant factor
+    denominator = weight * (total - weight)
+    valid = denominator > 0
+    between = np.zeros(256)
+    between[valid] = (total_mass * weight[valid] - total * mass[valid]) ** 2 / denominator[valid]
+    threshold = int(np.argmax(between)) if valid.any() else INK_THRESHOLD
+    return np.where(frame > threshold, PAPER, 0).astype(np.uint8)
+
+
+def preprocess(frame, dpi, steps=PREPROCESS):
+    """
+    Run the enabled steps (except crop, see rasterize) over one rendered frame.
+
+    Args:
+        frame: Grayscale uint8 frame; despeckling changes it in place
+        dpi: Resolution the frame was rendered at
+        steps: Steps to run, see parse_steps
+
+    Returns:
+        (frame, shear): shear is (slope, c) when the frame was deskewed, else None
+    """
+    shear = None
+    if STEP_DESPECKLE in steps:
+        frame = despeckle(frame, dpi)
+    if STEP_DESKEW in steps:
+        slope = estimate_skew(frame)
+        if abs(math.degrees(math.atan(slope))) >= MIN_SKEW_DEGREES:
+            frame, c = deskew(frame, slope)
+            shear = (slope, c)
+    if STEP_BINARIZE in steps:
+        frame = binarize(frame)
+    return frame, shear
+
+
+def shear_transform(shear, left):
+    """The region transform of the part of a deskewed frame starting at column left, see the module docstring."""
+    slope, c = shear
+    return (1.0, 0.0, 0.0, float(slope), 1.0, float(slope * left - c))
+
+
+def map_results(results, region):
+    """OCR results of a region with their boxes mapped through the region's transform, if it has one."""
+    transform = region.get("transform")
+    if transform is None:
+        return results
+    a, b, c, d, e, f = transform
+    return [
+        ([[a * x + b * y + c, d * x + e * y + f] for x, y in box], text, confidence)
+        for box, text, confidence in results
+    ]
@@ -0,0 +1,102 @@
+"""
+Paginated HTML preview of a redacted document.
+
+The preview is sent to the browser a window of PREVIEW_PAGES pages at a
+time, never as the whole document, so its size does not grow with the page
+count. Each page is rendered once into an HTML fragment: its text, HTML
+escaped, with every redaction label wrapped in a <mark> that names the
+category and rule. The fragments are kept in a PagePreview, which lives on
+its results.RedactionView, so reruns, paging back and forth and switching
+between views reuse them; at most FRAGMENT_CACHE_PAGES are kept per view.
+
+The hit index lists every redaction by category, in page order, so the
+preview can jump straight to any of them.
+"""
+import html
+from collections import OrderedDict
+
+from redaction import redaction_label
+
+# Pages shown (and sent to the browser) at once
+PREVIEW_PAGES = 5
+# Rendered page fragments kept per view, least recently used dropped first
+FRAGMENT_CACHE_PAGES = 256
+
+
+class PagePreview:
+    """
+    Rendered page fragments and the hit index of one redacted document.
+
+    Args:
+        pages: Page dicts with "page", "text" and this view's "matches" (results.Redaction or redaction.Match)
+    """
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._fragments = OrderedDict()
+        self._hits = None
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    @property
+    def hits(self):
+        """{category: [(page index, hit number on the page, match)]} in page and text order."""
+        if self._hits is None:
+            hits = {}
+            for index, page in enumerate(self.pages):
+                for number, match in enumerate(page["matches"]):
+                    hits.setdefault(match.category, []).append((index, number, match))
+            self._hits = hits
+        return self._hits
+
+    def _render(self, index, original, selected):
+        page = self.pages[index]
+        text = page["text"]
+        pieces = []
+        last = 0
+        for number, match in enumerate(page["matches"]):
+            pieces.append(html.escape(text[last:match.start]))
+            shown = text[match.start:match.end] if original else redaction_label(match.category)
+            css = "redaction-hit hit-selected" if number == selected else "redaction-hit"
+            title = html.escape(f"{match.category} · {match.rule}", quote=True)
+            pieces.append(f'<mark class="{css}" title="{title}">{html.escape(shown)}</mark>')
+            last = match.end
+        pieces.append(html.escape(text[last:]))
+        return (
+            f'<div class="preview-page"><div class="preview-page-number">Page {page["page"] + 1}</div>'
+            f'<div class="preview-page-text">{"".join(pieces)}</div></div>'
+        )
+
+    def fragment(self, index, original=False, selected=None):
+        """
+        The HTML of one page, from the cache when it was rendered before.
+
+        Args:
+            index: Page index
+            original: Show the original text with the redacted spans marked, instead of the labels
+            selected: Hit number on this page to highlight, if any
+        """
+        key = (index, original, selected)
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = self._fragments[key] = self._render(index, original, selected)
+            while len(self._fragments) > FRAGMENT_CACHE_PAGES:
+                self._fragments.popitem(last=False)
+        else:
+            self._fragments.move_to_end(key)
+        return fragment
+
+    def window(self, first, count=PREVIEW_PAGES, original=False, selected=None):
+        """
+        The HTML of count pages from page index first.
+
+        Args:
+            selected: (page index, hit number) to highlight, e.g. from hits
+        """
+        last = min(self.page_count, first + count)
+        return "".join(
+            self.fragment(index, original, selected[1] if selected and selected[0] == index else None)
+            for index in range(first, last)
+        )
@@ -0,0 +1,259 @@
+"""
+Adaptive rasterization of the page regions that need OCR.
+
+Each region is first rendered as a small grayscale thumbnail, which tells
+three things: whether there is any ink at all (blank regions are not OCR'd),
+where the ink is (the render is clipped to it, with a margin), and how tall
+the text lines are. The resolution of the real render is then chosen so that
+a line of text comes out around TARGET_TEXT_PX pixels high, which is where
+EasyOCR reads best: small print gets more pixels, large print fewer. It is
+capped by the resolution of the scanned images on the page, since
+rendering above it only interpolates, and by MAX_PIXELS for large-format pages.
+
+Regions are rendered in grayscale and handed to EasyOCR as NumPy arrays
+that share the pixmap's sample buffer: nothing is encoded, decoded or copied.
+
+Tall regions (whole scanned pages) are split into header, body and footer
+bands at the first blank gap near their top and bottom. Each band is OCR'd
+as a region of its own, so a letterhead or footer that repeats on every page
+can be recognized once and reused (see dedup) while the body is OCR'd fresh.
+
+Each render is cleaned up before it is split (deskewed by default, see
+preprocess); regions that are not split are cropped to their ink like the
+bands.
+
+Settings can be overridden with REDACTOR_RENDER_DPI (a fixed resolution
+instead of the adaptive one), REDACTOR_CLIP_TO_CONTENT=0 and
+REDACTOR_SPLIT_BANDS=0.
+"""
+import os
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from preprocess import PREPROCESS, STEP_CROP, preprocess, shear_transform
+
+MIN_DPI = 100
+MAX_DPI = 300
+FIXED_DPI = int(os.environ["REDACTOR_RENDER_DPI"]) if os.environ.get("REDACTOR_RENDER_DPI") else None
+CLIP_TO_CONTENT = os.environ.get("REDACTOR_CLIP_TO_CONTENT", "1") != "0"
+SPLIT_BANDS = os.environ.get("REDACTOR_SPLIT_BANDS", "1") != "0"
+
+# Height, in rendered pixels, that a line of text should come out at
+TARGET_TEXT_PX = 28
+
+# Largest render of one region, in pixels (about A3 at 300 dpi)
+MAX_PIXELS = 17_000_000
+
+# Thumbnail used to find the ink and measure the text lines
+THUMBNAIL_DPI = 50
+INK_THRESHOLD = 160  # Gray level below which a thumbnail pixel counts as ink
+CLIP_MARGIN = 6  # Points kept around the ink
+
+BAND_HEADER = "header"
+BAND_BODY = "body"
+BAND_FOOTER = "footer"
+BAND_NONE = "region"  # A region that was not split
+# Header and footer gaps are looked for within this fraction of the top and bottom of a region
+BAND_FRACTION = 0.15
+# Regions shorter than this (points) are never split: photos, stamps, snippets
+MIN_SPLIT_HEIGHT = 216
+# Blank rows, in rendered pixels, that separate a band from the body: about one text line
+MIN_BAND_GAP_PX = TARGET_TEXT_PX
+# A row or column with ink on no more than this fraction of its pixels counts as blank
+BLANK_LINE_INK = 0.005
+# Pixels kept around the ink of a band
+BAND_MARGIN_PX = 4
+
+# What the renders depend on besides their pixels; part of the OCR cache key
+RENDER_SETTINGS = {
+    "colorspace": "gray", "format": "array", "target_text_px": TARGET_TEXT_PX, "bands": SPLIT_BANDS,
+    "preprocess": list(PREPROCESS),
+}
+
+
+class _PixmapBuffer:
+    """Exposes a pixmap's samples to NumPy; the array keeps this object, and so the pixmap, alive."""
+
+    def __init__(self, pix):
+        self.pixmap = pix
+        shape = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+        self.__array_interface__ = {
+            "shape": shape,
+            "strides": (pix.stride, pix.n, 1)[:len(shape)],
+            "typestr": "|u1",
+            "data": (pix.samples_ptr, False),
+            "version": 3,
+        }
+
+
+def pixmap_frame(pix):
+    """
+    Return the samples of a pixmap as a (height, width[, channels]) uint8 array, without copying.
+
+    The result is a plain np.ndarray (EasyOCR checks the exact type).
+    """
+    return np.asarray(_PixmapBuffer(pix))
+
+
+def _ink_runs(mask):
+    """Lengths of the runs of True in a 1-d boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+
+
+def _native_dpi(page, rect):
+    """Highest resolution of the images drawn in rect, or None when there are none."""
+    best = None
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if bbox.is_empty or not bbox.intersects(rect):
+            continue
+        dpi = max(info["width"] * 72 / bbox.width, info["height"] * 72 / bbox.height)
+        best = dpi if best is None else max(best, dpi)
+    return best
+
+
+def plan_region(page, rect):
+    """
+    Decide how to render one region of a page.
+
+    Returns:
+        (dpi, clip) with clip the fitz.Rect to render, or None when the region is blank
+    """
+    thumbnail = pixmap_frame(page.get_pixmap(dpi=THUMBNAIL_DPI, clip=rect, colorspace=fitz.csGRAY))
+    ink = thumbnail < INK_THRESHOLD
+    rows = ink.any(axis=1)
+    if not rows.any():
+        return None
+    scale = 72 / THUMBNAIL_DPI  # Thumbnail pixels to points
+
+    clip = fitz.Rect(rect)
+    if CLIP_TO_CONTENT:
+        cols = ink.any(axis=0)
+        top, bottom = np.flatnonzero(rows)[[0, -1]]
+        left, right = np.flatnonzero(cols)[[0, -1]]
+        clip = fitz.Rect(
+            rect.x0 + left * scale - CLIP_MARGIN,
+            rect.y0 + top * scale - CLIP_MARGIN,
+            rect.x0 + (right + 1) * scale + CLIP_MARGIN,
+            rect.y0 + (bottom + 1) * scale + CLIP_MARGIN,
+        ) & rect
+
+    if FIXED_DPI:
+        return FIXED_DPI, clip
+    line_height = float(np.median(_ink_runs(rows))) * scale  # Points
+    dpi = TARGET_TEXT_PX * 72 / max(line_height, 1)
+    native = _native_dpi(page, clip)
+    if native is not None:
+        dpi = min(dpi, native)
+    dpi = min(max(dpi, MIN_DPI), MAX_DPI)
+    dpi = min(dpi, 72 * (MAX_PIXELS / max(clip.width * clip.height, 1)) ** 0.5)
+    return int(dpi), clip
+
+
+def _ink_mask(frame):
+    """Dark 2 x 2 pixel squares (marked at their top-left pixel); scattered scanner speckles are not ink."""
+    dark = frame < INK_THRESHOLD
+    ink = np.zeros_like(dark)
+    ink[:-1, :-1] = dark[:-1, :-1] & dark[:-1, 1:] & dark[1:, :-1] & dark[1:, 1:]
+    return ink
+
+
+def _inked(ink, axis):
+    """Rows (axis=1) or columns (axis=0) of an ink mask that hold more than a trace of ink."""
+    return np.count_nonzero(ink, axis=axis) > ink.shape[axis] * BLANK_LINE_INK
+
+
+def split_bands(frame):
+    """
+    Cut a rendered region into header, body and footer bands.
+
+    The header ends in the middle of the first gap of at least MIN_BAND_GAP_PX
+    blank rows that starts within the top BAND_FRACTION of the frame, the
+    footer starts in the middle of the last such gap within the bottom
+    BAND_FRACTION. Either may be missing. Each band is then cropped to its
+    own ink, so the same letterhead comes out the same size on every page
+    whatever the rest of the page holds.
+
+    Returns:
+        [(band, (top, bottom, left, right)), ...] in pixels, from top to bottom; blank bands are left out
+    """
+    ink = _ink_mask(frame)
+    height = frame.shape[0]
+    blank = ~_inked(ink, 1)
+    edges = np.diff(np.concatenate(([0], blank.astype(np.int8), [0])))
+    gaps = [
+        (start, end) for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+        if end - start >= MIN_BAND_GAP_PX and 0 < start and end < height  # Not the margins
+    ]
+    top = next(((start + end) // 2 for start, end in gaps if start <= height * BAND_FRACTION), 0)
+    bottom = next(((start + end) // 2 for start, end in reversed(gaps) if end >= height * (1 - BAND_FRACTION)), height)
+    bands = []
+    for band, first, end in ((BAND_HEADER, 0, top), (BAND_BODY, top, bottom), (BAND_FOOTER, bottom, height)):
+        rows = np.flatnonzero(~blank[first:end])
+        cols = np.flatnonzero(_inked(ink[first:end], 0))
+        if not rows.size or not cols.size:
+            continue
+        bands.append((band, (
+            max(first, first + rows[0] - BAND_MARGIN_PX), min(end, first + rows[-1] + 1 + BAND_MARGIN_PX),
+            max(0, cols[0] - BAND_MARGIN_PX), min(frame.shape[1], cols[-1] + 1 + BAND_MARGIN_PX),
+        )))
+    return bands
+
+
+def ink_bounds(frame):
+    """(top, bottom, left, right) of the ink of a frame with BAND_MARGIN_PX around it, None when it is blank."""
+    ink = _ink_mask(frame)
+    rows = np.flatnonzero(_inked(ink, 1))
+    cols = np.flatnonzero(_inked(ink, 0))
+    if not rows.size or not cols.size:
+        return None
+    return (
+        max(0, rows[0] - BAND_MARGIN_PX), min(frame.shape[0], rows[-1] + 1 + BAND_MARGIN_PX),
+        max(0, cols[0] - BAND_MARGIN_PX), min(frame.shape[1], cols[-1] + 1 + BAND_MARGIN_PX),
+    )
+
+
+def render_regions(page, rects, steps=PREPROCESS):
+    """
+    Render the non-blank regions of a page for OCR.
+
+    steps are the preprocessing steps run on every render, see preprocess.
+
+    Returns:
+        (regions, frames): regions are dicts with the rendered rect, dpi and
+        band (BAND_HEADER, BAND_BODY, BAND_FOOTER or BAND_NONE), frames the
+        matching grayscale arrays, see pixmap_frame. Bands are slices of
+        their region's frame and share its memory. A region cut from a
+        deskewed frame has a "transform" too, see preprocess.
+    """
+    regions = []
+    frames = []
+    for rect in rects:
+        plan = plan_region(page, rect)
+        if plan is None:
+            continue
+        dpi, clip = plan
+        frame, shear = preprocess(pixmap_frame(page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY)), dpi, steps)
+        if SPLIT_BANDS and clip.height >= MIN_SPLIT_HEIGHT:
+            parts = split_bands(frame)
+        elif STEP_CROP in steps:
+            bounds = ink_bounds(frame)
+            parts = [(BAND_NONE, bounds)] if bounds else []
+        else:
+            parts = [(BAND_NONE, (0, frame.shape[0], 0, frame.shape[1]))]
+        scale = 72 / dpi
+        for band, (top, bottom, left, right) in parts:
+            frames.append(frame[top:bottom, left:right])
+            region = {"rect": clip, "dpi": dpi, "band": band}
+            if (top, bottom, left, right) != (0, frame.shape[0], 0, frame.shape[1]):
+                region["rect"] = fitz.Rect(
+                    clip.x0 + left * scale, clip.y0 + top * scale, clip.x0 + right * scale, clip.y0 + bottom * scale,
+                )
+                if shear is None:
+                    region["rect"] &= clip  # A deskewed frame is taller than the clip; its rect is only an origin
+            if shear is not None:
+                region["transform"] = shear_transform(shear, left)
+            regions.append(region)
+    return regions, frames
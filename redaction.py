@@ -0,0 +1,233 @@
+"""
+Single-pass redaction engine.
+
+All rules of a mode are compiled once into a single alternation, so a
+document is scanned once for every category at the same time. Matches come
+out left to right and never overlap; where two rules could match at the same
+position the one listed first wins. The redacted text is then assembled in
+one pass from the untouched stretches between matches, so only the matched
+spans themselves are replaced.
+
+The combined expression is prefixed with a lookahead on the characters any
+rule can start with, so the scan skips most positions after a single
+character test instead of trying every alternative there.
+"""
+import bisect
+import re
+from dataclasses import dataclass
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+SSN = "SSN"
+CREDIT_CARD = "CREDIT CARD"
+ADDRESS = "ADDRESS"
+ZIP = "ZIP"
+
+CATEGORIES = (SSN, CREDIT_CARD, ADDRESS, ZIP)
+
+
+def redaction_label(category):
+    return f"[REDACTED {category}]"
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    A single detection rule.
+
+    Args:
+        name: Unique rule name, reported with each match
+        category: One of CATEGORIES, decides the replacement label
+        pattern: Regular expression; must not contain capturing groups
+        flags: re flags applied to this rule only
+        context_words: If set, the match is only redacted when one of these
+            words appears within context_window characters around it
+    """
+    name: str
+    category: str
+    pattern: str
+    flags: int = 0
+    context_words: tuple = ()
+    context_window: int = 10
+
+
+@dataclass(frozen=True)
+class Match:
+    start: int
+    end: int
+    category: str
+    rule: str
+
+
+# Conservative mode: only values that are explicitly labeled
+CONSERVATIVE_RULES = (
+    Rule("ssn_labeled", SSN, r"\bSSN:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b", re.IGNORECASE),
+    Rule("ssn_social_security_labeled", SSN, r"\bSocial Security:\s*\d{3}[-\s<>]\d{2}[-\s<>]\d{4}\b", re.IGNORECASE),
+    Rule("card_credit_card_labeled", CREDIT_CARD, r"\bCredit Card:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b", re.IGNORECASE),
+    Rule("card_number_labeled", CREDIT_CARD, r"\bCard Number:\s*\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b", re.IGNORECASE),
+    Rule("address_labeled", ADDRESS, r"\bAddress:\s*[^\n]+", re.IGNORECASE),
+    Rule("zip_labeled", ZIP, r"\bZIP:\s*\d{5}(?:-\d{4})?\b", re.IGNORECASE),
+)
+
+# Aggressive mode: unlabeled patterns, tolerant of common OCR errors
+AGGRESSIVE_RULES = (
+    # Handles OCR errors like < > or o instead of -
+    Rule("ssn_ocr_tolerant", SSN, r"\b\d{3}[-\s<>o]\d{2}[-\s<>o]\d{4}\b", re.IGNORECASE),
+    # Handles OCR errors in the last groups
+    Rule("card_ocr_tolerant", CREDIT_CARD, r"\b\d{4}[\s\-]\d{4}[\s\-]\d{3}[A-Za-z0-9][\s\-][A-Za-z0-9]\d{2,3}\b"),
+    Rule("card_4x4", CREDIT_CARD, r"\b\d{4}[\s\-]\d{4}[\s\-]\d{4}[\s\-]\d{4}\b"),
+    Rule("address_street", ADDRESS, r"\b\d{1,4}\s+[A-Za-z]+\s+(?:Street|St|Avenue|Ave|Road|Rd|Drive|Dr|Lane|Ln|Boulevard|Blvd)\b", re.IGNORECASE),
+    # ZIP codes only when the surrounding text says so, plain 5-digit numbers are too common
+    Rule("zip_in_context", ZIP, r"\b\d{5}(?:-\d{4})?\b", context_words=("zip", "postal", "address", "mail")),
+)
+
+
+def _scoped(pattern, flags):
+    """Wrap a pattern so its flags apply to it alone inside the combined expression."""
+    letters = "".join(letter for flag, letter in ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s")) if flags & flag)
+    return f"(?{letters}:{pattern})" if letters else f"(?:{pattern})"
+
+
+_CATEGORY_CLASSES = {
+    sre_parse.CATEGORY_DIGIT: r"\d",
+    sre_parse.CATEGORY_SPACE: r"\s",
+    sre_parse.CATEGORY_WORD: r"\w",
+}
+
+
+def _first_chars(items, flags):
+    """
+    Return the regex class members a parsed pattern can start with, or None if unknown.
+
+    Only the constructs our rules use are understood; anything else (negated
+    classes, optional first items, ...) makes the caller skip the optimization.
+    """
+    for op, arg in items:
+        if op is sre_parse.AT:
+            continue  # \b, ^ and friends consume nothing
+        if op is sre_parse.LITERAL:
+            char = chr(arg)
+            chars = {char, char.lower(), char.upper()} if flags & re.IGNORECASE else {char}
+            return {re.escape(c) for c in chars}
+        if op is sre_parse.IN:
+            members = set()
+            for item_op, item_arg in arg:
+                if item_op is sre_parse.LITERAL:
+                    members |= _first_chars([(item_op, item_arg)], flags)
+                elif item_op is sre_parse.RANGE:
+                    low, high = chr(item_arg[0]), chr(item_arg[1])
+                    members.add(f"{re.escape(low)}-{re.escape(high)}")
+                    if flags & re.IGNORECASE:
+                        members.add(f"{re.escape(low.lower())}-{re.escape(high.lower())}")
+                        members.add(f"{re.escape(low.upper())}-{re.escape(high.upper())}")
+                elif item_op is sre_parse.CATEGORY and item_arg in _CATEGORY_CLASSES:
+                    members.add(_CATEGORY_CLASSES[item_arg])
+                else:
+                    return None
+            return members
+        if op is sre_parse.SUBPATTERN:
+            return _first_chars(arg[-1], flags)
+        if op is sre_parse.BRANCH:
+            members = set()
+            for branch in arg[1]:
+                branch_members = _first_chars(branch, flags)
+                if branch_members is None:
+                    return None
+                members |= branch_members
+            return members
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+            return _first_chars(arg[2], flags)
+        return None
+    return None
+
+
+class RedactionEngine:
+    """
+    Finds and redacts all rule matches in one scan.
+
+    Args:
+        rules: Rules in priority order
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self._rules_by_group = {}
+        alternatives = []
+        first_chars = set()
+        for index, rule in enumerate(self.rules):
+            if re.compile(rule.pattern, rule.flags).groups:
+                raise ValueError(f"Rule {rule.name!r} must not contain capturing groups")
+            group = f"r{index}"
+            self._rules_by_group[group] = rule
+            alternatives.append(f"(?P<{group}>{_scoped(rule.pattern, rule.flags)})")
+            if first_chars is not None:
+                rule_chars = _first_chars(sre_parse.parse(rule.pattern, rule.flags), rule.flags)
+                first_chars = None if rule_chars is None else first_chars | rule_chars
+        combined = "|".join(alternatives)
+        if first_chars:
+            # Case-folded when any rule ignores case, so e.g. the long s still reaches an (?i) "S" rule
+            lookahead = _scoped(f"[{''.join(sorted(first_chars))}]", re.IGNORECASE if any(r.flags & re.IGNORECASE for r in self.rules) else 0)
+            combined = f"(?={lookahead})(?:{combined})"
+        self._regex = re.compile(combined)
+
+    def find(self, text):
+        """Yield the non-overlapping Matches in text, left to right."""
+        for m in self._regex.finditer(text):
+            rule = self._rules_by_group[m.lastgroup]
+            if rule.context_words:
+                context = text[max(0, m.start() - rule.context_window):m.end() + rule.context_window].lower()
+                if not any(word in context for word in rule.context_words):
+                    continue
+            yield Match(m.start(), m.end(), rule.category, rule.name)
+
+    def apply(self, text, matches):
+        """Rewrite text once, replacing each of the given (sorted, non-overlapping) matches by its label."""
+        pieces = []
+        last = 0
+        for match in matches:
+            pieces.append(text[last:match.start])
+            pieces.append(redaction_label(match.category))
+            last = match.end
+        pieces.append(text[last:])
+        return "".join(pieces)
+
+    def redact(self, text):
+        return self.apply(text, self.find(text))
+
+
+def merge_matches(matches, extra):
+    """
+    Add extra matches (e.g. NER entities) to an engine's matches.
+
+    Both lists are sorted; an extra match overlapping one of matches is dropped.
+    """
+    merged = list(matches)
+    if not extra:
+        return merged
+    starts = [match.start for match in merged]
+    for match in extra:
+        index = bisect.bisect_right(starts, match.start)
+        if index and merged[index - 1].end > match.start:
+            continue
+        if index < len(merged) and merged[index].start < match.end:
+            continue
+        merged.insert(index, match)
+        starts.insert(index, match.start)
+    return merged
+
+
+CONSERVATIVE = RedactionEngine(CONSERVATIVE_RULES)
+AGGRESSIVE = RedactionEngine(AGGRESSIVE_RULES)
+
+ENGINES = {
+    "conservative": CONSERVATIVE,
+    "aggressive": AGGRESSIVE,
+}
+
+
+def get_engine(mode="conservative"):
+    """Return the precompiled engine for "conservative" or "aggressive" mode."""
+    return ENGINES[mode]
@@ -0,0 +1,199 @@
+"""
+Structured redaction results.
+
+A RedactionResult keeps what the expensive stages produced for a document,
+the text of every page with its text-layer words and OCR tokens, and turns it
+into Redaction records: page, character span, boxes on the page, category,
+rule and confidence. Switching the mode or toggling categories only re-runs
+the cheap redaction step on that cached data; nothing is rendered or OCR'd
+again. Every (mode, categories) combination is computed once and kept as a
+RedactionView with its own redacted pages and exports.
+"""
+import bisect
+from collections import Counter
+from dataclasses import dataclass
+
+from exporters import ResultExports
+from preview import PagePreview
+from redaction import CATEGORIES, get_engine, merge_matches
+
+# Boxes on the same line closer than this (points) are merged into one
+LINE_TOLERANCE = 1.0
+
+
+@dataclass(frozen=True)
+class Redaction:
+    """
+    One redacted span. It can stand in for a redaction.Match anywhere a match is expected.
+
+    Args:
+        page: 0-based page number
+        start, end: Character span in the page text
+        category, rule: What was found and by which rule
+        confidence: Lowest OCR confidence of the tokens covered, 1.0 for text-layer spans
+        boxes: (x0, y0, x1, y1) rectangles on the PDF page, in points; empty if the span could not be located
+    """
+    page: int
+    start: int
+    end: int
+    category: str
+    rule: str
+    confidence: float = 1.0
+    boxes: tuple = ()
+
+
+def page_tokens(page):
+    """
+    Locate the words of a pipeline page: (start, end, box, confidence) tuples sorted by start.
+
+    Text-layer words come from the render stage ("words"), OCR tokens from
+    the OCR results of each rendered region, mapped from pixels to points.
+    """
+    tokens = []
+    text = page["text"]
+    for segment in page.get("segments", ()):
+        if segment["source"] == "text":
+            cursor = segment["start"]
+            for x0, y0, x1, y1, word, *_ in page.get("words", ()):
+                position = text.find(word, cursor, segment["end"])
+                if position < 0:
+                    continue  # E.g. a word PyMuPDF dehyphenated differently
+                tokens.append((position, position + len(word), (x0, y0, x1, y1), 1.0))
+                cursor = position + len(word)
+        else:
+            region = page["regions"][segment["region"]]
+            scale = 72 / region["dpi"]
+            origin = region["rect"]
+            offset = segment["start"]
+            for box, word, confidence in page["ocr_results"][segment["region"]]:
+                xs = [point[0] for point in box]
+                ys = [point[1] for point in box]
+                rect = (
+                    origin.x0 + min(xs) * scale, origin.y0 + min(ys) * scale,
+                    origin.x0 + max(xs) * scale, origin.y0 + max(ys) * scale,
+                )
+                tokens.append((offset, offset + len(word), rect, confidence))
+                offset += len(word) + 1  # Tokens are joined with a space
+    tokens.sort()
+    return tokens
+
+
+def _merge_lines(boxes):
+    merged = []
+    for box in boxes:
+        last = merged[-1] if merged else None
+        if last and abs(last[1] - box[1]) < LINE_TOLERANCE and abs(last[3] - box[3]) < LINE_TOLERANCE:
+            merged[-1] = (min(last[0], box[0]), last[1], max(last[2], box[2]), last[3])
+        else:
+            merged.append(box)
+    return tuple(merged)
+
+
+def to_redactions(page, matches, tokens):
+    """Turn the matches of one page into Redactions, with boxes and confidence from its tokens."""
+    ends = [token[1] for token in tokens]
+    redactions = []
+    for match in matches:
+        boxes = []
+        confidence = 1.0
+        for index in range(bisect.bisect_right(ends, match.start), len(tokens)):
+            start, end, (x0, y0, x1, y1), token_confidence = tokens[index]
+            if start >= match.end:
+                break
+            lo, hi = max(match.start, start), min(match.end, end)
+            if lo >= hi:
+                continue
+            width = (x1 - x0) / (end - start)  # A partly covered token is cut in proportion to its characters
+            boxes.append((x0 + width * (lo - start), y0, x0 + width * (hi - start), y1))
+            confidence = min(confidence, token_confidence)
+        redactions.append(Redaction(
+            page["page"], match.start, match.end, match.category, match.rule, round(confidence, 4), _merge_lines(boxes),
+        ))
+    return redactions
+
+
+class RedactionView:
+    """
+    The document redacted with one mode and set of categories.
+
+    Attributes:
+        pages: Copies of the pipeline pages with this view's matches and redacted text
+        redactions: All Redactions, in page and text order
+        counts: Counter of redactions per category
+        exports: ResultExports built from these pages on demand
+        preview: PagePreview of these pages, its fragments rendered on demand
+    """
+
+    def __init__(self, pages, page_redactions, pdf_bytes, pdf_output, metrics=None, exports=None):
+        self.pages = []
+        self.redactions = []
+        for page, redactions in zip(pages, page_redactions):
+            redacted = get_engine().apply(page["text"], redactions)  # Labels do not depend on the mode
+            self.pages.append(dict(page, matches=redactions, redacted=redacted))
+            self.redactions.extend(redactions)
+        self.counts = Counter(redaction.category for redaction in self.redactions)
+        self.exports = exports or ResultExports(self.pages, pdf_bytes, pdf_output, metrics)
+        self.preview = PagePreview(self.pages)
+
+    @property
+    def redacted_text(self):
+        return "\n".join(page["redacted"] for page in self.pages)
+
+
+class RedactionResult:
+    """
+    Everything needed to redact a processed document again, in any mode.
+
+    Args:
+        pages: Pipeline pages as they came out of the pipeline, redacted in mode
+        exports: Their ResultExports; its writers are reused for the initial view
+        mode: The mode the pipeline redacted with
+    """
+
+    def __init__(self, pages, exports, mode):
+        self.pages = pages
+        self.pdf_bytes = exports.pdf_bytes
+        self.pdf_output = exports.pdf_output
+        self.metrics = exports.metrics
+        self._tokens = [None] * len(pages)
+        self._found = {}
+        self._views = {}
+        # The pipeline's own matches and exports are the initial view, nothing is redone for it
+        self._found[mode] = [self._to_redactions(i, page["matches"]) for i, page in enumerate(pages)]
+        self._views[(mode, frozenset(CATEGORIES))] = RedactionView(
+            pages, self._found[mode], self.pdf_bytes, self.pdf_output, self.metrics, exports,
+        )
+
+    def _to_redactions(self, index, matches):
+        if self._tokens[index] is None:
+            self._tokens[index] = page_tokens(self.pages[index])
+        return to_redactions(self.pages[index], matches, self._tokens[index])
+
+    @property
+    def page_report(self):
+        return [page["triage"] for page in self.pages]
+
+    @property
+    def original_text(self):
+        return "\n".join(page["text"] for page in self.pages)
+
+    def find(self, mode):
+        """Redactions of every category found in mode, per page; computed once per mode. NER entities are kept."""
+        if mode not in self._found:
+            engine = get_engine(mode)
+            self._found[mode] = [
+                self._to_redactions(i, merge_matches(engine.find(page["text"]), page.get("entities")))
+                for i, page in enumerate(self.pages)
+            ]
+        return self._found[mode]
+
+    def view(self, mode, categories=CATEGORIES):
+        """Return the RedactionView for a mode, keeping only the given categories."""
+        key = (mode, frozenset(categories))
+        if key not in self._views:
+            page_redactions = [
+                [redaction for redaction in redactions if redaction.category in key[1]]
+                for redactions in self.find(mode)
+            ]
+            self._views[key] = RedactionView(self.pages, page_redactions, self.pdf_bytes, self.pdf_output, self.metrics)
+        return self._views[key]
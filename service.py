@@ -0,0 +1,353 @@
+"""
+Local HTTP redaction service for other tools.
+
+A long-lived process that keeps the OCR reader and worker pool warm and runs
+the same pipeline as the Streamlit app (pipeline.redact_pdf) for each
+request. The pages of all concurrent requests are OCR'd through one
+ocr_engine.OCRBatcher, so regions from several documents share batches; the
+OCR cache and the near-duplicate index are shared too.
+
+Backpressure: at most MAX_ACTIVE documents are processed at once and up to
+MAX_WAITING more wait for a slot. Beyond that, or while the batcher's queue
+is full, requests are refused straight away with 503 and a Retry-After
+header rather than piling up. Each document's memory and CPU cost is
+estimated and reserved from the process's budgets (see admission) before it
+takes a slot: under policy "queue" it waits for room, under "reject" it is
+refused with 503, and one that could never fit is refused with 413. A body
+that is not a readable PDF is refused with 400.
+
+    POST /redact     the PDF as the request body. Query parameters:
+                     mode (conservative, aggressive), format (json, pdf, docx),
+                     pdf_output (retypeset, in_place), ner (off, distilled, large;
+                     default REDACTOR_NER)
+    GET  /health     liveness, and whether the models are loaded
+    GET  /stats      admission, batching, cache and dedup counters as JSON
+    GET  /metrics    the metrics registry in Prometheus text format
+
+Only the redacted text and the positions of what was redacted are returned,
+never the sensitive values themselves.
+
+    REDACTOR_SERVICE_HOST         interface to listen on (default 127.0.0.1)
+    REDACTOR_SERVICE_PORT         port (default 8765)
+    REDACTOR_SERVICE_MAX_ACTIVE   documents processed at once (default: OCR workers, at least 2)
+    REDACTOR_SERVICE_MAX_WAITING  documents waiting for a slot before 503 (default 16)
+    REDACTOR_SERVICE_MAX_MB       largest request body accepted (default 100)
+
+    python service.py --port 8765 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from admission import AdmissionRejected, InvalidDocument, estimate, get_admission
+from dedup import get_default_index
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_IN_PLACE, PDF_OUTPUT_RETYPESET
+from metrics import REGISTRY, PipelineMetrics, publish, publish_failure
+from ner import NER_MODELS, NER_OFF
+from ocr_cache import get_default_cache
+from ocr_engine import (
+    BATCH_MAX_LATENCY, BATCH_MAX_PENDING, BATCH_MAX_REGIONS, OCRBatcher, default_workers, warm_up,
+)
+from pipeline import redact_pdf
+from redaction import ENGINES
+
+SERVICE_HOST = os.environ.get("REDACTOR_SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("REDACTOR_SERVICE_PORT", "8765"))
+MAX_ACTIVE = int(os.environ.get("REDACTOR_SERVICE_MAX_ACTIVE", "0")) or max(2, default_workers())
+MAX_WAITING = int(os.environ.get("REDACTOR_SERVICE_MAX_WAITING", "16"))
+MAX_BODY_BYTES = int(float(os.environ.get("REDACTOR_SERVICE_MAX_MB", "100")) * 1024 * 1024)
+
+# Seconds a refused client is told to wait before trying again
+RETRY_AFTER_SECONDS = 1
+
+FORMAT_JSON = "json"
+CONTENT_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_PDF: "application/pdf",
+    FORMAT_DOCX: "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+class ServiceBusy(Exception):
+    """Raised by RedactionService.redact when no more documents can be accepted right now."""
+
+
+class RedactionService:
+    """
+    Warm models, shared OCR batches and admission control for concurrent documents.
+
+    Args:
+        workers: OCR processes behind the batcher
+        max_active: Documents processed at once
+        max_waiting: Documents waiting for a slot before ServiceBusy is raised
+        batcher: ocr_engine.OCRBatcher, by default one for workers
+        use_cache: Use the process-wide OCR cache and near-duplicate index
+        admission: admission.AdmissionController, by default the process-wide one
+    """
+
+    def __init__(self, workers=None, max_active=MAX_ACTIVE, max_waiting=MAX_WAITING, batcher=None, use_cache=True,
+                 admission=None):
+        self.workers = workers or default_workers()
+        self.admission = admission or get_admission()
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.batcher = batcher or OCRBatcher(self.workers)
+        self.cache = get_default_cache() if use_cache else None
+        self.dedup = get_default_index() if use_cache else None
+        self.active = 0
+        self.waiting = 0
+        self.counts = Counter()  # accepted, rejected, too_large, done, empty, failed
+        self.warm = False
+        self._slots = threading.Semaphore(max_active)
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        """Load the reader and start the OCR pool now instead of on the first request."""
+        warm_up(self.workers, background=False)
+        self.warm = True
+
+    @contextmanager
+    def _admit(self, cost):
+        with self._lock:
+            if (self.active + self.waiting >= self.max_active + self.max_waiting
+                    or self.batcher.pending_regions >= self.batcher.max_pending):
+                self.counts["rejected"] += 1
+                raise ServiceBusy(f"{self.active} documents in progress and {self.waiting} waiting")
+            try:
+                self.admission.check(cost)
+            except AdmissionRejected:
+                self.counts["too_large"] += 1
+                raise
+            self.counts["accepted"] += 1
+            self.waiting += 1
+        try:
+            self.admission.reserve(cost)
+        except AdmissionRejected as e:
+            with self._lock:
+                self.waiting -= 1
+                self.counts["accepted"] -= 1
+                self.counts["rejected"] += 1
+            raise ServiceBusy(str(e)) from e
+        self._slots.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._slots.release()
+            self.admission.release(cost)
+
+    def redact(self, pdf_bytes, mode="conservative", export_format=None, pdf_output=PDF_OUTPUT_RETYPESET,
+               ner_model=None):
+        """
+        Redact one PDF. Raises ServiceBusy when it cannot be accepted right now,
+        admission.AdmissionRejected when it is too large to be accepted at all,
+        admission.InvalidDocument when it is not a readable PDF.
+
+        Args:
+            pdf_bytes: The PDF document
+            mode: "conservative" or "aggressive"
+            export_format: FORMAT_PDF or FORMAT_DOCX to build alongside, or None
+            pdf_output, ner_model: See pipeline.redact_pdf
+
+        Returns:
+            (pages, exports, metrics): as from pipeline.redact_pdf, and the document's PipelineMetrics
+        """
+        cost = estimate(pdf_bytes, self.workers)
+        with self._admit(cost):
+            metrics = PipelineMetrics()
+            metrics.estimate = cost
+            try:
+                pages, exports = redact_pdf(
+                    pdf_bytes, mode, pdf_output=pdf_output,
+                    export_formats=(export_format,) if export_format else (),
+                    cache=self.cache, metrics=metrics, ner_model=ner_model, dedup=self.dedup, ocr=self.batcher,
+                )
+            except Exception:
+                with self._lock:
+                    self.counts["failed"] += 1
+                publish_failure()
+                raise
+            publish(metrics)
+            with self._lock:
+                self.counts["done" if exports is not None else "empty"] += 1
+            return pages, exports, metrics
+
+    def stats(self):
+        with self._lock:
+            admission = dict(self.counts, active=self.active, waiting=self.waiting,
+                             max_active=self.max_active, max_waiting=self.max_waiting)
+        return {
+            "warm": self.warm,
+            "workers": self.workers,
+            "admission": admission,
+            "budgets": self.admission.stats(),
+            "batcher": self.batcher.stats(),
+            "cache": self.cache.stats() if self.cache else None,
+            "dedup": self.dedup.stats() if self.dedup else None,
+        }
+
+
+def page_summary(page):
+    """What the JSON response says about one page: its redacted text and where the redactions are."""
+    return {
+        "page": page["page"],
+        "kind": page["triage"]["kind"],
+        "redacted": page["redacted"],
+        "matches": [
+            {"start": match.start, "end": match.end, "category": match.category, "rule": match.rule}
+            for match in page["matches"]
+        ],
+    }
+
+
+class RedactionHandler(BaseHTTPRequestHandler):
+    """HTTP front end of the RedactionService set on the server as server.service."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._send(status, {"error": message}, headers=headers)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send(200, {"status": "ok", "warm": service.warm})
+        elif path == "/stats":
+            self._send(200, service.stats())
+        elif path == "/metrics":
+            self._send(200, REGISTRY.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._error(404, f"unknown path {path}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/redact":
+            self._error(404, f"unknown path {url.path}")
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            self.close_connection = True
+            self._error(411, "send the PDF as the request body, with a Content-Length")
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True  # The body is not read
+            self._error(413, f"documents are limited to {MAX_BODY_BYTES // (1024 * 1024)} MB")
+            return
+        pdf_bytes = self.rfile.read(length)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        mode = params.get("mode", "conservative")
+        export_format = params.get("format", FORMAT_JSON)
+        pdf_output = params.get("pdf_output", PDF_OUTPUT_RETYPESET)
+        if mode not in ENGINES:
+            self._error(400, f"mode must be one of {', '.join(ENGINES)}")
+            return
+        if export_format not in CONTENT_TYPES:
+            self._error(400, f"format must be one of {', '.join(CONTENT_TYPES)}")
+            return
+        if pdf_output not in (PDF_OUTPUT_RETYPESET, PDF_OUTPUT_IN_PLACE):
+            self._error(400, f"pdf_output must be {PDF_OUTPUT_RETYPESET} or {PDF_OUTPUT_IN_PLACE}")
+            return
+        # Only the named models: a free-form value would have the server fetch and load any model or path
+        ner_model = params.get("ner")
+        if ner_model is not None and ner_model not in (NER_OFF, *NER_MODELS):
+            self._error(400, f"ner must be one of {', '.join((NER_OFF, *NER_MODELS))}")
+            return
+
+        try:
+            pages, exports, metrics = self.server.service.redact(
+                pdf_bytes, mode, None if export_format == FORMAT_JSON else export_format, pdf_output,
+                ner_model,
+            )
+        except ServiceBusy as e:
+            self._error(503, str(e), {"Retry-After": str(RETRY_AFTER_SECONDS)})
+            return
+        except AdmissionRejected as e:
+            self._error(413, str(e))
+            return
+        except InvalidDocument as e:
+            self._error(400, str(e))
+            return
+        except Exception as e:
+            self._error(500, f"{type(e).__name__}: {e}")
+            return
+        if exports is None:
+            self._error(422, "no text could be extracted from the document")
+        elif export_format == FORMAT_JSON:
+            self._send(200, {
+                "pages": [page_summary(page) for page in pages],
+                "redactions_by_category": dict(Counter(match.category for page in pages for match in page["matches"])),
+                "metrics": metrics.snapshot(),
+            })
+        else:
+            self._send(200, exports.get(export_format), CONTENT_TYPES[export_format])
+
+    def log_message(self, format, *args):
+        pass  # One line per request is noise for a local service; see /stats and /metrics
+
+
+def make_server(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    """A threading HTTP server for the service; port 0 picks a free port (see server.server_port)."""
+    server = ThreadingHTTPServer((host, port), RedactionHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the redactor over HTTP with warm models.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="OCR worker processes (default: REDACTOR_OCR_WORKERS or CPU-based)")
+    parser.add_argument("--max-active", type=int, default=MAX_ACTIVE, help="Documents processed at once")
+    parser.add_argument("--max-waiting", type=int, default=MAX_WAITING, help="Documents waiting for a slot before 503")
+    parser.add_argument("--batch-regions", type=int, default=BATCH_MAX_REGIONS, help="Regions per shared OCR batch")
+    parser.add_argument("--batch-latency-ms", type=float, default=BATCH_MAX_LATENCY * 1000,
+                        help="Longest a region waits for its OCR batch to fill")
+    parser.add_argument("--max-pending", type=int, default=BATCH_MAX_PENDING,
+                        help="Regions waiting for OCR before new requests are refused")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the OCR result cache nor reuse near-duplicate regions")
+    args = parser.parse_args(argv)
+
+    workers = args.workers or default_workers()
+    batcher = OCRBatcher(workers, args.batch_regions, args.batch_latency_ms / 1000, args.max_pending)
+    service = RedactionService(workers, args.max_active, args.max_waiting, batcher, use_cache=not args.no_cache)
+    print("Loading OCR models...", file=sys.stderr)
+    service.warm_up()
+    server = make_server(service, args.host, args.port)
+    print(f"Listening on http://{args.host}:{server.server_port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""
+Large-document mode: spooled uploads, page-range shards and resumable checkpoints.
+
+A large upload is copied to SPOOL_DIR in fixed-size chunks and from then on
+opened by path, so MuPDF reads pages from the file as they are needed
+instead of the pipeline holding the whole document as bytes. The page range
+is cut into shards of SHARD_PAGES pages; each shard runs through the
+pipeline on its own and its finished pages are checkpointed to disk. A
+journal next to the checkpoints records every finished shard, so when
+processing is interrupted (a crash, a restart, a cancelled job) the same
+document picks up again after the last finished shard instead of OCR'ing
+everything once more. At the end the shards are merged from their
+checkpoints, in page order.
+
+Spooled files are named after their SHA-256, so uploading the same document
+again finds both the file and its checkpoints. Two jobs for the same document
+would share those checkpoints, so a run holds its checkpoint directory's lock
+from start to finish and a second run of the document waits for the first
+(a spool directory is meant for one server process). Both hold unredacted text:
+the spool directory is created 0o700 and must belong to this user (a
+directory someone else planted at the default path is refused), files in it
+are created 0o600, and checkpoints are JSON, never unpickled.
+
+    REDACTOR_SPOOL_DIR          where uploads and checkpoints are kept (default: <tempdir>/redactor-spool)
+    REDACTOR_LARGE_DOCUMENT_MB  uploads at least this large use large-document mode (default 20)
+    REDACTOR_SHARD_PAGES        pages per shard (default 25)
+"""
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import weakref
+from dataclasses import asdict
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from exporters import FORMAT_DOCX, FORMAT_PDF, PDF_OUTPUT_RETYPESET, ResultExports
+from metrics import PipelineMetrics
+from ner import NER_MODEL
+from ocr_engine import DEFAULT_BATCH_SIZE, engine_version
+from pipeline import run_pipeline
+from rasterize import RENDER_SETTINGS
+from redaction import Match, get_engine
+from triage import open_pdf
+
+SPOOL_DIR = os.environ.get("REDACTOR_SPOOL_DIR") or os.path.join(tempfile.gettempdir(), "redactor-spool")
+LARGE_DOCUMENT_BYTES = int(float(os.environ.get("REDACTOR_LARGE_DOCUMENT_MB", "20")) * 1024 * 1024)
+SHARD_PAGES = int(os.environ.get("REDACTOR_SHARD_PAGES", "25"))
+
+# Uploads are copied this many bytes at a time
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# Spooled files and checkpoints untouched for this long are removed by spool_upload()
+SPOOL_TTL_SECONDS = 24 * 3600
+
+JOURNAL_FILE = "journal.jsonl"
+# Written to the journal's first line; journals of another format are discarded
+CHECKPOINT_FORMAT = "json"
+
+
+def is_large(size):
+    """True when a document of size bytes should use large-document mode."""
+    return size >= LARGE_DOCUMENT_BYTES
+
+
+def _private_dir(directory):
+    """Create a directory only this user can enter, or check that an existing one is such a directory."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"{directory} is not a directory")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} belongs to another user; set REDACTOR_SPOOL_DIR to a private directory")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _write_private(path, data):
+    """Write bytes to path atomically, in a file created 0o600, and sync it to disk."""
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _to_json(value):
+    """The JSON form of what pages hold besides JSON types: rects, matches and NumPy numbers."""
+    if isinstance(value, fitz.Rect):
+        return {"__rect__": [value.x0, value.y0, value.x1, value.y1]}
+    if isinstance(value, Match):
+        return {"__match__": asdict(value)}
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} cannot be checkpointed")
+
+
+def _from_json(value):
+    if "__rect__" in value:
+        return fitz.Rect(value["__rect__"])
+    if "__match__" in value:
+        return Match(**value["__match__"])
+    return value
+
+
+def prune_spool(directory=SPOOL_DIR, ttl=SPOOL_TTL_SECONDS):
+    """Remove spooled files and checkpoint directories that have not been touched for ttl seconds."""
+    if not os.path.isdir(directory):
+        return
+    cutoff = time.time() - ttl
+    for entry in os.scandir(directory):
+        if entry.stat().st_mtime < cutoff:
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+
+
+def spool_upload(fileobj, directory=SPOOL_DIR):
+    """
+    Copy an uploaded file to the spool directory, chunk by chunk.
+
+    Args:
+        fileobj: Binary file object, read from its current position
+        directory: Spool directory
+
+    Returns:
+        The path of the spooled PDF, named after its SHA-256
+    """
+    _private_dir(directory)
+    prune_spool(directory)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: fileobj.read(SPOOL_CHUNK_BYTES), b""):
+                digest.update(chunk)
+                f.write(chunk)
+        path = os.path.join(directory, digest.hexdigest() + ".pdf")
+        os.replace(tmp_path, path)  # An identical earlier upload is simply replaced
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+def shard_ranges(page_count, shard_pages=SHARD_PAGES):
+    """Cut page_count pages into (start, stop) ranges of at most shard_pages pages."""
+    return [(start, min(start + shard_pages, page_count)) for start in range(0, page_count, shard_pages)]
+
+
+class ShardJournal:
+    """
+    Checkpoints of the finished shards of one document, and the journal that lists them.
+
+    The first journal line holds the settings the checkpoints were made with;
+    if they differ from the current ones, the old checkpoints are discarded.
+    Checkpoints are JSON; tuples in the pages come back as lists.
+    A checkpoint file is complete before its journal line is written, so a
+    shard is either journaled and readable or it is done again.
+
+    Args:
+        directory: Checkpoint directory of the document
+        settings: JSON-serializable settings that affect the pages produced
+    """
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        self.settings = settings = json.loads(json.dumps(settings))  # As it reads back from the journal
+        self.done = {}  # Shard index -> journal entry
+        self._path = os.path.join(directory, JOURNAL_FILE)
+        if self._read() != settings:
+            self.clear()
+        if not os.path.exists(self._path):
+            _private_dir(directory)
+            self._append({"settings": settings, "format": CHECKPOINT_FORMAT})
+
+    def _read(self):
+        """Load the journal and return the settings it was written with, or None."""
+        try:
+            with open(self._path) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break  # A line cut short by a crash, and whatever follows it
+        if not entries or "settings" not in entries[0] or entries[0].get("format") != CHECKPOINT_FORMAT:
+            return None
+        for entry in entries[1:]:
+            if os.path.exists(os.path.join(self.directory, entry["file"])):
+                self.done[entry["shard"]] = entry
+        return entries[0]["settings"]
+
+    def _append(self, entry):
+        with open(os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, shard, page_range, pages):
+        """Checkpoint the pages of a finished shard, then journal it."""
+        name = f"shard-{shard:05d}.json"
+        _write_private(os.path.join(self.directory, name), json.dumps(pages, default=_to_json).encode("utf-8"))
+        entry = {"shard": shard, "start": page_range[0], "stop": page_range[1], "pages": len(pages), "file": name}
+        self._append(entry)
+        self.done[shard] = entry
+
+    def load(self, shard):
+        """The pages checkpointed for a finished shard."""
+        with open(os.path.join(self.directory, self.done[shard]["file"]), "rb") as f:
+            return json.load(f, object_hook=_from_json)
+
+    def clear(self):
+        self.done = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def checkpoint_dir(path):
+    """Default checkpoint directory of a document: next to it, named after it."""
+    return os.path.splitext(path)[0] + ".shards"
+
+
+_checkpoint_locks = weakref.WeakValueDictionary()  # Checkpoint directory -> lock, while a run holds it
+_checkpoint_locks_lock = threading.Lock()
+
+
+def checkpoint_lock(directory):
+    """The lock a run of a document holds on its checkpoint directory, shared by every thread of the process."""
+    key = os.path.normcase(os.path.realpath(directory))
+    with _checkpoint_locks_lock:
+        lock = _checkpoint_locks.get(key)
+        if lock is None:
+            lock = _checkpoint_locks[key] = threading.Lock()
+        return lock
+
+
+def iter_redact_large(path, mode="conservative", workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                      pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), cache=None,
+                      metrics=None, ner_model=None, shard_pages=SHARD_PAGES, checkpoints=None, keep_checkpoints=False,
+                      dedup=None):
+    """
+    Large-document pipeline.iter_redact_pdf: the document is read from path and processed shard by shard.
+
+    Yields each page as it is done, including the pages of shards restored
+    from checkpoints, and returns (pages, exports) like iter_redact_pdf. The
+    exports are built from the merged pages, the original PDF is read from
+    path when the in-place PDF is made, so the file must outlive the result.
+
+    Args:
+        path: The PDF file, e.g. from spool_upload()
+        shard_pages: Pages per shard
+        checkpoints: Checkpoint directory, defaults to checkpoint_dir(path)
+        keep_checkpoints: Keep the checkpoints once the document is done
+        (others): See pipeline.redact_pdf
+    """
+    metrics = metrics or PipelineMetrics()
+    ner_model = ner_model or NER_MODEL
+    with open_pdf(path) as doc:
+        page_count = doc.page_count
+    metrics.total_pages = page_count
+    ranges = shard_ranges(page_count, shard_pages)
+    checkpoints = checkpoints or checkpoint_dir(path)
+    # Held until the shards are merged: another run of the document would clear or rewrite the checkpoints
+    with checkpoint_lock(checkpoints):
+        journal = ShardJournal(checkpoints, {
+            "mode": mode,
+            "ner_model": ner_model,
+            "engine": engine_version(),
+            "render": RENDER_SETTINGS,
+            "shards": ranges,
+        })
+        engine = get_engine(mode)
+        for shard, page_range in enumerate(ranges):
+            if shard in journal.done:
+                for page in journal.load(shard):  # Finished before the interruption
+                    if metrics.on_page is not None:
+                        metrics.on_page(page, metrics)
+                    yield page
+                continue
+            shard_pages_done = []
+            for page in run_pipeline(
+                path, engine, workers=workers, batch_size=batch_size, cache=cache, metrics=metrics,
+                ner_model=ner_model, page_range=page_range, dedup=dedup,
+            ):
+                shard_pages_done.append(page)
+                if metrics.on_page is not None:
+                    metrics.on_page(page, metrics)
+                yield page
+            journal.record(shard, page_range, shard_pages_done)
+
+        # Merge the shards in page order, from their checkpoints
+        pages = [page for shard in range(len(ranges)) for page in journal.load(shard)]
+        metrics.total_pages = page_count  # Each shard's render stage set it again
+        if not keep_checkpoints:
+            journal.clear()
+    metrics.finish()
+    if not any(page["text"].strip() for page in pages):
+        return pages, None
+
+    exports = ResultExports(pages, path, pdf_output, metrics)
+    exports.build(export_formats)
+    return pages, exports
+
+
+def redact_large(path, mode="conservative", workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                 pdf_output=PDF_OUTPUT_RETYPESET, export_formats=(FORMAT_PDF, FORMAT_DOCX), cache=None,
+                 metrics=None, ner_model=None, shard_pages=SHARD_PAGES, checkpoints=None, keep_checkpoints=False,
+                 dedup=None):
+    """Run a PDF file through iter_redact_large to the end and return (pages, exports), like pipeline.redact_pdf."""
+    steps = iter_redact_large(
+        path, mode, workers, batch_size, pdf_output, export_formats, cache, metrics, ner_model,
+        shard_pages, checkpoints, keep_checkpoints, dedup,
+    )
+    try:
+        while True:
+            next(steps)
+    except StopIteration as done:
+        return done.value
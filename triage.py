@@ -0,0 +1,122 @@
+"""
+Per-page triage for PDF documents.
+
+Born-digital pages already carry a text layer that PyMuPDF can return
+directly, so only pages that actually contain pixels with text in them
+need to go through OCR. Every page is sorted into one of four kinds:
+
+- text:  the embedded text layer covers the page, no OCR needed
+- image: no usable text layer (scans, outlined fonts), OCR the whole page
+- mixed: a text layer plus image regions that are not covered by it,
+         only those regions are OCR'd
+- blank: nothing on the page, skipped entirely
+"""
+import os
+
+import fitz  # PyMuPDF
+
+PAGE_TEXT = "text"
+PAGE_IMAGE = "image"
+PAGE_MIXED = "mixed"
+PAGE_BLANK = "blank"
+
+# A text layer with fewer characters than this is treated as absent
+MIN_TEXT_CHARS = 20
+
+# Images smaller than this fraction of the page (logos, bullets, rules) are ignored
+MIN_IMAGE_AREA_RATIO = 0.02
+
+# An image region with at least this many text-layer words on top of it, whose
+# boxes cover at least MIN_WORD_COVERAGE of its area, is considered covered
+# (e.g. the invisible text layer of a scanner-OCR'd PDF). A few words stamped
+# on a scan (a "received" line, a page number) cover far less, and the scan
+# under them is still OCR'd. Ten lines of 12pt text cover about 0.1 of a page,
+# a full page about 0.4; a sparser layer errs on the side of OCR.
+MIN_WORDS_OVER_IMAGE = 3
+MIN_WORD_COVERAGE = 0.05
+
+
+def _image_regions(page):
+    """Return the on-page rectangles of all non-trivial images."""
+    page_area = abs(page.rect)
+    regions = []
+    for info in page.get_image_info():
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        if rect.is_empty or page_area == 0:
+            continue
+        if abs(rect) / page_area >= MIN_IMAGE_AREA_RATIO:
+            regions.append(rect)
+    return regions
+
+
+def _is_covered(words, rect):
+    """True when the text-layer words on top of an image account for its text, see MIN_WORD_COVERAGE."""
+    count = 0
+    area = 0.0
+    for x0, y0, x1, y1, *_ in words:
+        if fitz.Point((x0 + x1) / 2, (y0 + y1) / 2) in rect:
+            count += 1
+            area += abs(fitz.Rect(x0, y0, x1, y1) & rect)
+    return count >= MIN_WORDS_OVER_IMAGE and area >= MIN_WORD_COVERAGE * abs(rect)
+
+
+def triage_page(page):
+    """
+    Decide how the text of a single page should be obtained.
+
+    Args:
+        page: A loaded fitz.Page
+
+    Returns:
+        dict with the page number, its kind (one of PAGE_TEXT, PAGE_IMAGE,
+        PAGE_MIXED, PAGE_BLANK), the number of text-layer characters and
+        the list of regions (fitz.Rect) that still need OCR.
+    """
+    text_chars = len(page.get_text("text").strip())
+    images = _image_regions(page)
+
+    if text_chars < MIN_TEXT_CHARS:
+        # No usable text layer. Vector drawings may still be outlined glyphs,
+        # so only a page with neither images nor drawings is really blank.
+        if images or page.get_drawings():
+            kind, regions = PAGE_IMAGE, [page.rect]
+        elif text_chars:
+            kind, regions = PAGE_TEXT, []
+        else:
+            kind, regions = PAGE_BLANK, []
+    else:
+        words = page.get_text("words")
+        regions = [rect for rect in images if not _is_covered(words, rect)]
+        kind = PAGE_MIXED if regions else PAGE_TEXT
+
+    return {
+        "page": page.number,
+        "kind": kind,
+        "text_chars": text_chars,
+        "ocr_regions": regions,
+    }
+
+
+def open_pdf(source):
+    """
+    Open a PDF given as bytes or as a file path.
+
+    A path is opened by MuPDF directly, which reads pages from the file as
+    they are needed instead of holding the whole document in memory.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return fitz.open(source, filetype="pdf")
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def triage_document(doc):
+    """Run triage_page over every page of an open fitz.Document."""
+    return [triage_page(page) for page in doc]
+
+
+def summarize_triage(report):
+    """Count pages per kind, e.g. {'text': 12, 'image': 3, 'mixed': 1, 'blank': 0}."""
+    summary = {PAGE_TEXT: 0, PAGE_IMAGE: 0, PAGE_MIXED: 0, PAGE_BLANK: 0}
+    for entry in report:
+        summary[entry["kind"]] += 1
+    return summary
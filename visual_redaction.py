@@ -0,0 +1,169 @@
+"""
+In-place visual redaction of the original PDF.
+
+Instead of re-typesetting the redacted text into a new document, every
+detected span is mapped back onto the original page and removed there with
+PyMuPDF redaction annotations, which black out the area and delete the text
+and image pixels underneath. Layout, fonts and untouched pages are kept
+exactly as they were.
+
+- Matches that already carry their boxes (results.Redaction) are used as they are.
+- Otherwise spans in the text layer are located through the boxes of the
+  text-layer words they cover (the words are matched to their offsets in the
+  page text in order, so only the occurrence that matched is redacted, not
+  every identical string on the page), and spans in OCR'd regions through the
+  EasyOCR box of every token they cover. Within a partly covered word the
+  covered characters are searched for inside the word's box; a token that is
+  only partly covered is otherwise cut horizontally in proportion to its
+  characters.
+
+The document is written once, straight to a byte buffer, when all pages
+have been seen.
+"""
+import fitz  # PyMuPDF
+
+from triage import open_pdf
+
+REDACTION_FILL = (0, 0, 0)
+# Boxes on the same line closer than this (points) are merged into one
+LINE_TOLERANCE = 1.0
+
+
+def _box_rect(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return fitz.Rect(min(xs), min(ys), max(xs), max(ys))
+
+
+def _ocr_rects(page, segment, start, end):
+    """Page rectangles covering characters start:end of one OCR'd region's text."""
+    region = page["regions"][segment["region"]]
+    region_rect = region["rect"]
+    scale = 72 / region["dpi"]  # Rendered pixels to PDF points
+    offset = 0
+    for box, text, _ in page["ocr_results"][segment["region"]]:
+        token_start, token_end = offset, offset + len(text)
+        offset = token_end + 1  # Tokens are joined with a space
+        lo, hi = max(start, token_start), min(end, token_end)
+        if lo >= hi:
+            continue
+        rect = _box_rect(box)
+        width = rect.width
+        x0 = rect.x0 + width * (lo - token_start) / len(text)
+        x1 = rect.x0 + width * (hi - token_start) / len(text)
+        yield fitz.Rect(
+            region_rect.x0 + x0 * scale,
+            region_rect.y0 + rect.y0 * scale,
+            region_rect.x0 + x1 * scale,
+            region_rect.y0 + rect.y1 * scale,
+        )
+
+
+def _word_spans(page, segment):
+    """The text-layer words of a text segment with their offsets in the page text: (start, end, word, rect)."""
+    text = page["text"]
+    cursor = segment["start"]
+    for x0, y0, x1, y1, word, *_ in page.get("words", ()):
+        position = text.find(word, cursor, segment["end"])
+        if position < 0:
+            continue  # E.g. a word PyMuPDF dehyphenated differently
+        cursor = position + len(word)
+        yield position, cursor, word, fitz.Rect(x0, y0, x1, y1)
+
+
+def _text_rects(pdf_page, page, segment, start, end):
+    """Page rectangles covering characters start:end (page text offsets) of a text-layer segment."""
+    for word_start, word_end, word, rect in _word_spans(page, segment):
+        if word_start >= end:
+            break
+        lo, hi = max(start, word_start), min(end, word_end)
+        if lo >= hi:
+            continue
+        if lo == word_start and hi == word_end:
+            yield rect
+            continue
+        part = word[lo - word_start:hi - word_start]
+        hits = pdf_page.search_for(part, clip=rect)
+        occurrence = word[:lo - word_start].count(part)
+        if occurrence < len(hits):
+            yield hits[occurrence] & rect
+        else:
+            width = rect.width / len(word)
+            yield fitz.Rect(rect.x0 + width * (lo - word_start), rect.y0, rect.x0 + width * (hi - word_start), rect.y1)
+
+
+def _merge_lines(rects):
+    merged = []
+    for rect in rects:
+        last = merged[-1] if merged else None
+        if last and abs(last.y0 - rect.y0) < LINE_TOLERANCE and abs(last.y1 - rect.y1) < LINE_TOLERANCE:
+            merged[-1] = last | rect
+        else:
+            merged.append(rect)
+    return merged
+
+
+def match_rects(pdf_page, page, match):
+    """
+    Locate one redaction.Match of a pipeline page on the original PDF page.
+
+    Returns:
+        List of fitz.Rect, empty if the span could not be located
+    """
+    rects = []
+    for segment in page["segments"]:
+        lo, hi = max(match.start, segment["start"]), min(match.end, segment["end"])
+        if lo >= hi:
+            continue
+        if segment["source"] == "text":
+            located = _merge_lines(_text_rects(pdf_page, page, segment, lo, hi))
+            if not located and page["text"][lo:hi].strip():
+                # No word of the span was found, e.g. dehyphenated: every occurrence rather than none
+                for line in page["text"][lo:hi].split("\n"):
+                    if line.strip():
+                        located.extend(pdf_page.search_for(line.strip()))
+            rects.extend(located)
+        else:
+            rects.extend(_ocr_rects(page, segment, lo - segment["start"], hi - segment["start"]))
+    return rects
+
+
+class VisualRedactor:
+    """
+    Applies the matches of each pipeline page to the original PDF.
+
+    Args:
+        pdf_bytes: The original document, as bytes or a file path
+        fill: RGB fill of the redaction boxes, components in 0..1
+    """
+
+    def __init__(self, pdf_bytes, fill=REDACTION_FILL):
+        self.doc = open_pdf(pdf_bytes)
+        self.fill = fill
+        self.pages_redacted = 0
+        self.unlocated = 0  # Matches that could not be mapped back onto the page
+
+    def write_page(self, page):
+        if not page.get("matches"):
+            return  # Untouched pages are written out as they are
+        pdf_page = self.doc[page["page"]]
+        annotated = False
+        for match in page["matches"]:
+            boxes = getattr(match, "boxes", None)
+            rects = [fitz.Rect(box) for box in boxes] if boxes else match_rects(pdf_page, page, match)
+            if not rects:
+                self.unlocated += 1
+            for rect in rects:
+                pdf_page.add_redact_annot(rect, fill=self.fill)
+                annotated = True
+        if annotated:
+            pdf_page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_PIXELS)
+            self.pages_redacted += 1
+
+    def to_bytes(self):
+        """Write the redacted document once; garbage collection drops the removed content."""
+        return self.doc.tobytes(garbage=1, deflate=True)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())